@@ -0,0 +1,258 @@
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from access_partitions import HISTORY_VIEW
+
+#события сотрудника с промежутком не больше этого - один интервал присутствия; у событий нет
+#направления (вход/выход), поэтому выход - это последнее событие перед паузой длиннее SESSION_GAP
+SESSION_GAP = timedelta(hours=2)
+#сколько новых записей журнала (по log_id) разбирается одной транзакцией
+UPDATE_BATCH = 50000
+
+#Интервалы присутствия хранятся в access_sessions: по строке на интервал сотрудника за день, интервалы
+#не переходят через полночь; итоги дня (первый вход, последний выход) - в access_presence_days.
+#update_sessions разбирает только записи журнала с log_id больше отметки из analytics_watermarks
+#и пересчитывает лишь затронутые дни сотрудников, поэтому отчеты за год читают итоги, а не весь журнал.
+#Удаление записей журнала итоги не меняет - для этого есть rebuild_sessions.
+CREATE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS access_sessions (
+          session_id INTEGER PRIMARY KEY,
+          employee_id INTEGER NOT NULL,
+          day TEXT NOT NULL,
+          start_time TEXT NOT NULL,
+          end_time TEXT NOT NULL,
+          seconds INTEGER NOT NULL,
+          events INTEGER NOT NULL,
+          first_door INTEGER NOT NULL,
+          last_door INTEGER NOT NULL,
+          FOREIGN KEY (employee_id) REFERENCES employees(employee_id) ON DELETE CASCADE
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_access_sessions_employee ON access_sessions(employee_id, day)",
+    "CREATE INDEX IF NOT EXISTS idx_access_sessions_end_time ON access_sessions(end_time)",
+    #итоги дня сотрудника; первичный ключ (day, employee_id): отчет за период - чтение одного диапазона
+    '''CREATE TABLE IF NOT EXISTS access_presence_days (
+          day TEXT NOT NULL,
+          employee_id INTEGER NOT NULL,
+          first_in TEXT NOT NULL,
+          last_out TEXT NOT NULL,
+          sessions INTEGER NOT NULL,
+          events INTEGER NOT NULL,
+          seconds INTEGER NOT NULL,
+          PRIMARY KEY (day, employee_id),
+          FOREIGN KEY (employee_id) REFERENCES employees(employee_id) ON DELETE CASCADE
+    ) WITHOUT ROWID''',
+    "CREATE INDEX IF NOT EXISTS idx_access_presence_days_employee ON access_presence_days(employee_id, day)",
+    '''CREATE TABLE IF NOT EXISTS analytics_watermarks (
+          name TEXT PRIMARY KEY,
+          last_id INTEGER NOT NULL
+    )''',
+]
+
+_WATERMARK = 'access_sessions'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def create_tables(cursor):
+    for sql in CREATE_TABLES:
+        cursor.execute(sql)
+
+
+def normalize_timestamp(value):
+    """Отметка журнала -> 'ГГГГ-ММ-ДД ЧЧ:ММ:СС'; None, если это не дата
+
+    Старые записи и записи не из access_ingest.py могут быть короче ('ГГГГ-ММ-ДД ЧЧ:ММ', 'ГГГГ-ММ-ДД')
+    или с 'T' и долями секунды - разбор интервалов рассчитан только на полный формат.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    #обычный случай - значение уже в нужном виде
+    if len(value) == 19 and value[10] == ' ':
+        return value
+    return parsed.strftime(TIMESTAMP_FORMAT)
+
+
+def _seconds(timestamp):
+    #секунды от начала дня без разбора даты: интервалы не переходят через полночь
+    return int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+def merge_sessions(items, gap_seconds=None):
+    """Склеивает интервалы одного дня: items - [(начало, конец, событий, первая дверь, последняя дверь), ...]
+
+    Одиночное событие - интервал из одной точки. Возвращает склеенные интервалы в порядке времени.
+    """
+    gap_seconds = SESSION_GAP.total_seconds() if gap_seconds is None else gap_seconds
+    merged = []
+    for start, end, events, first_door, last_door in sorted(items, key=lambda item: (item[0], item[1])):
+        if merged and _seconds(start) - _seconds(merged[-1][1]) <= gap_seconds:
+            current = merged[-1]
+            if end >= current[1]:
+                current[1], current[4] = end, last_door
+            current[2] += events
+        else:
+            merged.append([start, end, events, first_door, last_door])
+    return merged
+
+
+def get_watermark(conn):
+    row = conn.execute("SELECT last_id FROM analytics_watermarks WHERE name = ?", (_WATERMARK,)).fetchone()
+    return row[0] if row else 0
+
+
+def _last_log_id(conn):
+    #AUTOINCREMENT: последний выданный log_id, где бы запись теперь ни лежала (в access_logs или в разделе)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'access_logs'").fetchone()
+    return row[0] if row else 0
+
+
+def _apply_events(conn, events):
+    by_day = {}
+    for employee_id, door_id, timestamp in events:
+        by_day.setdefault((employee_id, timestamp[:10]), []).append((timestamp, timestamp, 1, door_id, door_id))
+    removed, added, days = [], [], []
+    for (employee_id, day), items in by_day.items():
+        existing = conn.execute('''
+            SELECT session_id, start_time, end_time, events, first_door, last_door
+            FROM access_sessions WHERE employee_id = ? AND day = ?
+        ''', (employee_id, day)).fetchall()
+        removed += [(row[0],) for row in existing]
+        sessions = [(employee_id, day, start, end, _seconds(end) - _seconds(start), count, first_door, last_door)
+                    for start, end, count, first_door, last_door in merge_sessions(items + [row[1:] for row in existing])]
+        added += sessions
+        days.append((day, employee_id, sessions[0][2], max(session[3] for session in sessions), len(sessions),
+                     sum(session[5] for session in sessions), sum(session[4] for session in sessions)))
+    conn.executemany("DELETE FROM access_sessions WHERE session_id = ?", removed)
+    conn.executemany('''
+        INSERT INTO access_sessions (employee_id, day, start_time, end_time, seconds, events, first_door, last_door)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', added)
+    conn.executemany('''
+        INSERT OR REPLACE INTO access_presence_days (day, employee_id, first_in, last_out, sessions, events, seconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', days)
+
+
+def update_sessions(conn, batch=UPDATE_BATCH):
+    """Добавляет в access_sessions записи журнала, появившиеся после отметки
+
+    Возвращает (разобрано записей, пропущено записей с неразборчивым временем). Каждая порция log_id
+    (watermark, watermark + batch] разбирается и сдвигает отметку в одной транзакции; пропущенные записи
+    в итоги не попадают и повторно не разбираются.
+    """
+    processed = skipped = 0
+    last_id = _last_log_id(conn)
+    watermark = get_watermark(conn)
+    while watermark < last_id:
+        upper = min(watermark + batch, last_id)
+        try:
+            #условие по log_id уходит в каждый раздел представления истории и идет по первичному ключу
+            rows = conn.execute(f'''
+                SELECT employee_id, door_id, timestamp FROM {HISTORY_VIEW}
+                WHERE log_id > ? AND log_id <= ?
+            ''', (watermark, upper)).fetchall()
+            events = []
+            for employee_id, door_id, value in rows:
+                timestamp = normalize_timestamp(value)
+                if timestamp is not None:
+                    events.append((employee_id, door_id, timestamp))
+            _apply_events(conn, events)
+            conn.execute('''
+                INSERT INTO analytics_watermarks (name, last_id) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id
+            ''', (_WATERMARK, upper))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        processed += len(events)
+        skipped += len(rows) - len(events)
+        watermark = upper
+    return processed, skipped
+
+
+def rebuild_sessions(conn):
+    """Пересчитывает итоги заново (например, после удаления записей журнала)"""
+    try:
+        conn.execute("DELETE FROM access_sessions")
+        conn.execute("DELETE FROM access_presence_days")
+        conn.execute("DELETE FROM analytics_watermarks WHERE name = ?", (_WATERMARK,))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return update_sessions(conn)
+
+
+def daily_presence(conn, start_day, end_day, employee_id=None):
+    """Присутствие по дням за [start_day, end_day] включительно:
+    [(employee_id, ФИО, день, первый вход, последний выход, интервалов, событий, секунд присутствия), ...]
+    """
+    conditions, params = ["d.day >= ?", "d.day <= ?"], [start_day, end_day]
+    if employee_id is not None:
+        conditions.append("d.employee_id = ?")
+        params.append(employee_id)
+    #порядок первичного ключа: строки идут без сортировки
+    return conn.execute(f'''
+        SELECT d.employee_id, e.name, d.day, d.first_in, d.last_out, d.sessions, d.events, d.seconds
+        FROM access_presence_days d
+        JOIN employees e ON e.employee_id = d.employee_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY d.day, d.employee_id
+    ''', params).fetchall()
+
+
+def presence_intervals(conn, employee_id, start_day, end_day):
+    """Интервалы присутствия сотрудника: [(день, начало, конец, событий, первая дверь, последняя дверь), ...]"""
+    return conn.execute('''
+        SELECT day, start_time, end_time, events, first_door, last_door
+        FROM access_sessions
+        WHERE employee_id = ? AND day >= ? AND day <= ?
+        ORDER BY start_time
+    ''', (employee_id, start_day, end_day)).fetchall()
+
+
+def door_occupancy(conn, now=None):
+    """Сколько сотрудников сейчас у каждой двери: [(door_id, сотрудников, 'ФИО, ФИО'), ...]
+
+    Сотрудник считается присутствующим, если его последнее событие было не раньше SESSION_GAP назад,
+    и относится к двери этого события.
+    """
+    now = now or datetime.now()
+    since = (now - SESSION_GAP).strftime("%Y-%m-%d %H:%M:%S")
+    until = now.strftime("%Y-%m-%d %H:%M:%S")
+    #при MAX() SQLite берет остальные столбцы из строки с максимумом: последний интервал каждого сотрудника
+    return conn.execute('''
+        SELECT last.last_door, COUNT(*), GROUP_CONCAT(e.name, ', ')
+        FROM (SELECT employee_id, last_door, MAX(end_time)
+              FROM access_sessions
+              WHERE end_time >= ? AND end_time <= ?
+              GROUP BY employee_id) last
+        JOIN employees e ON e.employee_id = last.employee_id
+        GROUP BY last.last_door
+        ORDER BY last.last_door
+    ''', (since, until)).fetchall()
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    conn = sqlite3.connect(args[0] if args else DB_FILE)
+    conn.execute("PRAGMA foreign_keys = ON")
+    started = time.perf_counter()
+    processed, skipped = rebuild_sessions(conn) if '--rebuild' in sys.argv else update_sessions(conn)
+    print(f"Разобрано записей журнала: {processed} за {time.perf_counter() - started:.2f} с")
+    if skipped:
+        print(f"Пропущено записей с неразборчивым временем: {skipped}")
+    today = datetime.now().strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    rows = daily_presence(conn, today, today)
+    print(f"Присутствие за {today} ({(time.perf_counter() - started) * 1000:.1f} мс):")
+    for _, name, _, first_in, last_out, sessions, _, seconds in rows:
+        print(f"  {name}: {first_in[11:]} - {last_out[11:]}, интервалов {sessions}, {seconds / 3600:.1f} ч")
+    for door_id, count, names in door_occupancy(conn):
+        print(f"Дверь {door_id}: {count} ({names})")
+    conn.close()
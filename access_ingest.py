@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import queue
+import socketserver
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from data_access import get_pool
+
+#сколько событий пишется одной транзакцией
+BATCH_SIZE = 1000
+#сколько событий может ждать записи; при полном буфере источник блокируется (обратное давление)
+MAX_BUFFER = 50000
+#сколько ждать добора пачки после первого события, с: задержка записи против числа commit
+FLUSH_INTERVAL = 0.2
+#как часто печатается скорость приема, с
+REPORT_INTERVAL = 5.0
+#как часто tail проверяет файл на новые строки, с
+TAIL_POLL_INTERVAL = 0.5
+DEFAULT_PORT = 8765
+#повторы записи пачки, если база занята другим процессом: задержка WRITE_RETRY_DELAY * 2^(попытка-1), с
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.5
+#пачки, которые так и не удалось записать, дописываются сюда (рядом с базой) в формате входных строк.
+#Вернуть их в журнал: переименовать файл (новые сбои допишутся в новый) и загрузить его командой
+#python access_ingest.py tail <файл> --once
+SPOOL_FILE = "access_spool.jsonl"
+#основные коды SQLITE_BUSY и SQLITE_LOCKED: база занята, запись стоит повторить
+_BUSY_CODES = (5, 6)
+
+#событие от контроллера двери - одна строка json: {"employee_id": 1, "door_id": 2, "timestamp": "ГГГГ-ММ-ДД ЧЧ:ММ:СС"}
+#timestamp можно не указывать - тогда берется время приема.
+#Событие с несуществующим employee_id не вставляется (INSERT ... SELECT ... WHERE EXISTS) и считается отклоненным,
+#поэтому одно плохое событие не откатывает всю пачку.
+_INSERT_SQL = '''
+    INSERT INTO access_logs (employee_id, door_id, timestamp)
+    SELECT ?, ?, ?
+    WHERE EXISTS (SELECT 1 FROM employees WHERE employee_id = ?)
+'''
+
+
+def parse_event(line):
+    """Строка json -> (employee_id, door_id, timestamp); ValueError для неразборчивых строк"""
+    try:
+        data = json.loads(line)
+        employee_id = int(data['employee_id'])
+        door_id = int(data['door_id'])
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ValueError(f"Неверное событие доступа: {line.strip()[:100]}") from e
+    timestamp = data.get('timestamp')
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        #формат тот же, что у остальных записей журнала: сортировка и фильтры по строке
+        try:
+            timestamp = datetime.strptime(str(timestamp), "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError as e:
+            raise ValueError(f"Неверное время события: {timestamp}") from e
+    return employee_id, door_id, timestamp
+
+
+def is_busy(error):
+    """Ошибка "база занята/заблокирована" (повтор может пройти), а не ошибка данных или файла"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        #расширенные коды (SQLITE_BUSY_SNAPSHOT и т.п.) несут основной в младшем байте
+        return code & 0xff in _BUSY_CODES
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+#прием событий журнала доступа: источники кладут события в буфер (submit), поток записи забирает
+#их пачками до batch_size и пишет одним executemany в одной транзакции (один commit на пачку).
+#Когда буфер полон, submit ждет: читающий сокет или файл поток останавливается, и TCP сам
+#притормаживает отправителя, а память не растет.
+#Занятую базу запись пачки ждет с повторами; пачка, которую записать не удалось, уходит в spool_file
+#и считается в failed (rejected - только события, отклоненные по содержимому). Ошибка записи передается
+#в on_error(ошибка), ход приема и отклоненные строки - в report(сообщение), если их задал вызывающий.
+class AccessLogIngestor:
+    def __init__(self, db_file, batch_size=BATCH_SIZE, max_buffer=MAX_BUFFER, flush_interval=FLUSH_INTERVAL,
+                 report_interval=REPORT_INTERVAL, spool_file=None, retries=WRITE_RETRIES,
+                 retry_delay=WRITE_RETRY_DELAY, report=None, on_error=None):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.spool_file = spool_file
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.report = report or (lambda message: None)
+        self.on_error = on_error
+        self._buffer = queue.Queue(maxsize=max_buffer)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.received = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.spooled = 0
+        self.retried = 0
+        self.batches = 0
+        self.blocked_seconds = 0.0
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        """Ставит событие (employee_id, door_id, timestamp) в буфер; ждет, пока в буфере нет места"""
+        try:
+            self._buffer.put_nowait(event)
+        except queue.Full:
+            started = time.perf_counter()
+            self._buffer.put(event)
+            with self._lock:
+                self.blocked_seconds += time.perf_counter() - started
+        with self._lock:
+            self.received += 1
+
+    def submit_line(self, line):
+        """Разбирает строку json и ставит событие в буфер; неразборчивая строка считается отклоненной"""
+        if not line.strip():
+            return
+        try:
+            event = parse_event(line)
+        except ValueError as e:
+            with self._lock:
+                self.rejected += 1
+            self.report(str(e))
+            return
+        self.submit(event)
+
+    def stop(self, timeout=30):
+        """Дописывает все, что осталось в буфере, и останавливает поток записи"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def pending(self):
+        return self._buffer.qsize()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        with self._lock:
+            return {
+                'received': self.received,
+                'inserted': self.inserted,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'spooled': self.spooled,
+                'retried': self.retried,
+                'batches': self.batches,
+                'pending': self.pending(),
+                'blocked_seconds': self.blocked_seconds,
+                'events_per_sec': self.inserted / elapsed if elapsed else 0.0,
+            }
+
+    def _next_batch(self):
+        try:
+            batch = [self._buffer.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._buffer.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._buffer.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def write_batch(self, batch):
+        """Пишет пачку одной транзакцией; возвращает число вставленных событий"""
+        conn = get_pool(self.db_file).connection()
+        try:
+            cursor = conn.executemany(_INSERT_SQL, [(employee_id, door_id, timestamp, employee_id)
+                                                    for employee_id, door_id, timestamp in batch])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return cursor.rowcount
+
+    def _write_with_retries(self, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self.write_batch(batch)
+            except sqlite3.OperationalError as e:
+                if attempt == self.retries or not is_busy(e):
+                    raise
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def spool(self, batch):
+        """Дописывает события пачки в spool_file строками json; возвращает число сохраненных"""
+        if self.spool_file is None:
+            return 0
+        with open(self.spool_file, 'a', encoding='utf-8') as f:
+            for employee_id, door_id, timestamp in batch:
+                f.write(json.dumps({'employee_id': employee_id, 'door_id': door_id, 'timestamp': timestamp}) + '\n')
+        return len(batch)
+
+    def _failed(self, batch, error):
+        #пачка не записана: прием продолжается, а события по возможности сохраняются для повторной загрузки
+        try:
+            spooled = self.spool(batch)
+        except OSError as spool_error:
+            spooled = 0
+            error = sqlite3.DatabaseError(f"{error}; не удалось сохранить пачку в {self.spool_file}: {spool_error}")
+        with self._lock:
+            self.failed += len(batch)
+            self.spooled += spooled
+            self.batches += 1
+        if self.on_error is not None:
+            self.on_error(error)
+        else:
+            self.report(f"Ошибка записи журнала доступа ({len(batch)} событий, сохранено {spooled}): {str(error)}")
+
+    def _run(self):
+        last_report = time.perf_counter()
+        last_inserted = 0
+        while not (self._stop.is_set() and self._buffer.empty()):
+            batch = self._next_batch()
+            if batch:
+                try:
+                    inserted = self._write_with_retries(batch)
+                except sqlite3.Error as e:
+                    self._failed(batch, e)
+                else:
+                    with self._lock:
+                        self.inserted += inserted
+                        self.rejected += len(batch) - inserted
+                        self.batches += 1
+            now = time.perf_counter()
+            if self.report_interval and now - last_report >= self.report_interval:
+                rate = (self.inserted - last_inserted) / (now - last_report)
+                self.report(f"Журнал доступа: {rate:,.0f} событий/с, всего {self.inserted}, "
+                            f"отклонено {self.rejected}, не записано {self.failed}, в буфере {self.pending()}")
+                last_report, last_inserted = now, self.inserted
+
+
+#TCP: каждое соединение присылает события построчно (json)
+class _EventHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            self.server.ingestor.submit_line(line.decode('utf-8', errors='replace'))
+
+
+class AccessEventServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ingestor, host='127.0.0.1', port=DEFAULT_PORT):
+        super().__init__((host, port), _EventHandler)
+        self.ingestor = ingestor
+
+
+def tail_file(ingestor, path, from_end=False, follow=True, stop=None):
+    """Читает события из файла построчно и, если follow, ждет дописываемых строк (как tail -f).
+
+    Недописанная последняя строка ждет своего перевода строки. Возвращает число прочитанных строк.
+    """
+    stop = stop or threading.Event()
+    lines = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        if from_end:
+            f.seek(0, os.SEEK_END)
+        partial = ''
+        while not stop.is_set():
+            chunk = f.readline()
+            if not chunk:
+                if not follow:
+                    break
+                stop.wait(TAIL_POLL_INTERVAL)
+                continue
+            partial += chunk
+            if not partial.endswith('\n'):
+                continue
+            ingestor.submit_line(partial)
+            partial = ''
+            lines += 1
+        if partial and not follow:
+            ingestor.submit_line(partial)
+            lines += 1
+    return lines
+
+
+def main():
+    from main import DB_FILE, STORAGE_CONFIG
+    from data_access import configure_pool, load_storage_config, close_all_pools
+    parser = argparse.ArgumentParser(description="Прием событий журнала доступа")
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-buffer', type=int, default=MAX_BUFFER)
+    subparsers = parser.add_subparsers(dest='source', required=True)
+    tcp = subparsers.add_parser('tcp', help="события построчно по TCP")
+    tcp.add_argument('--host', default='127.0.0.1')
+    tcp.add_argument('--port', type=int, default=DEFAULT_PORT)
+    tail = subparsers.add_parser('tail', help="события из дописываемого файла")
+    tail.add_argument('file')
+    tail.add_argument('--from-end', action='store_true', help="пропустить строки, уже записанные в файл")
+    tail.add_argument('--once', action='store_true', help="прочитать файл до конца и завершиться")
+    args = parser.parse_args()
+    spool_file = os.path.join(os.path.dirname(os.path.abspath(args.db)), SPOOL_FILE)
+
+    configure_pool(args.db, *load_storage_config(STORAGE_CONFIG))
+    ingestor = AccessLogIngestor(args.db, batch_size=args.batch_size, max_buffer=args.max_buffer,
+                                 spool_file=spool_file, report=print)
+    ingestor.start()
+    try:
+        if args.source == 'tcp':
+            with AccessEventServer(ingestor, args.host, args.port) as server:
+                print(f"Прием событий доступа на {args.host}:{args.port}")
+                server.serve_forever()
+        else:
+            tail_file(ingestor, args.file, from_end=args.from_end, follow=not args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestor.stop()
+        close_all_pools()
+    stats = ingestor.stats()
+    print(f"Принято {stats['received']}, записано {stats['inserted']}, отклонено {stats['rejected']}, "
+          f"пачек {stats['batches']}, {stats['events_per_sec']:,.0f} событий/с")
+    if stats['failed']:
+        print(f"Не записано из-за ошибок базы {stats['failed']}, сохранено в {spool_file}: {stats['spooled']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+from data_access import get_pool
+from virtual_table import VirtualTable, keyset_query
+
+#сколько последних месяцев (включая текущий) остается в самой таблице access_logs
+HOT_MONTHS = 2
+#разделы старше стольких месяцев сжимаются в архив и удаляются из базы
+ARCHIVE_AFTER_MONTHS = 24
+#папка архивов рядом с файлом базы
+ARCHIVE_DIRECTORY = "access_archive"
+#все записи журнала: access_logs и живые месячные разделы
+HISTORY_VIEW = "access_logs_history"
+TIME_COLUMN = "a.timestamp"
+#триггер change_log на удаление из access_logs (migrations.change_log_triggers)
+DELETE_TRIGGER = "trg_access_logs_log_delete"
+
+#Журнал доступа хранится по месяцам: новые события пишутся в access_logs (триггеры, внешний ключ и прием
+#из access_ingest.py не меняются), а apply_retention переносит прошедшие месяцы в таблицы access_logs_ГГГГ_ММ
+#и сжимает самые старые в архивы. Каталог access_log_partitions хранит для каждого раздела первую и последнюю
+#отметку времени: по ним запросы пропускают разделы вне нужного периода.
+_COLUMNS = "log_id, employee_id, door_id, timestamp"
+
+
+def create_catalog(cursor):
+    """Каталог разделов и представление истории (миграция)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_log_partitions (
+              month TEXT PRIMARY KEY,
+              table_name TEXT NOT NULL,
+              rows INTEGER NOT NULL,
+              first_timestamp TEXT,
+              last_timestamp TEXT,
+              archive_file TEXT
+        )
+    ''')
+    rebuild_history_view(cursor)
+
+
+def partition_table(month):
+    """'2024-05' -> 'access_logs_2024_05'"""
+    return f"access_logs_{month.replace('-', '_')}"
+
+
+def month_bounds(month):
+    """'2024-05' -> ('2024-05-01', '2024-06-01'): границы для timestamp >= ? AND timestamp < ?"""
+    year, number = (int(part) for part in month.split('-'))
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f"{month}-01", f"{year:04d}-{number:02d}-01"
+
+
+def months_ago(now, months):
+    """Месяц 'ГГГГ-ММ', отстоящий от now на months назад"""
+    index = now.year * 12 + now.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def rebuild_history_view(cursor):
+    tables = [row[0] for row in cursor.execute(
+        "SELECT table_name FROM access_log_partitions WHERE archive_file IS NULL ORDER BY month")]
+    selects = [f"SELECT {_COLUMNS} FROM {table}" for table in ["access_logs"] + tables]
+    cursor.execute(f"DROP VIEW IF EXISTS {HISTORY_VIEW}")
+    #условия на timestamp и log_id SQLite переносит внутрь каждой части UNION ALL, и каждая идет по своему индексу
+    cursor.execute(f"CREATE VIEW {HISTORY_VIEW} AS {' UNION ALL '.join(selects)}")
+
+
+def _create_partition(cursor, table):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+              log_id INTEGER PRIMARY KEY,
+              employee_id INTEGER NOT NULL,
+              door_id INTEGER NOT NULL,
+              timestamp TEXT NOT NULL,
+              FOREIGN KEY (employee_id) REFERENCES employees(employee_id) ON DELETE RESTRICT
+        )
+    ''')
+    #те же индексы, что у access_logs: фильтры вкладки работают и по разделам
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table}(timestamp)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_employee_id ON {table}(employee_id, timestamp)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_door_id ON {table}(door_id, timestamp)")
+
+
+def _update_catalog(cursor, month, table, archive_file=None):
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO access_log_partitions (month, table_name, rows, first_timestamp, last_timestamp, archive_file)
+        SELECT ?, ?, COUNT(*), MIN(timestamp), MAX(timestamp), ? FROM {table}
+    ''', (month, table, archive_file))
+
+
+def rotate_partitions(conn, archive_dir, now=None, hot_months=HOT_MONTHS):
+    """Переносит месяцы старше hot_months из access_logs в разделы; возвращает [(месяц, строк), ...]
+
+    Каждый месяц переносится своей транзакцией. Опоздавшие события уже заархивированного месяца
+    возвращают его архив в базу (restore_partition); следующий apply_retention сожмет его снова.
+    """
+    cutoff = month_bounds(months_ago(now or datetime.now(), hot_months - 1))[0]
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 7) FROM access_logs WHERE timestamp < ? ORDER BY 1", (cutoff,))]
+    archived = dict(conn.execute(
+        "SELECT month, archive_file FROM access_log_partitions WHERE archive_file IS NOT NULL").fetchall())
+    moved = []
+    for month in months:
+        if month in archived:
+            restore_partition(conn, month, archive_dir)
+        table = partition_table(month)
+        start, end = month_bounds(month)
+        cursor = conn.cursor()
+        try:
+            _create_partition(cursor, table)
+            cursor.execute(f'''INSERT INTO {table} ({_COLUMNS})
+                               SELECT {_COLUMNS} FROM access_logs WHERE timestamp >= ? AND timestamp < ?''',
+                           (start, end))
+            rows = cursor.rowcount
+            #строки не удаляются, а переезжают в раздел и остаются в представлении истории: без триггера
+            #журнала изменений, иначе каждая дала бы запись в change_log и открытые таблицы перечитали бы их все.
+            #Триггер снимается и возвращается в той же транзакции, другие соединения его отсутствия не увидят
+            trigger = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                     (DELETE_TRIGGER,)).fetchone()
+            if trigger is not None:
+                cursor.execute(f"DROP TRIGGER {DELETE_TRIGGER}")
+            cursor.execute("DELETE FROM access_logs WHERE timestamp >= ? AND timestamp < ?", (start, end))
+            if trigger is not None:
+                cursor.execute(trigger[0])
+            _update_catalog(cursor, month, table)
+            rebuild_history_view(cursor)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        moved.append((month, rows))
+    return moved
+
+
+def archive_partitions(conn, archive_dir, now=None, archive_after_months=ARCHIVE_AFTER_MONTHS):
+    """Сжимает разделы старше archive_after_months в archive_dir и удаляет их из базы
+
+    Возвращает [(месяц, путь к архиву), ...]. Раздел удаляется только после того, как архив записан
+    и в нем столько же строк, сколько в разделе.
+    """
+    cutoff = months_ago(now or datetime.now(), archive_after_months)
+    partitions = conn.execute('''
+        SELECT month, table_name, rows FROM access_log_partitions
+        WHERE archive_file IS NULL AND month < ? ORDER BY month
+    ''', (cutoff,)).fetchall()
+    archived = []
+    for month, table, rows in partitions:
+        os.makedirs(archive_dir, exist_ok=True)
+        file_name = f"{table}.db.gz"
+        path = os.path.join(archive_dir, file_name)
+        with tempfile.TemporaryDirectory(dir=archive_dir) as tmp:
+            export = os.path.join(tmp, f"{table}.db")
+            conn.commit()
+            #ATTACH недоступен внутри транзакции
+            conn.execute("ATTACH DATABASE ? AS archive", (export,))
+            try:
+                conn.execute(f'''CREATE TABLE archive.access_logs (
+                                     log_id INTEGER PRIMARY KEY,
+                                     employee_id INTEGER NOT NULL,
+                                     door_id INTEGER NOT NULL,
+                                     timestamp TEXT NOT NULL)''')
+                conn.execute(f"INSERT INTO archive.access_logs ({_COLUMNS}) SELECT {_COLUMNS} FROM main.{table}")
+                conn.commit()
+                exported = conn.execute("SELECT COUNT(*) FROM archive.access_logs").fetchone()[0]
+            finally:
+                conn.execute("DETACH DATABASE archive")
+            if exported != rows:
+                raise sqlite3.DatabaseError(f"Архив {month}: выгружено {exported} строк из {rows}")
+            with open(export, 'rb') as src, gzip.open(path + '.tmp', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + '.tmp', path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE access_log_partitions SET archive_file = ? WHERE month = ?", (file_name, month))
+            rebuild_history_view(cursor)
+            cursor.execute(f"DROP TABLE {table}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        archived.append((month, path))
+    return archived
+
+
+def restore_partition(conn, month, archive_dir):
+    """Возвращает раздел из архива в базу; архив после этого удаляется. Возвращает число строк"""
+    row = conn.execute("SELECT table_name, archive_file FROM access_log_partitions WHERE month = ?",
+                       (month,)).fetchone()
+    if row is None or row[1] is None:
+        raise ValueError(f"Раздел {month} не в архиве")
+    table, file_name = row
+    path = os.path.join(archive_dir, file_name)
+    with tempfile.TemporaryDirectory(dir=archive_dir) as tmp:
+        export = os.path.join(tmp, f"{table}.db")
+        with gzip.open(path, 'rb') as src, open(export, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        conn.commit()
+        conn.execute("ATTACH DATABASE ? AS archive", (export,))
+        try:
+            cursor = conn.cursor()
+            try:
+                _create_partition(cursor, table)
+                cursor.execute(f"INSERT INTO {table} ({_COLUMNS}) SELECT {_COLUMNS} FROM archive.access_logs")
+                rows = cursor.rowcount
+                _update_catalog(cursor, month, table)
+                rebuild_history_view(cursor)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    os.remove(path)
+    return rows
+
+
+def apply_retention(conn, archive_dir, now=None, hot_months=HOT_MONTHS, archive_after_months=ARCHIVE_AFTER_MONTHS):
+    """Политика хранения: перенос прошедших месяцев в разделы, затем архивация старых разделов"""
+    rotated = rotate_partitions(conn, archive_dir, now, hot_months)
+    archived = archive_partitions(conn, archive_dir, now, archive_after_months)
+    return rotated, archived
+
+
+def default_archive_dir(db_file):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), ARCHIVE_DIRECTORY)
+
+
+def partition_sources(conn, start=None, end=None):
+    """Таблицы с записями за [start, end): [(таблица, первая отметка, последняя отметка), ...], новые первыми
+
+    access_logs входит всегда, когда не пуста: в нее могут попасть опоздавшие события любого месяца.
+    """
+    sources = []
+    first, last = conn.execute("SELECT (SELECT MIN(timestamp) FROM access_logs), "
+                               "(SELECT MAX(timestamp) FROM access_logs)").fetchone()
+    if first is not None:
+        sources.append(("access_logs", first, last))
+    conditions, params = ["archive_file IS NULL", "rows > 0"], []
+    if start is not None:
+        conditions.append("last_timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("first_timestamp < ?")
+        params.append(end)
+    sources += conn.execute(f'''
+        SELECT table_name, first_timestamp, last_timestamp FROM access_log_partitions
+        WHERE {' AND '.join(conditions)}
+    ''', params).fetchall()
+    return sorted(sources, key=lambda source: source[2], reverse=True)
+
+
+def archived_months(conn, start=None, end=None):
+    """Месяцы периода, которые есть только в архиве (запросы их не видят до restore_partition)"""
+    conditions, params = ["archive_file IS NOT NULL"], []
+    if start is not None:
+        conditions.append("last_timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("first_timestamp < ?")
+        params.append(end)
+    return [row[0] for row in conn.execute(
+        f"SELECT month FROM access_log_partitions WHERE {' AND '.join(conditions)} ORDER BY month", params)]
+
+
+def pruned_union(conn, arm_sql, start=None, end=None):
+    """UNION ALL запроса arm_sql ({source} - таблица) только по разделам, пересекающим [start, end)
+
+    Для отчетов: группировка внутри каждой части идет по индексам раздела, а внешний запрос
+    складывает частичные итоги, например
+    SELECT door_id, SUM(n) FROM (SELECT door_id, COUNT(*) AS n FROM {source} WHERE ... GROUP BY door_id) GROUP BY door_id
+    """
+    sources = partition_sources(conn, start, end) or [("access_logs", None, None)]
+    return ' UNION ALL '.join(arm_sql.format(source=source) for source, _, _ in sources)
+
+
+def fetch_page(conn, select_template, base_template, where, params, key_columns, key_positions, id_column,
+               descending=False, after=None, before=None, limit=200, start=None, end=None):
+    """Страница журнала по всем разделам; {source} в select_template и base_template - имя таблицы раздела
+
+    UNION ALL-представление с ORDER BY ... LIMIT SQLite собирает целиком, поэтому страница выбирается
+    из каждого раздела отдельно (по его индексу) и результаты сливаются. start и end - период из условий
+    отбора: разделы вне него не читаются при любой сортировке. При сортировке по времени раздел
+    пропускается и тогда, когда по его первой и последней отметке в страницу он попасть не может:
+    "последние сутки" читают только access_logs.
+    """
+    by_time = key_columns[0] == TIME_COLUMN
+    #порядок, в котором keyset_query вернет строки (before - в обратном)
+    newest_first = descending != (before is not None)
+    bound = (after or before or (None,))[0] if by_time else None
+
+    def key(row):
+        return tuple(row[i] for i in key_positions)
+
+    rows = []
+    for source, first, last in partition_sources(conn, start, end):
+        if by_time:
+            if newest_first:
+                if (bound is not None and first > bound) or (len(rows) >= limit and last < rows[-1][key_positions[0]]):
+                    continue
+            elif (bound is not None and last < bound) or (len(rows) >= limit and first > rows[-1][key_positions[0]]):
+                continue
+        sql, query_params = keyset_query(select_template.format(source=source), where, params, key_columns,
+                                         descending, after, before, limit, base_template.format(source=source),
+                                         id_column)
+        rows = sorted(rows + conn.execute(sql, query_params).fetchall(), key=key, reverse=newest_first)[:limit]
+    return rows
+
+
+#VirtualTable над журналом доступа со всеми живыми разделами: страницы - fetch_page,
+#обновления по change_log - через представление истории (условие по log_id уходит в каждый раздел)
+class PartitionedAccessTable(VirtualTable):
+    def __init__(self, parent, db_file, columns, select_sql, base_table, **options):
+        """
+        :param select_sql: как у VirtualTable, но вместо таблицы журнала - {source}
+        :param base_table: "{source} a"
+        """
+        self.select_template = select_sql
+        self.base_template = base_table
+        super().__init__(parent, db_file, columns, select_sql.format(source=HISTORY_VIEW),
+                         base_table=base_table.format(source=HISTORY_VIEW), **options)
+
+    def fetch_page(self, after=None, before=None, limit=None):
+        #период фильтра "Время" (см. filters.build_ranges) отсекает разделы до чтения
+        start, end = self.ranges.get(TIME_COLUMN, (None, None))
+        return fetch_page(get_pool(self.db_file).connection(), self.select_template, self.base_template,
+                          self.where, self.params, self.key_columns, self.key_positions, self.id_column,
+                          self.descending, after, before, limit or self.page_size, start, end)
+
+
+def delete_access_log(conn, log_id):
+    """Удаляет запись журнала из access_logs или из ее раздела; False, если записи нет. Без commit"""
+    if conn.execute("DELETE FROM access_logs WHERE log_id = ?", (log_id,)).rowcount:
+        return True
+    row = conn.execute(f"SELECT timestamp FROM {HISTORY_VIEW} WHERE log_id = ?", (log_id,)).fetchone()
+    if row is None:
+        return False
+    month = row[0][:7]
+    table = partition_table(month)
+    conn.execute(f"DELETE FROM {table} WHERE log_id = ?", (log_id,))
+    conn.execute("UPDATE access_log_partitions SET rows = rows - 1 WHERE month = ?", (month,))
+    #у разделов нет триггеров журнала изменений: открытые таблицы узнают об удалении отсюда
+    conn.execute("INSERT INTO change_log (table_name, row_id, op) VALUES ('access_logs', ?, 'D')", (log_id,))
+    return True
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = sys.argv[1:]
+    db_file = args.pop(0) if args and args[0].endswith('.db') else DB_FILE
+    if not args or args[0] not in ('list', 'retention', 'restore') or (args[0] == 'restore' and len(args) < 2):
+        print("Использование: python access_partitions.py [db] list | retention | restore ГГГГ-ММ")
+        sys.exit(2)
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON")
+    archive_dir = default_archive_dir(db_file)
+    if args[0] == 'retention':
+        rotated, archived = apply_retention(conn, archive_dir)
+        for month, rows in rotated:
+            print(f"{month}: {rows} записей перенесено в раздел")
+        for month, path in archived:
+            print(f"{month}: раздел сжат в {path}")
+    elif args[0] == 'restore':
+        print(f"{args[1]}: возвращено {restore_partition(conn, args[1], archive_dir)} записей")
+    hot = conn.execute("SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM access_logs").fetchone()
+    print(f"access_logs: {hot[0]} записей, {hot[1]} - {hot[2]}")
+    for month, table, rows, first, last, archive_file in conn.execute(
+            "SELECT * FROM access_log_partitions ORDER BY month"):
+        print(f"{month}: {rows} записей, {first} - {last}" + (f", архив {archive_file}" if archive_file else ""))
+    conn.close()
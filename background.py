@@ -0,0 +1,98 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#сколько потоков выполняют запросы к БД для окна
+QUERY_WORKERS = 2
+#как часто главный поток Tk забирает готовые результаты, мс
+POLL_INTERVAL_MS = 30
+
+
+#выполнение запросов вне главного потока Tk.
+#Функция запроса выполняется в рабочем потоке (со своим соединением из пула),
+#а обработчики результата вызываются в главном потоке через after().
+#Запросы с одним ключом не копятся: новый запрос отменяет еще не начатый предыдущий,
+#а результат устаревшего запроса просто отбрасывается.
+class BackgroundQueries:
+    def __init__(self, root, workers=QUERY_WORKERS, poll_ms=POLL_INTERVAL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-query')
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._futures = {}
+        self._closed = False
+        self._after_id = self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, key, query, on_success=None, on_error=None):
+        """Запускает query() в рабочем потоке; on_success(result) / on_error(exc) - в главном потоке"""
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            previous = self._futures.get(key)
+            if previous is not None:
+                previous.cancel()
+            future = self._executor.submit(query)
+            self._futures[key] = future
+        future.add_done_callback(
+            lambda f: self._results.put((key, generation, f, on_success, on_error)))
+        return future
+
+    def cancel(self, key):
+        """Отменяет запрос с ключом key: его результат не будет доставлен"""
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            future = self._futures.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def is_busy(self, key):
+        with self._lock:
+            future = self._futures.get(key)
+        return future is not None and not future.done()
+
+    def _poll(self):
+        while True:
+            try:
+                key, generation, future, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if self._generations.get(key) != generation:
+                    continue
+                self._futures.pop(key, None)
+            if future.cancelled():
+                continue
+            error = future.exception()
+            try:
+                if error is not None:
+                    if on_error is not None:
+                        on_error(error)
+                    else:
+                        print(f"Ошибка фонового запроса {key}: {str(error)}")
+                elif on_success is not None:
+                    on_success(future.result())
+            except Exception as e:
+                #окно, ждавшее результат, могло быть уже закрыто
+                print(f"Ошибка обработки результата {key}: {str(e)}")
+        if not self._closed:
+            self._after_id = self.root.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        self._closed = True
+        try:
+            self.root.after_cancel(self._after_id)
+        except Exception:
+            pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+#общий исполнитель фоновых запросов для главного окна приложения
+def get_background_queries(widget):
+    root = widget.nametowidget('.')
+    queries = getattr(root, 'background_queries', None)
+    if queries is None:
+        queries = BackgroundQueries(root)
+        root.background_queries = queries
+    return queries
@@ -0,0 +1,824 @@
+import argparse
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import calculate
+from calculate import calculate_discount, calculate_discount_batch, calculate_products, calculate_products_batch
+from csv_import import BulkImporter, IncrementalImporter, ParallelImporter, TABLES
+from data_access import ConnectionPool, STORAGE_PROFILES
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(SCRIPT_DIRECTORY, "db.db")
+
+#настройки sqlite "из коробки" - точка отсчета для сравнения профилей
+SQLITE_DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+#копия базы через backup API, чтобы замеры не меняли рабочий db.db
+def copy_database(db_file, target_file):
+    src = sqlite3.connect(db_file)
+    dst = sqlite3.connect(target_file)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+#задержка commit и пропускная способность чтения при параллельной записи для каждого профиля
+def bench_storage(db_file, commits=200, readers=4, duration=2.0):
+    profiles = {'sqlite-default': SQLITE_DEFAULT_PRAGMAS}
+    profiles.update(STORAGE_PROFILES)
+    print(f"{'профиль':<16}{'commit p50, мс':>16}{'commit p95, мс':>16}{'чтений/с':>12}{'записей/с':>12}")
+    for name, pragmas in profiles.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            copy_database(db_file, path)
+            pool = ConnectionPool(path, pragmas=pragmas)
+            pool.execute("CREATE TABLE IF NOT EXISTS bench_commits (id INTEGER PRIMARY KEY, payload TEXT, created TEXT)")
+            pool.connection().commit()
+
+            latencies = []
+            for i in range(commits):
+                started = time.perf_counter()
+                with pool.transaction() as cursor:
+                    cursor.execute("INSERT INTO bench_commits (payload, created) VALUES (?, datetime('now'))", (f"row {i}",))
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            stop = threading.Event()
+            read_counts = [0] * readers
+
+            def reader(index):
+                while not stop.is_set():
+                    pool.fetchall('''
+                        SELECT p.name, s.quantity, s.sale_date
+                        FROM sales s
+                        JOIN products p ON s.product_id = p.product_id
+                    ''')
+                    pool.fetchone("SELECT COUNT(*) FROM bench_commits")
+                    read_counts[index] += 1
+
+            threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+            for thread in threads:
+                thread.start()
+            writes = 0
+            started = time.perf_counter()
+            try:
+                while time.perf_counter() - started < duration:
+                    try:
+                        with pool.transaction() as cursor:
+                            cursor.execute("INSERT INTO bench_commits (payload, created) VALUES ('concurrent', datetime('now'))")
+                        writes += 1
+                    except sqlite3.OperationalError:
+                        #в режиме DELETE писатель может упереться в читателей
+                        pass
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            elapsed = time.perf_counter() - started
+            pool.close_all()
+
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+            print(f"{name:<16}{statistics.median(latencies):>16.3f}{p95:>16.3f}"
+                  f"{sum(read_counts) / elapsed:>12.0f}{writes / elapsed:>12.0f}")
+
+
+#каталог с csv, где sales.csv раздут до rows строк (остальные файлы - из репозитория)
+def make_import_fixture(target_dir, rows):
+    for spec in TABLES:
+        source = os.path.join(SCRIPT_DIRECTORY, spec.file_name)
+        if spec.table != 'sales' and os.path.exists(source):
+            shutil.copy(source, target_dir)
+    rng = random.Random(42)
+    with open(os.path.join(target_dir, 'sales.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['partner_id', 'product_id', 'quantity', 'sale_date'])
+        for _ in range(rows):
+            writer.writerow([rng.randint(1, 4), rng.randint(1, 20), rng.randint(1, 50000),
+                             f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"])
+
+
+#скорость импорта csv в пустую базу со схемой из main.create_database
+#workers: список числа процессов разбора; 0 - последовательный BulkImporter
+def bench_import(rows, workers=(0,)):
+    from main import create_database
+    from migrations import apply_migrations
+    with tempfile.TemporaryDirectory() as tmp:
+        make_import_fixture(tmp, rows)
+        for count in workers:
+            db_file = os.path.join(tmp, f'bench_{count}.db')
+            create_database(db_file)
+            pool = ConnectionPool(db_file, pragmas=STORAGE_PROFILES['bulk-import'])
+            apply_migrations(pool.connection())
+            if count:
+                importer = ParallelImporter(pool.connection(), tmp, workers=count)
+            else:
+                importer = BulkImporter(pool.connection(), tmp)
+            started = time.perf_counter()
+            importer.run()
+            elapsed = time.perf_counter() - started
+            pool.close_all()
+            label = f"{count} процессов" if count else "последовательно"
+            print(f"--- {label}: {elapsed:.2f} с всего")
+            for table, stats in importer.stats.items():
+                print(f"{table:<12}{stats['inserted']:>10} строк {stats['seconds']:>8.2f} с {stats['rows_per_sec']:>12.0f} строк/с")
+
+
+#параллельный импорт файла с неразборчивыми байтами: предупреждение, как у последовательного, а не зависание
+def bench_import_errors(rows, workers=2, timeout=60):
+    from main import create_database
+    from migrations import apply_migrations
+    with tempfile.TemporaryDirectory() as tmp:
+        make_import_fixture(tmp, rows)
+        with open(os.path.join(tmp, 'sales.csv'), 'ab') as f:
+            f.write(b'\xff\xfe,1,5,2025-01-01\n1,1,5,2025-01-01\n')
+        db_file = os.path.join(tmp, 'errors.db')
+        create_database(db_file)
+        pool = ConnectionPool(db_file, pragmas=STORAGE_PROFILES['bulk-import'])
+        apply_migrations(pool.connection())
+        importer = ParallelImporter(pool.connection(), tmp, workers=workers, chunk_bytes=64)
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(warnings=importer.run()), daemon=True)
+        started = time.perf_counter()
+        thread.start()
+        thread.join(timeout)
+        assert not thread.is_alive(), f"импорт не завершился за {timeout} с"
+        print(f"импорт с ошибкой в sales.csv: {time.perf_counter() - started:.2f} с, предупреждения: {result['warnings']}")
+        assert any('sales.csv' in warning for warning in result['warnings'])
+        #таблицы до sales импортированы полностью
+        assert pool.connection().execute("SELECT COUNT(*) FROM products").fetchone()[0] > 0
+        pool.close_all()
+
+
+#повторный импорт измененного sales.csv: строки сверяются с загруженными, а не вставляются второй раз
+def bench_reimport(rows):
+    from main import create_database
+    from migrations import apply_migrations
+    from sales_totals import check_consistency
+    with tempfile.TemporaryDirectory() as tmp:
+        make_import_fixture(tmp, rows)
+        db_file = os.path.join(tmp, 'reimport.db')
+        create_database(db_file)
+        pool = ConnectionPool(db_file, pragmas=STORAGE_PROFILES['desktop'])
+        conn = pool.connection()
+        apply_migrations(conn)
+        IncrementalImporter(conn, tmp, report=print).run()
+        assert conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == rows
+        path = os.path.join(tmp, 'sales.csv')
+        with open(path, encoding='utf-8', newline='') as f:
+            lines = list(csv.reader(f))
+        #одна строка изменена, одна удалена, одна добавлена
+        lines[1][2] = str(int(lines[1][2]) + 1)
+        del lines[2]
+        lines.append(['1', '1', '100', '2025-01-01'])
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows(lines)
+        started = time.perf_counter()
+        warnings = IncrementalImporter(conn, tmp, report=print).run()
+        elapsed = time.perf_counter() - started
+        count = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        print(f"повторный импорт измененного sales.csv ({rows} строк): {elapsed:.2f} с, строк в sales {count}")
+        assert not warnings, warnings
+        assert count == rows
+        assert conn.execute("SELECT SUM(quantity) FROM sales").fetchone()[0] == sum(int(line[2]) for line in lines[1:])
+        assert check_consistency(conn) == []
+        pool.close_all()
+
+
+#пакетный расчет материалов и скидок против поэлементного цикла на rows синтетических строк
+#(типы 0..3, чтобы часть строк уходила в -1, и немного нулевых параметров)
+def bench_calculate(rows, seed=1):
+    rnd = random.Random(seed)
+    product_types = array('q', (rnd.randint(0, 3) for _ in range(rows)))
+    material_types = array('q', (rnd.randint(0, 3) for _ in range(rows)))
+    totals = array('d', (rnd.uniform(-10, 10000) for _ in range(rows)))
+    params1 = array('d', (rnd.uniform(0, 50) for _ in range(rows)))
+    params2 = array('d', (rnd.uniform(0, 50) for _ in range(rows)))
+    quantities = array('q', (rnd.randint(0, 400000) for _ in range(rows)))
+    print(f"строк: {rows}, numpy: {'да' if calculate.np is not None else 'нет (array.array)'}")
+
+    started = time.perf_counter()
+    scalar_products = [calculate_products(*row) for row in zip(product_types, material_types, totals, params1, params2)]
+    scalar_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    batch_products = calculate_products_batch(memoryview(product_types), memoryview(material_types),
+                                              memoryview(totals), memoryview(params1), memoryview(params2))
+    batch_seconds = time.perf_counter() - started
+    assert list(batch_products) == scalar_products, "пакетный calculate_products расходится с поэлементным"
+    print(f"calculate_products: цикл {scalar_seconds:.2f} с, пакет {batch_seconds:.2f} с, "
+          f"ускорение x{scalar_seconds / batch_seconds:.1f}")
+
+    started = time.perf_counter()
+    scalar_discounts = [calculate_discount(quantity) for quantity in quantities]
+    scalar_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    batch_discounts = calculate_discount_batch(memoryview(quantities))
+    batch_seconds = time.perf_counter() - started
+    assert list(batch_discounts) == scalar_discounts, "пакетный calculate_discount расходится с поэлементным"
+    print(f"calculate_discount: цикл {scalar_seconds:.2f} с, пакет {batch_seconds:.2f} с, "
+          f"ускорение x{scalar_seconds / batch_seconds:.1f}")
+
+
+#поэлементный calculate_products по кэшу коэффициентов из БД с product_types и material_types типами
+def bench_coefficients(product_types=5000, material_types=2000, calls=1000000, seed=1):
+    from main import create_database
+    from migrations import apply_migrations
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'coefficients.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        apply_migrations(conn)
+        conn.executemany("INSERT OR REPLACE INTO product_type_coefficients VALUES (?, ?)",
+                         [(type_id, rnd.uniform(0.5, 5)) for type_id in range(1, product_types + 1)])
+        conn.executemany("INSERT OR REPLACE INTO material_defect_rates VALUES (?, ?)",
+                         [(type_id, rnd.uniform(0, 0.5)) for type_id in range(1, material_types + 1)])
+        conn.commit()
+
+        started = time.perf_counter()
+        calculate.load_coefficients(conn)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(1000):
+            calculate.load_coefficients(conn)
+        check_seconds = (time.perf_counter() - started) / 1000
+        conn.close()
+
+    #каждый десятый тип отсутствует в таблицах, чтобы проверялась и ветка -1
+    rows = [(rnd.randint(1, product_types * 11 // 10), rnd.randint(1, material_types * 11 // 10),
+             rnd.uniform(1, 10000), rnd.uniform(0.1, 50), rnd.uniform(0.1, 50)) for _ in range(calls)]
+    started = time.perf_counter()
+    results = [calculate_products(*row) for row in rows]
+    elapsed = time.perf_counter() - started
+    print(f"типов продукции: {product_types}, типов материала: {material_types}")
+    print(f"загрузка кэша: {load_seconds * 1000:.1f} мс, проверка версии: {check_seconds * 1000000:.0f} мкс")
+    print(f"calculate_products: {calls / elapsed:,.0f} вызовов/с, "
+          f"-1 в {results.count(-1) / calls:.0%} вызовов")
+
+
+#фильтры и сортировка вкладки заявок на rows синтетических заявках: время первой и следующей страницы
+#по сценариям (значения полей ORDER_FILTERS, столбец сортировки, по убыванию)
+FILTER_SCENARIOS = [
+    ("без фильтра", ["", "", ("", "")], None, False),
+    ("статус", ["", "created", ("", "")], None, False),
+    ("статус + период", ["", "prepaid", ("2024-03-01", "2024-03-31")], None, False),
+    ("период", ["", "", ("2024-06-01", "2024-06-30")], None, False),
+    ("партнер (один)", ["Партнер 0042", "", ("", "")], None, False),
+    ("партнер (префикс)", ["партнер 01", "", ("", "")], None, False),
+    ("партнер + статус", ["Партнер 0042", "completed", ("", "")], None, False),
+    ("сортировка по дате", ["", "", ("", "")], "Дата создания", True),
+    ("сортировка по статусу", ["", "", ("", "")], "Статус", False),
+    ("статус, по дате", ["", "cancelled", ("", "")], "Дата создания", True),
+    ("период, по дате", ["", "", ("2024-06-01", "2024-06-30")], "Дата создания", False),
+]
+
+
+def bench_filters(rows=1000000, partners=1000, runs=5, target_ms=50, seed=1):
+    from main import create_database, ORDERS_SELECT_SQL, ORDER_FILTERS, ORDER_SORT_COLUMNS
+    from migrations import apply_migrations
+    from filters import build_conditions
+    from orders import ORDER_STATUSES
+    from virtual_table import keyset_query
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'filters.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        conn.execute("INSERT INTO managers (name, email, password) VALUES ('bench', 'bench@localhost', '')")
+        conn.executemany("INSERT INTO partners (name, partner_type, rating) VALUES (?, 'ООО', ?)",
+                         [(f"Партнер {i:04d}", rnd.randint(0, 100)) for i in range(partners)])
+        conn.executemany("INSERT INTO products (article, type, name, min_partner_price, product_type_id, param1, param2) "
+                         "VALUES (?, 'bench', ?, 100, 1, 1, 1)", [(str(i), f"Продукт {i}") for i in range(20)])
+        conn.executemany("INSERT INTO orders (partner_id, manager_id, product_id, quantity, cost, status, created_date) "
+                         "VALUES (?, 1, ?, ?, ?, ?, ?)",
+                         ((rnd.randint(1, partners), rnd.randint(1, 20), rnd.randint(1, 100), rnd.uniform(100, 10000),
+                           rnd.choice(ORDER_STATUSES),
+                           f"{rnd.randint(2022, 2025)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}")
+                          for _ in range(rows)))
+        conn.commit()
+        apply_migrations(conn)
+
+        print(f"заявок: {rows}, партнеров: {partners}, цель: {target_ms} мс на страницу")
+        print(f"{'сценарий':<26}{'строк':>7}{'1-я стр., мс':>14}{'2-я стр., мс':>14}")
+        slow = []
+        for name, values, sort_column, descending in FILTER_SCENARIOS:
+            conditions, params = build_conditions(
+                ORDER_FILTERS, [value if isinstance(value, tuple) else (value,) for value in values])
+            expression, position = ORDER_SORT_COLUMNS[sort_column] if sort_column else ("o.order_id", 0)
+            if position == 0:
+                key_columns, positions = (expression,), (0,)
+            else:
+                key_columns, positions = (expression, "o.order_id"), (position, 0)
+            timings = []
+            after = None
+            found = None
+            for _ in range(2):
+                samples = []
+                for _ in range(runs):
+                    sql, query_params = keyset_query(ORDERS_SELECT_SQL, conditions, params, key_columns, descending,
+                                                     after=after, limit=200, base_table="orders o",
+                                                     id_column="o.order_id")
+                    started = time.perf_counter()
+                    page = conn.execute(sql, query_params).fetchall()
+                    samples.append((time.perf_counter() - started) * 1000)
+                timings.append(statistics.median(samples))
+                found = len(page) if found is None else found
+                after = tuple(page[-1][i] for i in positions) if page else None
+            if max(timings) > target_ms:
+                slow.append(name)
+            print(f"{name:<26}{found:>7}{timings[0]:>14.2f}{timings[1]:>14.2f}")
+        conn.close()
+    print(f"медленнее цели: {', '.join(slow)}" if slow else "все сценарии укладываются в цель")
+
+
+#полнотекстовый поиск: rows синтетических партнеров и продуктов, вставка через триггеры FTS и время запросов.
+#Фамилии и улицы собираются из слогов (словарь в тысячи слов), города, типы и цвета - из коротких списков
+SEARCH_SYLLABLES = ("ва", "ни", "ко", "ров", "ле", "на", "ми", "тов", "ка", "зин", "со", "бе", "ло", "ду", "ра",
+                    "гин", "пе", "тр", "ше", "фё")
+SEARCH_CITIES = ("Москва", "Казань", "Ростов-на-Дону", "Екатеринбург", "Самара", "Пермь", "Тверь", "Омск")
+SEARCH_LOCATIONS = ("Розничные точки", "Интернет", "Опт", "Оффлайн", "Маркетплейсы")
+SEARCH_PRODUCT_TYPES = ("Кресло", "Стол", "Шкаф", "Стеллаж", "Тумба", "Стул", "Диван", "Полка")
+SEARCH_ADJECTIVES = ("офисное", "детское", "угловой", "письменный", "компьютерный", "складной", "мягкий")
+SEARCH_COLORS = ("Дуб", "Венге", "Орех", "Белый", "Черный", "Серый", "Бук", "Ясень")
+#запрос -> (текст для партнеров, текст для продукции)
+SEARCH_QUERIES = {
+    'слово целиком': ("казань", "стол"),
+    'два слова': ("ростов ул", "шкаф венге"),
+    'префикс 2 буквы': ("ко", "ст"),
+    'префикс фамилии': ("ниров", "офис"),
+    'номер': ("1000004", "19917"),
+    'нет совпадений': ("несуществующее", "несуществующее"),
+}
+
+
+def bench_search(rows=100000, runs=20, seed=1):
+    from main import create_database
+    from migrations import apply_migrations
+    from search import check_indexes, search_partners, search_products
+    rnd = random.Random(seed)
+
+    def word():
+        return ''.join(rnd.choice(SEARCH_SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'search.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        apply_migrations(conn)
+        started = time.perf_counter()
+        conn.executemany('''INSERT INTO partners (name, partner_type, rating, address, director_name, sales_locations, inn)
+                            VALUES (?, 'ООО', 50, ?, ?, ?, ?)''',
+                         [(f"ООО {word()} {i}", f"{rnd.choice(SEARCH_CITIES)}, ул. {word()}, {rnd.randint(1, 99)}",
+                           f"{word()}ов {word()} {word()}ович", rnd.choice(SEARCH_LOCATIONS), str(1000000000 + i))
+                          for i in range(rows)])
+        conn.executemany('''INSERT INTO products (article, type, name, description, standard_number, min_partner_price,
+                                                  product_type_id, param1, param2)
+                            VALUES (?, 'bench', ?, ?, ?, 100, 1, 1, 1)''',
+                         [(f"#{3000000 + i}",
+                           f"{rnd.choice(SEARCH_PRODUCT_TYPES)} {rnd.choice(SEARCH_ADJECTIVES)} цвет {rnd.choice(SEARCH_COLORS)}",
+                           f"{word()} {word()} {word()} {word()}",
+                           f"ГОСТ {rnd.randint(10000, 29999)}-{rnd.randint(2000, 2024)}") for i in range(rows)])
+        conn.commit()
+        insert_seconds = time.perf_counter() - started
+        check_indexes(conn)
+        print(f"партнеров и продуктов: по {rows}, вставка с триггерами FTS: {2 * rows / insert_seconds:,.0f} строк/с")
+        print(f"{'запрос':<18}{'партнеры, мс':>14}{'найдено':>9}{'продукция, мс':>15}{'найдено':>9}")
+        for name, texts in SEARCH_QUERIES.items():
+            line = f"{name:<18}"
+            for search, text in zip((search_partners, search_products), texts):
+                samples = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    found = search(conn, text)
+                    samples.append((time.perf_counter() - started) * 1000)
+                line += f"{statistics.median(samples):>14.2f}{len(found):>9}"
+            print(line)
+        conn.close()
+
+
+#прием журнала доступа: commit на каждое событие (как кнопка в окне) против пачек AccessLogIngestor
+def bench_ingest(db_file, events=100000, single=2000, batch_sizes=(100, 1000, 5000), seed=1):
+    from access_ingest import AccessLogIngestor
+    from data_access import close_all_pools, configure_pool, get_pool
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ingest.db')
+        copy_database(db_file, path)
+        configure_pool(path)
+        pool = get_pool(path)
+        with pool.transaction() as cursor:
+            cursor.executemany("INSERT INTO employees (name) VALUES (?)", [(f"Сотрудник {i}",) for i in range(200)])
+        employees = {row[0] for row in pool.execute("SELECT employee_id FROM employees").fetchall()}
+        choices = sorted(employees)
+        #события идут по времени, как от контроллеров дверей; каждое сотое - от неизвестного сотрудника
+        start = datetime(2024, 1, 1)
+        stream = [(rnd.choice(choices) if i % 100 else -1, rnd.randint(1, 20),
+                   (start + timedelta(seconds=i * 3)).strftime("%Y-%m-%d %H:%M:%S"))
+                  for i in range(events)]
+
+        conn = pool.connection()
+        started = time.perf_counter()
+        for employee_id, door_id, timestamp in stream[:single]:
+            if employee_id in employees:
+                conn.execute("INSERT INTO access_logs (employee_id, door_id, timestamp) VALUES (?, ?, ?)",
+                             (employee_id, door_id, timestamp))
+                conn.commit()
+        single_rate = single / (time.perf_counter() - started)
+        print(f"{'способ':<24}{'событий/с':>12}{'записано':>10}{'отклонено':>11}{'пачек':>8}{'ожидание, с':>13}")
+        print(f"{'commit на событие':<24}{single_rate:>12,.0f}{single:>10}{'':>11}{single:>8}{'':>13}")
+
+        for batch_size in batch_sizes:
+            #буфер меньше потока: источник упирается в запись и ждет (обратное давление)
+            ingestor = AccessLogIngestor(path, batch_size=batch_size, max_buffer=batch_size * 10, report_interval=0)
+            started = time.perf_counter()
+            ingestor.start()
+            for event in stream:
+                ingestor.submit(event)
+            ingestor.stop()
+            elapsed = time.perf_counter() - started
+            stats = ingestor.stats()
+            print(f"{'пачки по ' + str(batch_size):<24}{events / elapsed:>12,.0f}{stats['inserted']:>10}"
+                  f"{stats['rejected']:>11}{stats['batches']:>8}{stats['blocked_seconds']:>13.2f}")
+        close_all_pools()
+
+
+#журнал доступа по месячным разделам: время страниц и отчетов против одной таблицы с той же историей
+def bench_partitions(months=36, rows_per_month=30000, runs=20, seed=1):
+    from access_partitions import apply_retention, fetch_page, pruned_union
+    from main import create_database
+    from migrations import apply_migrations
+    from virtual_table import keyset_query
+    rnd = random.Random(seed)
+    now = datetime(2025, 1, 1) + timedelta(days=months * 30)
+    first = now - timedelta(days=months * 30)
+    span = int((now - first).total_seconds())
+    select = "SELECT a.log_id, e.name, a.door_id, a.timestamp FROM {source} a JOIN employees e ON a.employee_id = e.employee_id"
+    day_ago = (now - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    quarter = ((now - timedelta(days=400)).strftime("%Y-%m-%d"), (now - timedelta(days=310)).strftime("%Y-%m-%d"))
+    #условия, параметры и период (как его передает FilterBar через ranges)
+    scenarios = {
+        'первая страница': ([], (), (None, None)),
+        'последние сутки': (["a.timestamp >= ?"], (day_ago,), (day_ago, None)),
+        'сотрудник за квартал': (["a.employee_id = ?", "a.timestamp >= ?", "a.timestamp < ?"], (7,) + quarter,
+                                 quarter),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for layout in ('одна таблица', 'разделы'):
+            db_file = os.path.join(tmp, f"{layout}.db")
+            create_database(db_file)
+            conn = sqlite3.connect(db_file)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            apply_migrations(conn)
+            conn.executemany("INSERT INTO employees (name) VALUES (?)", [(f"Сотрудник {i}",) for i in range(300)])
+            rnd.seed(seed)
+            events = sorted((first + timedelta(seconds=rnd.randrange(span))).strftime("%Y-%m-%d %H:%M:%S")
+                            for _ in range(months * rows_per_month))
+            conn.executemany("INSERT INTO access_logs (employee_id, door_id, timestamp) VALUES (?, ?, ?)",
+                             ((rnd.randint(1, 300), rnd.randint(1, 20), timestamp) for timestamp in events))
+            conn.commit()
+            if layout == 'разделы':
+                started = time.perf_counter()
+                rotated, archived = apply_retention(conn, os.path.join(tmp, 'archive'), now=now)
+                archive_bytes = sum(os.path.getsize(path) for _, path in archived)
+                print(f"apply_retention: {len(rotated)} месяцев в разделы, {len(archived)} в архив "
+                      f"({archive_bytes / 1024 / 1024:.1f} МБ) за {time.perf_counter() - started:.1f} с")
+            source = 'access_logs' if layout == 'одна таблица' else 'access_logs_history'
+            timings = {}
+            for name, (where, params, period) in scenarios.items():
+                samples = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    if layout == 'одна таблица':
+                        sql, query_params = keyset_query(select.format(source=source), where, params,
+                                                         ("a.timestamp", "a.log_id"), True, limit=200,
+                                                         base_table="access_logs a", id_column="a.log_id")
+                        found = conn.execute(sql, query_params).fetchall()
+                    else:
+                        found = fetch_page(conn, select, "{source} a", where, params, ("a.timestamp", "a.log_id"),
+                                           (3, 0), "a.log_id", True, limit=200, start=period[0], end=period[1])
+                    samples.append((time.perf_counter() - started) * 1000)
+                timings[name] = (statistics.median(samples), len(found))
+            report = "SELECT door_id, COUNT(*) AS n FROM {source} WHERE timestamp >= :start AND timestamp < :end GROUP BY door_id"
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                if layout == 'одна таблица':
+                    sql = report.format(source=source)
+                else:
+                    #частичные итоги по разделам периода
+                    sql = f"SELECT door_id, SUM(n) FROM ({pruned_union(conn, report, *quarter)}) GROUP BY door_id"
+                conn.execute(sql, dict(zip(('start', 'end'), quarter))).fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+            timings['отчет за квартал'] = (statistics.median(samples), None)
+            results[layout] = timings
+            conn.close()
+        print(f"{'запрос':<24}{'одна таблица, мс':>18}{'разделы, мс':>14}{'строк':>8}")
+        for name in results['одна таблица']:
+            single, rows = results['одна таблица'][name]
+            partitioned, _ = results['разделы'][name]
+            print(f"{name:<24}{single:>18.2f}{partitioned:>14.2f}{rows if rows is not None else '':>8}")
+
+
+#события рабочего дня сотрудника: приход, обед, иногда долгая отлучка, уход
+def make_workday_events(rnd, day, doors=20):
+    minute = rnd.randint(7 * 60 + 30, 9 * 60 + 30)
+    events = [minute]
+    for _ in range(rnd.randint(1, 4)):
+        minute += rnd.randint(30, 120)
+        events.append(minute)
+    if rnd.random() < 0.2:
+        #отлучка дольше SESSION_GAP - новый интервал присутствия
+        minute += rnd.randint(150, 200)
+        events.append(minute)
+    minute = max(minute, rnd.randint(16 * 60 + 30, 18 * 60 + 30))
+    events.append(minute)
+    return [(rnd.randint(1, doors), f"{day} {m // 60:02d}:{m % 60:02d}:{rnd.randint(0, 59):02d}") for m in events]
+
+
+#отчеты по журналу доступа за год: полный разбор в access_sessions, дозагрузка одного дня и отчеты по итогам
+def bench_analytics(employees=300, days=365, runs=5, seed=1):
+    import access_analytics
+    from main import create_database
+    from migrations import apply_migrations
+    rnd = random.Random(seed)
+    first_day = datetime(2024, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'analytics.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        apply_migrations(conn)
+        conn.executemany("INSERT INTO employees (name) VALUES (?)", [(f"Сотрудник {i}",) for i in range(employees)])
+
+        def day_events(offset):
+            day = (first_day + timedelta(days=offset)).strftime("%Y-%m-%d")
+            if (first_day + timedelta(days=offset)).weekday() >= 5:
+                return []
+            return sorted(((employee_id, door_id, timestamp) for employee_id in range(1, employees + 1)
+                           for door_id, timestamp in make_workday_events(rnd, day)), key=lambda event: event[2])
+
+        started = time.perf_counter()
+        for offset in range(days - 1):
+            conn.executemany("INSERT INTO access_logs (employee_id, door_id, timestamp) VALUES (?, ?, ?)",
+                             day_events(offset))
+        conn.commit()
+        total = conn.execute("SELECT COUNT(*) FROM access_logs").fetchone()[0]
+        print(f"событий за {days} дней: {total}, вставка {time.perf_counter() - started:.1f} с")
+
+        started = time.perf_counter()
+        access_analytics.update_sessions(conn)
+        sessions = conn.execute("SELECT COUNT(*) FROM access_sessions").fetchone()[0]
+        print(f"первый разбор: {time.perf_counter() - started:.2f} с, интервалов {sessions}")
+
+        last_day = first_day + timedelta(days=days - 1)
+        while last_day.weekday() >= 5:
+            last_day -= timedelta(days=1)
+        events = day_events((last_day - first_day).days)
+        conn.executemany("INSERT INTO access_logs (employee_id, door_id, timestamp) VALUES (?, ?, ?)", events)
+        conn.commit()
+        started = time.perf_counter()
+        processed, _ = access_analytics.update_sessions(conn)
+        print(f"дозагрузка дня: {processed} событий за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        year = (first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"))
+        now = last_day.replace(hour=12)
+        reports = {
+            'присутствие за год': lambda: access_analytics.daily_presence(conn, *year),
+            'сотрудник за год': lambda: access_analytics.daily_presence(conn, *year, employee_id=7),
+            'интервалы за год': lambda: access_analytics.presence_intervals(conn, 7, *year),
+            'занятость дверей': lambda: access_analytics.door_occupancy(conn, now),
+            'без итогов: журнал': lambda: conn.execute(
+                "SELECT employee_id, substr(timestamp, 1, 10), MIN(timestamp), MAX(timestamp) "
+                "FROM access_logs WHERE timestamp >= ? GROUP BY employee_id, substr(timestamp, 1, 10)",
+                (year[0],)).fetchall(),
+        }
+        print(f"{'отчет':<22}{'мс':>10}{'строк':>9}")
+        for name, report in reports.items():
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                rows = report()
+                samples.append((time.perf_counter() - started) * 1000)
+            print(f"{name:<22}{statistics.median(samples):>10.1f}{len(rows):>9}")
+        conn.close()
+
+
+#справочники окна заявки: чтение таблицы при каждом открытии против общего кэша и фильтр по вводу
+def bench_reference(products=50000, partners=5000, runs=20):
+    from main import create_database
+    from migrations import apply_migrations
+    from reference_cache import ReferenceCache, label
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'reference.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        apply_migrations(conn)
+        conn.executemany("INSERT INTO partners (name, partner_type, rating) VALUES (?, 'ООО', 50)",
+                         [(f"Партнер {i}",) for i in range(partners)])
+        conn.executemany('''INSERT INTO products (article, type, name, min_partner_price, product_type_id, param1, param2)
+                            VALUES (?, 'bench', ?, 100, 1, 1, 1)''',
+                         [(f"#{4000000 + i}", f"Продукт {SEARCH_COLORS[i % len(SEARCH_COLORS)]} {i}") for i in range(products)])
+        conn.commit()
+
+        def old_open():
+            #как OrderDialog до кэша: обе таблицы целиком и словари подписей
+            partner_map = {f"{p[1]} (ID: {p[0]})": p[0] for p in conn.execute("SELECT partner_id, name FROM partners")}
+            product_map = {f"{p[1]} (ID: {p[0]})": p[0] for p in conn.execute("SELECT product_id, name FROM products")}
+            return list(partner_map) + list(product_map)
+
+        cache = ReferenceCache()
+
+        def cached_open():
+            return cache.get(conn, 'partners'), cache.get(conn, 'products')
+
+        def timed(fn):
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - started) * 1000)
+            return statistics.median(samples)
+
+        print(f"партнеров {partners}, продуктов {products}")
+        print(f"открытие окна без кэша: {timed(old_open):.2f} мс")
+        started = time.perf_counter()
+        cached_open()
+        print(f"первое открытие с кэшем: {(time.perf_counter() - started) * 1000:.2f} мс")
+        print(f"следующие открытия: {timed(cached_open):.3f} мс")
+        conn.execute("UPDATE products SET min_partner_price = 120 WHERE product_id = 1")
+        conn.commit()
+        started = time.perf_counter()
+        snapshot = cache.get(conn, 'products')
+        print(f"после изменения продукции: {(time.perf_counter() - started) * 1000:.2f} мс, "
+              f"цена {snapshot.price_of(1)}, перечитываний {cache.loads}")
+        for text in ('Продукт', 'продукт сер', 'Продукт Синий 4999', '4999', 'нет такого'):
+            found = snapshot.matches(text)
+            print(f"фильтр '{text}': {timed(lambda: snapshot.matches(text)):.2f} мс, {len(found)} вариантов")
+        assert snapshot.by_label[label(1, snapshot.by_id[1][1])] == 1
+        conn.close()
+
+
+def bench_pricing(orders=200000, partners=5000, products=5000, quotes=10000, seed=1):
+    from main import create_database
+    from migrations import apply_migrations
+    from orders import ORDER_STATUSES
+    from pricing import PricingEngine, reprice_open_orders, unit_price, order_cost
+    from sales_totals import partner_totals
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'pricing.db')
+        create_database(db_file)
+        conn = sqlite3.connect(db_file)
+        apply_migrations(conn)
+        conn.execute("INSERT INTO managers (name, email, password) VALUES ('bench', 'bench@localhost', '')")
+        conn.executemany("INSERT INTO partners (name, partner_type, rating) VALUES (?, 'ООО', 50)",
+                         [(f"Партнер {i}",) for i in range(partners)])
+        conn.executemany('''INSERT INTO products (article, type, name, min_partner_price, product_type_id, param1, param2)
+                            VALUES (?, 'bench', ?, ?, 1, 1, 1)''',
+                         [(str(i), f"Продукт {i}", round(rnd.uniform(100, 20000), 2)) for i in range(products)])
+        conn.executemany("INSERT INTO sales (partner_id, product_id, quantity, sale_date) VALUES (?, 1, ?, '2025-01-01')",
+                         [(partner_id, rnd.choice((1, 20000, 100000, 400000))) for partner_id in range(1, partners + 1)])
+        conn.executemany("INSERT INTO orders (partner_id, manager_id, product_id, quantity, cost, status, created_date) "
+                         "VALUES (?, 1, ?, ?, 0, ?, '2025-01-01')",
+                         ((rnd.randint(1, partners), rnd.randint(1, products), rnd.randint(1, 500), rnd.choice(ORDER_STATUSES))
+                          for _ in range(orders)))
+        conn.commit()
+        requests = [(rnd.randint(1, partners), rnd.randint(1, products), rnd.randint(1, 500)) for _ in range(quotes)]
+
+        def plain_quote(partner_id, product_id, quantity):
+            #без кэшей: скидка и цена - по запросу на каждый расчет
+            discount = partner_totals(conn, partner_id)[1]
+            price = conn.execute("SELECT min_partner_price FROM products WHERE product_id = ?", (product_id,)).fetchone()[0]
+            return order_cost(unit_price(price, discount), quantity)
+
+        engine = PricingEngine(db_file)
+        started = time.perf_counter()
+        expected = [plain_quote(*request) for request in requests]
+        plain = time.perf_counter() - started
+        engine.quote(conn, *requests[0])
+        started = time.perf_counter()
+        quoted = [engine.quote(conn, *request).cost for request in requests]
+        cached = time.perf_counter() - started
+        assert quoted == expected
+        print(f"расчет стоимости: без кэша {plain / quotes * 1e6:.1f} мкс, "
+              f"с прайс-листами и скидками {cached / quotes * 1e6:.1f} мкс")
+
+        conn.execute("UPDATE products SET min_partner_price = ROUND(min_partner_price * 1.07, 2)")
+        conn.commit()
+        open_orders = conn.execute("SELECT order_id, partner_id, product_id, quantity FROM orders WHERE status = 'created'").fetchall()
+        started = time.perf_counter()
+        #по заявке за раз: расчет и UPDATE на каждую заявку (откатывается, чтобы сравнить с пересчетом ниже)
+        for order_id, partner_id, product_id, quantity in open_orders:
+            conn.execute("UPDATE orders SET cost = ? WHERE order_id = ?",
+                         (plain_quote(partner_id, product_id, quantity), order_id))
+        per_order = time.perf_counter() - started
+        conn.rollback()
+        started = time.perf_counter()
+        changed = reprice_open_orders(conn, engine)
+        bulk = time.perf_counter() - started
+        print(f"пересчет {len(open_orders)} открытых заявок из {orders}: по одной {per_order:.2f} с, "
+              f"одним проходом {bulk:.2f} с, изменено {len(changed)}, прайс-листов построено {engine.price_list_builds}")
+        for order_id, partner_id, product_id, quantity in open_orders[:1000]:
+            cost = conn.execute("SELECT cost FROM orders WHERE order_id = ?", (order_id,)).fetchone()[0]
+            assert cost == plain_quote(partner_id, product_id, quantity)
+        assert reprice_open_orders(conn, engine) == []
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности")
+    parser.add_argument('--db', default=DB_FILE, help="файл базы данных (копируется перед замером)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    storage = subparsers.add_parser('storage', help="профили хранения: commit и параллельное чтение")
+    storage.add_argument('--commits', type=int, default=200)
+    storage.add_argument('--readers', type=int, default=4)
+    storage.add_argument('--duration', type=float, default=2.0)
+
+    import_parser = subparsers.add_parser('import', help="скорость импорта csv")
+    import_parser.add_argument('--rows', type=int, default=1000000, help="строк в синтетическом sales.csv")
+    import_parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8],
+                               help="число процессов разбора для каждого прогона; 0 - последовательный импорт")
+
+    import_errors_parser = subparsers.add_parser('import-errors', help="параллельный импорт файла с неразборчивыми байтами")
+    import_errors_parser.add_argument('--rows', type=int, default=1000, help="строк в синтетическом sales.csv")
+
+    reimport_parser = subparsers.add_parser('reimport', help="повторный импорт измененного csv")
+    reimport_parser.add_argument('--rows', type=int, default=100000, help="строк в синтетическом sales.csv")
+
+    calculate_parser = subparsers.add_parser('calculate', help="пакетный расчет материалов и скидок")
+    calculate_parser.add_argument('--rows', type=int, default=10000000)
+
+    coefficients_parser = subparsers.add_parser('coefficients', help="calculate_products по кэшу коэффициентов")
+    coefficients_parser.add_argument('--product-types', type=int, default=5000)
+    coefficients_parser.add_argument('--material-types', type=int, default=2000)
+    coefficients_parser.add_argument('--calls', type=int, default=1000000)
+
+    filters_parser = subparsers.add_parser('filters', help="фильтры и сортировка заявок на большой таблице")
+    filters_parser.add_argument('--rows', type=int, default=1000000)
+    filters_parser.add_argument('--partners', type=int, default=1000)
+
+    search_parser = subparsers.add_parser('search', help="полнотекстовый поиск по партнерам и продукции")
+    search_parser.add_argument('--rows', type=int, default=100000)
+
+    ingest_parser = subparsers.add_parser('ingest', help="прием журнала доступа пачками")
+    ingest_parser.add_argument('--events', type=int, default=100000)
+
+    partitions_parser = subparsers.add_parser('partitions', help="журнал доступа по месячным разделам")
+    partitions_parser.add_argument('--months', type=int, default=36)
+    partitions_parser.add_argument('--rows-per-month', type=int, default=30000)
+
+    analytics_parser = subparsers.add_parser('analytics', help="отчеты присутствия по журналу доступа")
+    analytics_parser.add_argument('--employees', type=int, default=300)
+    analytics_parser.add_argument('--days', type=int, default=365)
+
+    reference_parser = subparsers.add_parser('reference', help="кэш справочников окна заявки")
+    reference_parser.add_argument('--products', type=int, default=50000)
+
+    pricing_parser = subparsers.add_parser('pricing', help="расчет стоимости заявок и пересчет открытых заявок")
+    pricing_parser.add_argument('--orders', type=int, default=200000)
+
+    args = parser.parse_args()
+    if args.command == 'storage':
+        bench_storage(args.db, args.commits, args.readers, args.duration)
+    elif args.command == 'import':
+        bench_import(args.rows, args.workers)
+    elif args.command == 'import-errors':
+        bench_import_errors(args.rows)
+    elif args.command == 'reimport':
+        bench_reimport(args.rows)
+    elif args.command == 'calculate':
+        bench_calculate(args.rows)
+    elif args.command == 'coefficients':
+        bench_coefficients(args.product_types, args.material_types, args.calls)
+    elif args.command == 'filters':
+        bench_filters(args.rows, args.partners)
+    elif args.command == 'search':
+        bench_search(args.rows)
+    elif args.command == 'ingest':
+        bench_ingest(args.db, args.events)
+    elif args.command == 'partitions':
+        bench_partitions(args.months, args.rows_per_month)
+    elif args.command == 'analytics':
+        bench_analytics(args.employees, args.days)
+    elif args.command == 'reference':
+        bench_reference(args.products)
+    elif args.command == 'pricing':
+        bench_pricing(args.orders)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import math
+from collections import defaultdict
+
+import calculate
+
+#спецификация по умолчанию для продукции без строк в product_materials:
+#прежнее правило - одна единица материала 1 на единицу продукции, без коэффициента типа и брака
+DEFAULT_MATERIAL_ID = 1
+DEFAULT_QUANTITY_PER_UNIT = 1.0
+
+
+class RequirementError(Exception):
+    """Потребность не рассчитать; errors - список (order_id, причина)"""
+    def __init__(self, errors):
+        super().__init__("; ".join(f"заявка {order_id}: {reason}" for order_id, reason in errors))
+        self.errors = errors
+
+
+def material_requirement(units, quantity_per_unit, product_type_id, material_type_id=None):
+    """Сколько материала нужно на units единиц продукции, с округлением вверх.
+
+    Обратный расчет к calculate_products: норма на единицу умножается на коэффициент типа продукции
+    и делится на (1 - процент брака материала). Без material_type_id брак не учитывается; тип продукции
+    или материала без значения в справочнике - calculate.CoefficientError.
+    """
+    coefficient = calculate.product_coefficient(product_type_id)
+    defect_rate = calculate.defect_rate(material_type_id) if material_type_id is not None else 0.0
+    return math.ceil(units * quantity_per_unit * coefficient / (1 - defect_rate))
+
+
+def load_requirements(conn, orders):
+    """Потребность в материалах для заявок: {order_id: [(material_id, количество), ...]}
+
+    orders - строки (order_id, product_id, quantity); спецификации всех продуктов читаются одним запросом.
+    Заявки, для продукции которых нет коэффициентов, перечисляются в RequirementError.
+    """
+    #справочник коэффициентов мог измениться с прошлого расчета
+    calculate.load_coefficients(conn)
+    product_ids = sorted({product_id for _, product_id, _ in orders})
+    lines = defaultdict(list)
+    product_types = {}
+    for start in range(0, len(product_ids), 500):
+        chunk = product_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        for product_id, product_type_id in conn.execute(
+                f"SELECT product_id, product_type_id FROM products WHERE product_id IN ({placeholders})", chunk):
+            product_types[product_id] = product_type_id
+        for product_id, material_id, per_unit, material_type_id in conn.execute(f'''
+                SELECT product_id, material_id, quantity_per_unit, material_type_id
+                FROM product_materials WHERE product_id IN ({placeholders})''', chunk):
+            lines[product_id].append((material_id, per_unit, material_type_id))
+    requirements = {}
+    errors = []
+    for order_id, product_id, quantity in orders:
+        bom = lines.get(product_id)
+        if not bom:
+            requirements[order_id] = [(DEFAULT_MATERIAL_ID, math.ceil(quantity * DEFAULT_QUANTITY_PER_UNIT))]
+            continue
+        product_type_id = product_types.get(product_id)
+        try:
+            requirements[order_id] = [
+                (material_id, material_requirement(quantity, per_unit, product_type_id, material_type_id))
+                for material_id, per_unit, material_type_id in bom
+            ]
+        except calculate.CoefficientError as e:
+            errors.append((order_id, str(e)))
+    if errors:
+        raise RequirementError(errors)
+    return requirements
+
+
+def find_shortages(conn, requirements):
+    """Сравнивает общую потребность со складом одним запросом: [(material_id, нужно, на складе), ...]"""
+    needed = defaultdict(int)
+    for lines in requirements.values():
+        for material_id, quantity in lines:
+            needed[material_id] += quantity
+    if not needed:
+        return []
+    material_ids = list(needed)
+    stock = {}
+    for start in range(0, len(material_ids), 500):
+        chunk = material_ids[start:start + 500]
+        stock.update(conn.execute(
+            f"SELECT material_id, stock_quantity FROM materials WHERE material_id IN ({', '.join('?' * len(chunk))})",
+            chunk).fetchall())
+    return [(material_id, quantity, stock.get(material_id, 0))
+            for material_id, quantity in sorted(needed.items()) if stock.get(material_id, 0) < quantity]
+
+
+def reserve_materials(cursor, orders, requirements, today):
+    """Списывает материалы и пишет движения склада; вызывается в транзакции после find_shortages.
+
+    orders - строки (order_id, product_id, quantity). Возвращает число строк warehouse_movements.
+    """
+    needed = defaultdict(int)
+    movements = []
+    for order_id, product_id, _ in orders:
+        for material_id, quantity in requirements[order_id]:
+            needed[material_id] += quantity
+            movements.append((material_id, product_id, quantity, today))
+    cursor.executemany('UPDATE materials SET stock_quantity = stock_quantity - ? WHERE material_id = ?',
+                       [(quantity, material_id) for material_id, quantity in needed.items()])
+    cursor.executemany('''
+        INSERT INTO warehouse_movements (material_id, product_id, quantity, movement_type, date)
+        VALUES (?, ?, ?, 'outgoing', ?)
+    ''', movements)
+    return len(movements)
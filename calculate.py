@@ -1,9 +1,62 @@
+import bisect
 import math
 import random
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#кэш таблиц product_type_coefficients и material_defect_rates (см. load_coefficients). Значения ведутся
+#в product_type_coefficients.csv и material_defect_rates.csv рядом с программой: после правки файла
+#они попадают в БД при следующем запуске (импорт csv), а кэш перечитывается по версии справочника.
+#Словари не изменяются на месте, а заменяются целиком, поэтому их безопасно читать из любого потока;
+#до загрузки из БД действуют прежние значения
+PRODUCT_COEFFICIENTS = {1: 1.5, 2: 2.0}
+MATERIAL_DEFECT_RATES = {1: 0.1, 2: 0.2}
+_coefficients_version = None
+#границы объема продаж (не включая) и скидки в процентах для интервалов между ними
+DISCOUNT_THRESHOLDS = (10000, 50000, 300000)
+DISCOUNT_RATES = (0, 5, 10, 15)
+
+class CoefficientError(LookupError):
+    """Для типа продукции или материала нет значения в справочнике коэффициентов"""
+
+
+def product_coefficient(product_type_id):
+    try:
+        return PRODUCT_COEFFICIENTS[product_type_id]
+    except KeyError:
+        raise CoefficientError(f"Нет коэффициента для типа продукции {product_type_id} "
+                               f"(product_type_coefficients.csv)") from None
+
+
+def defect_rate(material_type_id):
+    try:
+        return MATERIAL_DEFECT_RATES[material_type_id]
+    except KeyError:
+        raise CoefficientError(f"Нет процента брака для типа материала {material_type_id} "
+                               f"(material_defect_rates.csv)") from None
+
+
+def load_coefficients(conn, force=False):
+    """Перечитывает коэффициенты из БД, если их версия в data_versions изменилась; True - кэш обновлен"""
+    global PRODUCT_COEFFICIENTS, MATERIAL_DEFECT_RATES, _coefficients_version
+    row = conn.execute("SELECT version FROM data_versions WHERE name = 'coefficients'").fetchone()
+    version = row[0] if row else 0
+    if not force and version == _coefficients_version:
+        return False
+    PRODUCT_COEFFICIENTS = dict(conn.execute(
+        "SELECT product_type_id, coefficient FROM product_type_coefficients").fetchall())
+    MATERIAL_DEFECT_RATES = dict(conn.execute(
+        "SELECT material_type_id, defect_rate FROM material_defect_rates").fetchall())
+    _coefficients_version = version
+    return True
 
 def calculate_products(product_type_id, material_type_id, total_material, param1, param2):
-    product_coefficients = {1: 1.5, 2: 2.0}
-    material_defect_rates = {1: 0.1, 2: 0.2}
+    product_coefficients = PRODUCT_COEFFICIENTS
+    material_defect_rates = MATERIAL_DEFECT_RATES
 
     if (product_type_id not in product_coefficients
         or material_type_id not in material_defect_rates
@@ -19,11 +72,61 @@ def calculate_products(product_type_id, material_type_id, total_material, param1
     return math.floor(total_products)
 
 def calculate_discount(total_quantity):
-    if total_quantity < 10000:
-        return 0
-    elif 10000 <= total_quantity < 50000:
-        return 5
-    elif 50000 <= total_quantity < 300000:
-        return 10
-    else:
-        return 15
+    #ступени общие с calculate_discount_batch и sales_totals.discount_sql
+    return DISCOUNT_RATES[bisect.bisect_right(DISCOUNT_THRESHOLDS, total_quantity)]
+
+#пакетные варианты: принимают массивы numpy, array.array, memoryview или списки одинаковой длины
+#и возвращают массив результатов (numpy.ndarray, если numpy установлен, иначе array.array('q'))
+#с той же семантикой, что и поэлементный вызов, включая -1 для некорректных данных
+
+def calculate_products_batch(product_type_ids, material_type_ids, total_materials, params1, params2):
+    if np is not None:
+        return _calculate_products_numpy(product_type_ids, material_type_ids, total_materials, params1, params2)
+    coefficients = PRODUCT_COEFFICIENTS
+    defect_rates = MATERIAL_DEFECT_RATES
+    floor = math.floor
+    return array('q', [
+        floor((total * (1 - defect_rates[material])) / (p1 * p2 * coefficients[product]))
+        if product in coefficients and material in defect_rates and total > 0 and p1 > 0 and p2 > 0
+        else -1
+        for product, material, total, p1, p2
+        in zip(product_type_ids, material_type_ids, total_materials, params1, params2)
+    ])
+
+def _calculate_products_numpy(product_type_ids, material_type_ids, total_materials, params1, params2):
+    products = np.asarray(product_type_ids)
+    materials = np.asarray(material_type_ids)
+    totals = np.asarray(total_materials, dtype=np.float64)
+    p1 = np.asarray(params1, dtype=np.float64)
+    p2 = np.asarray(params2, dtype=np.float64)
+
+    coefficients = _lookup_numpy(products, PRODUCT_COEFFICIENTS)
+    defect_rates = _lookup_numpy(materials, MATERIAL_DEFECT_RATES)
+
+    valid = ~np.isnan(coefficients) & ~np.isnan(defect_rates) & (totals > 0) & (p1 > 0) & (p2 > 0)
+    result = np.full(products.shape, -1, dtype=np.int64)
+    #порядок операций тот же, что в calculate_products, чтобы округление совпадало
+    material_per_unit = p1[valid] * p2[valid] * coefficients[valid]
+    result[valid] = np.floor((totals[valid] * (1 - defect_rates[valid])) / material_per_unit)
+    return result
+
+def _lookup_numpy(ids, table):
+    """Значения table для каждого id (NaN для отсутствующих) двоичным поиском по отсортированным ключам"""
+    if not table:
+        return np.full(ids.shape, np.nan)
+    keys = np.array(sorted(table), dtype=np.float64)
+    values = np.array([table[key] for key in sorted(table)], dtype=np.float64)
+    positions = np.clip(np.searchsorted(keys, ids), 0, len(keys) - 1)
+    return np.where(keys[positions] == ids, values[positions], np.nan)
+
+def calculate_discount_batch(total_quantities):
+    if np is not None:
+        tiers = np.searchsorted(DISCOUNT_THRESHOLDS, np.asarray(total_quantities), side='right')
+        return np.asarray(DISCOUNT_RATES, dtype=np.int64)[tiers]
+    #развернутые сравнения в чистом python заметно быстрее bisect на каждый элемент
+    low, middle, high = DISCOUNT_THRESHOLDS
+    none, small, medium, large = DISCOUNT_RATES
+    return array('q', [
+        none if quantity < low else small if quantity < middle else medium if quantity < high else large
+        for quantity in total_quantities
+    ])
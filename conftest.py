@@ -0,0 +1 @@
+#тесты лежат в tests/ и импортируют модули из корня репозитория (main, migrations, ...)
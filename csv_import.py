@@ -0,0 +1,646 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import sales_totals
+
+#сколько строк разбирается и вставляется за один executemany
+BATCH_SIZE = 5000
+#через сколько вставленных строк фиксируется транзакция
+COMMIT_EVERY = 100000
+#размер куска файла для параллельного разбора
+CHUNK_BYTES = 4 * 1024 * 1024
+
+SUPPLIER_HEADERS = ['type', 'name', 'inn']
+MATERIAL_HEADERS = ['type', 'name', 'supplier_id', 'package_quantity', 'unit', 'description', 'image', 'cost', 'stock_quantity', 'min_quantity']
+PARTNER_HEADERS = ['name', 'partner_type', 'rating', 'address', 'director_name', 'phone', 'email', 'inn', 'logo', 'sales_locations']
+PRODUCT_HEADERS = ['article', 'type', 'name', 'description', 'image', 'min_partner_price', 'package_length', 'package_width', 'package_height', 'weight_no_package', 'weight_with_package', 'certificate', 'standard_number', 'production_time', 'cost_price', 'workshop_number', 'labor_count', 'product_type_id', 'param1', 'param2']
+SALES_HEADERS = ['partner_id', 'product_id', 'quantity', 'sale_date']
+PRODUCT_MATERIAL_HEADERS = ['product_id', 'material_id', 'quantity_per_unit', 'material_type_id']
+PRODUCT_COEFFICIENT_HEADERS = ['product_type_id', 'coefficient']
+DEFECT_RATE_HEADERS = ['material_type_id', 'defect_rate']
+
+
+def _opt_int(value):
+    return int(value) if value else None
+
+
+def _opt_float(value):
+    return float(value) if value else None
+
+
+#преобразование строк csv (значения в порядке *_HEADERS) в кортежи для INSERT
+def convert_supplier(v):
+    return (v[0], v[1], v[2] or None)
+
+
+def convert_material(v):
+    return (v[0], v[1], _opt_int(v[2]), _opt_int(v[3]), v[4] or None, v[5] or None, v[6] or None,
+            float(v[7]), int(v[8]), _opt_int(v[9]))
+
+
+def convert_partner(v):
+    return (v[0], v[1], int(v[2]), v[3] or None, v[4] or None, v[5] or None, v[6] or None,
+            v[7] or None, v[8] or None, v[9] or None)
+
+
+def convert_product(v):
+    return (v[0], v[1], v[2], v[3] or None, v[4] or None, float(v[5]),
+            _opt_float(v[6]), _opt_float(v[7]), _opt_float(v[8]), _opt_float(v[9]), _opt_float(v[10]),
+            v[11] or None, v[12] or None, _opt_int(v[13]), _opt_float(v[14]), _opt_int(v[15]), _opt_int(v[16]),
+            int(v[17]), float(v[18]), float(v[19]))
+
+
+def convert_sale(v):
+    return (int(v[0]), int(v[1]), int(v[2]), v[3])
+
+
+def convert_product_material(v):
+    return (int(v[0]), int(v[1]), float(v[2]), _opt_int(v[3]))
+
+
+#справочники для calculate.py: строка с пустым значением (оно еще не утверждено) пропускается,
+#и расчеты по такому типу завершаются ошибкой, а не идут с выдуманным коэффициентом
+def convert_coefficient(v):
+    return (int(v[0]), float(v[1]))
+
+
+#таблица импорта: порядок в TABLES соблюдает внешние ключи
+TableSpec = namedtuple('TableSpec', 'table file_name headers convert insert_sql required')
+
+TABLES = [
+    TableSpec('suppliers', 'suppliers.csv', SUPPLIER_HEADERS, convert_supplier,
+              'INSERT OR IGNORE INTO suppliers (type, name, inn) VALUES (?, ?, ?)', False),
+    TableSpec('materials', 'materials.csv', MATERIAL_HEADERS, convert_material,
+              '''INSERT OR IGNORE INTO materials (type, name, supplier_id, package_quantity, unit, description, image, cost, stock_quantity, min_quantity)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', True),
+    TableSpec('partners', 'partners.csv', PARTNER_HEADERS, convert_partner,
+              '''INSERT INTO partners (name, partner_type, rating, address, director_name, phone, email, inn, logo, sales_locations)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', True),
+    TableSpec('products', 'products.csv', PRODUCT_HEADERS, convert_product,
+              '''INSERT OR IGNORE INTO products (article, type, name, description, image, min_partner_price, package_length, package_width, package_height, weight_no_package, weight_with_package, certificate, standard_number, production_time, cost_price, workshop_number, labor_count, product_type_id, param1, param2)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', True),
+    TableSpec('sales', 'sales.csv', SALES_HEADERS, convert_sale,
+              'INSERT OR IGNORE INTO sales (partner_id, product_id, quantity, sale_date) VALUES (?, ?, ?, ?)', True),
+    TableSpec('product_materials', 'product_materials.csv', PRODUCT_MATERIAL_HEADERS, convert_product_material,
+              '''INSERT OR REPLACE INTO product_materials (product_id, material_id, quantity_per_unit, material_type_id)
+                 VALUES (?, ?, ?, ?)''', False),
+    TableSpec('product_type_coefficients', 'product_type_coefficients.csv', PRODUCT_COEFFICIENT_HEADERS,
+              convert_coefficient,
+              'INSERT OR REPLACE INTO product_type_coefficients (product_type_id, coefficient) VALUES (?, ?)', True),
+    TableSpec('material_defect_rates', 'material_defect_rates.csv', DEFECT_RATE_HEADERS, convert_coefficient,
+              'INSERT OR REPLACE INTO material_defect_rates (material_type_id, defect_rate) VALUES (?, ?)', True),
+]
+
+
+#таблицы с естественным ключом: повторный импорт перезаписывает строки по ключу (INSERT OR REPLACE).
+#У остальных ключа в файле нет, и IncrementalImporter запоминает в import_rows, какие строки загружены
+#из какого файла (rowid у этих таблиц AUTOINCREMENT и не переиспользуется)
+KEYED_TABLES = ('product_materials', 'product_type_coefficients', 'material_defect_rates')
+#естественные ключи строк: измененная строка файла обновляет прежнюю строку таблицы на месте, только если
+#совпадает ключ (id не меняется, ссылки продаж и заявок остаются верными). Остальные измененные строки
+#удаляются и вставляются заново - удаление строки, на которую уже ссылаются, отклоняет RESTRICT
+NATURAL_KEYS = {
+    'suppliers': ('inn',),
+    'materials': ('name', 'supplier_id'),
+    'partners': ('inn',),
+    'products': ('article',),
+}
+
+
+#позиции нужных колонок в заголовке файла; ValueError если каких-то нет
+def header_positions(fieldnames, expected_headers, file_name):
+    missing = [h for h in expected_headers if h not in fieldnames]
+    if missing:
+        raise ValueError(f"Неправильные заголовки в {file_name}. Expected: {expected_headers}, Found: {fieldnames}")
+    return [fieldnames.index(h) for h in expected_headers]
+
+
+#разбор пачки сырых строк: возвращает (кортежи для вставки, число отброшенных строк)
+def convert_rows(raw_rows, positions, convert):
+    rows = []
+    rejected = 0
+    for raw in raw_rows:
+        if not raw:
+            continue
+        try:
+            rows.append(convert([raw[i] for i in positions]))
+        except (ValueError, IndexError, TypeError):
+            rejected += 1
+    return rows, rejected
+
+
+#строки файла от текущей позиции до end байт; hasher (если задан) получает прочитанные байты
+def _decoded_lines(f, end=None, hasher=None):
+    position = f.tell()
+    for line in f:
+        if end is not None and position >= end:
+            return
+        if end is not None and position + len(line) > end:
+            line = line[:end - position]
+        position += len(line)
+        if hasher is not None:
+            hasher.update(line)
+        yield line.decode('utf-8')
+
+
+#однократное потоковое чтение файла пачками уже преобразованных строк
+#start/end - байтовый диапазон строк данных (по умолчанию весь файл после заголовка)
+def read_batches(path, spec, batch_size=BATCH_SIZE, start=None, end=None, hasher=None):
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if hasher is not None and not start:
+            hasher.update(header)
+        positions = header_positions(next(csv.reader([header.decode('utf-8')]), []), spec.headers, spec.file_name)
+        if start:
+            f.seek(start)
+        reader = csv.reader(_decoded_lines(f, end, hasher))
+        raw_rows = []
+        for raw in reader:
+            raw_rows.append(raw)
+            if len(raw_rows) >= batch_size:
+                yield convert_rows(raw_rows, positions, spec.convert)
+                raw_rows = []
+        if raw_rows:
+            yield convert_rows(raw_rows, positions, spec.convert)
+
+
+#импорт всех csv в одном соединении: executemany пачками, фиксация каждые commit_every строк.
+#Итоги по таблицам - в stats, ошибки файлов - в warnings (возвращаются из run); ход импорта
+#передается в report(сообщение), если вызывающий его задал (CLI - print)
+class BulkImporter:
+    def __init__(self, conn, csv_dir, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY, report=None):
+        self.conn = conn
+        self.report = report or (lambda message: None)
+        self.csv_dir = csv_dir
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.warnings = []
+        self.stats = {}
+        self._uncommitted = 0
+        self._savepoints = 0
+
+    def run(self):
+        cursor = self.conn.cursor()
+        #надежность записи не нужна на время импорта: при сбое импорт просто повторится
+        synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+        cursor.execute("PRAGMA synchronous = OFF")
+        try:
+            self._import_all()
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.execute(f"PRAGMA synchronous = {synchronous}")
+            cursor.close()
+        return self.warnings
+
+    #пути к существующим файлам в порядке TABLES; об отсутствующих обязательных - предупреждение
+    def _existing_files(self):
+        for spec in TABLES:
+            path = os.path.join(self.csv_dir, spec.file_name)
+            if os.path.exists(path):
+                yield spec, path
+            elif spec.required:
+                self.warnings.append(f"{spec.file_name} not found at {path}")
+
+    def _import_all(self):
+        for spec, path in self._existing_files():
+            try:
+                self.import_table(spec, read_batches(path, spec, self.batch_size))
+            except ValueError as e:
+                self.warnings.append(f"Ошибка импорта {spec.file_name}: {str(e)}")
+
+    def import_table(self, spec, batches):
+        started = time.perf_counter()
+        self._prepare(spec)
+        #итоги продаж пересчитываются один раз после вставки, а не триггером на каждую строку
+        partner_ids = self._suspend_sales_totals() if spec.table == 'sales' else None
+        inserted = 0
+        skipped = 0
+        for rows, rejected in batches:
+            accepted = self._accept(spec, rows)
+            skipped += rejected + len(rows) - len(accepted)
+            if accepted:
+                count = self._insert(spec.insert_sql, accepted)
+                inserted += count
+                self._uncommitted += count
+                if partner_ids is not None:
+                    partner_ids.update(r[0] for r in accepted)
+            #пока триггеры итогов сняты, продажи вставляются одной транзакцией
+            if self._uncommitted >= self.commit_every and partner_ids is None:
+                self.conn.commit()
+                self._uncommitted = 0
+        if partner_ids is not None:
+            self._resume_sales_totals(partner_ids)
+        elapsed = time.perf_counter() - started
+        self.stats[spec.table] = {
+            'inserted': inserted,
+            'skipped': skipped,
+            'seconds': elapsed,
+            'rows_per_sec': (inserted + skipped) / elapsed if elapsed > 0 else 0.0,
+        }
+        self.report(f"Imported {inserted} rows from {spec.file_name} (skipped {skipped}, "
+              f"{self.stats[spec.table]['rows_per_sec']:.0f} rows/sec)")
+        return inserted
+
+    #снимает триггеры partner_sales_totals внутри текущей транзакции; None - таблицы итогов нет
+    def _suspend_sales_totals(self):
+        if not self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'partner_sales_totals'").fetchone():
+            return None
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        cursor = self.conn.cursor()
+        sales_totals.drop_triggers(cursor)
+        cursor.close()
+        return set()
+
+    def _resume_sales_totals(self, partner_ids):
+        cursor = self.conn.cursor()
+        sales_totals.rebuild_totals(cursor, partner_ids)
+        sales_totals.create_triggers(cursor)
+        cursor.close()
+
+    #предзагрузка множеств для проверки внешних ключей и дублей без запросов на каждую строку
+    def _prepare(self, spec):
+        cursor = self.conn.cursor()
+        if spec.table == 'materials':
+            self.valid_supplier_ids = {row[0] for row in cursor.execute("SELECT supplier_id FROM suppliers")}
+        elif spec.table == 'partners':
+            self.partner_names = set()
+            self.partner_inns = set()
+            for name, inn in cursor.execute("SELECT name, inn FROM partners"):
+                self.partner_names.add(name)
+                if inn is not None:
+                    self.partner_inns.add(inn)
+        elif spec.table == 'sales':
+            self.valid_partner_ids = {row[0] for row in cursor.execute("SELECT partner_id FROM partners")}
+            self.valid_product_ids = {row[0] for row in cursor.execute("SELECT product_id FROM products")}
+        cursor.close()
+
+    def _accept(self, spec, rows):
+        if spec.table == 'materials':
+            return [r for r in rows if r[2] is None or r[2] in self.valid_supplier_ids]
+        if spec.table == 'partners':
+            accepted = []
+            for r in rows:
+                name, inn = r[0], r[7]
+                if name in self.partner_names or (inn is not None and inn in self.partner_inns):
+                    continue
+                self.partner_names.add(name)
+                if inn is not None:
+                    self.partner_inns.add(inn)
+                accepted.append(r)
+            return accepted
+        if spec.table == 'sales':
+            return [r for r in rows if r[0] in self.valid_partner_ids and r[1] in self.valid_product_ids]
+        return rows
+
+    #executemany в savepoint; если пачка не прошла целиком, вставляем ее построчно, пропуская плохие строки
+    def _insert(self, sql, rows):
+        self._savepoints += 1
+        savepoint = f"import_batch_{self._savepoints}"
+        cursor = self.conn.cursor()
+        cursor.execute(f"SAVEPOINT {savepoint}")
+        try:
+            cursor.executemany(sql, rows)
+            inserted = cursor.rowcount
+        except sqlite3.Error:
+            cursor.execute(f"ROLLBACK TO {savepoint}")
+            inserted = 0
+            for row in rows:
+                try:
+                    cursor.execute(sql, row)
+                    inserted += cursor.rowcount
+                except sqlite3.Error as e:
+                    self.report(f"Error importing row {row}: {str(e)}")
+        cursor.execute(f"RELEASE {savepoint}")
+        cursor.close()
+        return inserted
+
+
+#деление файла на куски по границам строк: (заголовок, [(начало, конец), ...] в байтах)
+#поля с переводом строки внутри кавычек не поддерживаются - в наших выгрузках их нет
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8')
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+#разбор одного куска файла в процессе-обработчике
+def parse_range(path, start, end, positions, convert):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+    return convert_rows(reader, positions, convert)
+
+
+_END_OF_TABLE = object()
+
+
+#импорт с разбором кусков файлов в пуле процессов; в базу пишет один поток-писатель,
+#таблицы по-прежнему идут в порядке TABLES (suppliers -> materials -> partners -> products -> sales)
+class ParallelImporter(BulkImporter):
+    def __init__(self, conn, csv_dir, workers=None, chunk_bytes=CHUNK_BYTES, **kwargs):
+        super().__init__(conn, csv_dir, **kwargs)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_bytes = chunk_bytes
+        self._writer_error = None
+
+    def _import_all(self):
+        #ограниченная очередь: разбор не убегает от записи больше чем на пару кусков на процесс
+        batches = queue.Queue(maxsize=self.workers * 2)
+        writer = threading.Thread(target=self._writer, args=(batches,), name='csv-import-writer')
+        writer.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for spec, path in self._existing_files():
+                    try:
+                        header, ranges = split_ranges(path, self.chunk_bytes)
+                        positions = header_positions(next(csv.reader([header]), []), spec.headers, spec.file_name)
+                    except ValueError as e:
+                        self.warnings.append(f"Ошибка импорта {spec.file_name}: {str(e)}")
+                        continue
+                    batches.put(spec)
+                    pending = deque()
+                    try:
+                        for start, end in ranges:
+                            pending.append(executor.submit(parse_range, path, start, end, positions, spec.convert))
+                            if len(pending) >= self.workers * 2:
+                                batches.put(pending.popleft().result())
+                        while pending:
+                            batches.put(pending.popleft().result())
+                    except ValueError as e:
+                        #как в последовательном импорте (например, UnicodeDecodeError): остаток файла
+                        #пропускается с предупреждением, писатель получает конец таблицы
+                        for future in pending:
+                            future.cancel()
+                        self.warnings.append(f"Ошибка импорта {spec.file_name}: {str(e)}")
+                    batches.put(_END_OF_TABLE)
+                    if self._writer_error:
+                        break
+        finally:
+            batches.put(None)
+            writer.join()
+        if self._writer_error:
+            raise self._writer_error
+
+    def _writer(self, batches):
+        finished = False
+        while not finished:
+            spec = batches.get()
+            if spec is None:
+                return
+            if self._writer_error:
+                continue
+
+            def table_batches():
+                nonlocal finished
+                while True:
+                    item = batches.get()
+                    if item is _END_OF_TABLE:
+                        return
+                    if item is None:
+                        #разбор прерван посреди таблицы: больше в очереди ничего не будет
+                        finished = True
+                        return
+                    yield item
+
+            items = table_batches()
+            try:
+                self.import_table(spec, items)
+            except Exception as e:
+                self._writer_error = e
+                #дочитываем очередь, чтобы не заблокировать разбор
+                for _ in items:
+                    pass
+
+
+#sha256 первых length байт файла; возвращается сам объект хеша, чтобы продолжить его дописанными байтами
+def hash_prefix(path, length):
+    hasher = hashlib.sha256()
+    remaining = length
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+#инкрементальный импорт: для каждого файла в import_checkpoints хранятся размер, mtime,
+#sha256 и смещение уже импортированной части. Неизмененный файл пропускается без чтения,
+#у дописанного читается только хвост. Измененный файл сверяется со строками, которые из него загружены
+#(import_rows): совпавшие остаются, измененные обновляются на месте (id не меняются - на них ссылаются
+#другие файлы), новые добавляются, исчезнувшие удаляются - все одной транзакцией
+class IncrementalImporter(BulkImporter):
+    def __init__(self, conn, csv_dir, **kwargs):
+        #строки и контрольная точка файла фиксируются одной транзакцией
+        kwargs.setdefault('commit_every', float('inf'))
+        super().__init__(conn, csv_dir, **kwargs)
+        self.unchanged_files = []
+
+    def _import_all(self):
+        for spec, path in self._existing_files():
+            try:
+                self._import_file(spec, path)
+            except ValueError as e:
+                self.conn.rollback()
+                self.warnings.append(f"Ошибка импорта {spec.file_name}: {str(e)}")
+
+    def _import_file(self, spec, path):
+        stat = os.stat(path)
+        checkpoint = self.conn.execute(
+            "SELECT size, mtime, content_hash, offset FROM import_checkpoints WHERE file_name = ?",
+            (spec.file_name,)).fetchone()
+
+        #строки таблиц с ключом файл перезаписывает по ключу, поэтому такой файл просто импортируется
+        if checkpoint is None and spec.table not in KEYED_TABLES and self._table_has_rows(spec.table):
+            #база заполнена полным импортом до появления контрольных точек - считаем файл импортированным
+            #и запоминаем совпадающие с его строками строки таблицы
+            hasher = hashlib.sha256()
+            self._adopt_rows(spec, path, stat, hasher)
+            self._save_checkpoint(spec.file_name, stat, hasher.hexdigest(), stat.st_size)
+            self.conn.commit()
+            self.unchanged_files.append(spec.file_name)
+            return
+
+        if checkpoint is not None:
+            size, mtime, content_hash, offset = checkpoint
+            if size == stat.st_size and mtime == stat.st_mtime_ns:
+                self.unchanged_files.append(spec.file_name)
+                return
+            if stat.st_size >= offset:
+                hasher = hash_prefix(path, offset)
+                if hasher.hexdigest() == content_hash:
+                    if stat.st_size > offset:
+                        self.report(f"{spec.file_name}: импорт дописанных строк с байта {offset}")
+                        self._import_tracked(spec, read_batches(path, spec, self.batch_size, offset, stat.st_size, hasher))
+                    self._save_checkpoint(spec.file_name, stat, hasher.hexdigest(), stat.st_size)
+                    self.conn.commit()
+                    return
+            self.report(f"{spec.file_name}: содержимое изменилось, файл импортируется заново")
+            if spec.table not in KEYED_TABLES:
+                hasher = hashlib.sha256()
+                self._sync_rows(spec, path, stat, hasher)
+                self._save_checkpoint(spec.file_name, stat, hasher.hexdigest(), stat.st_size)
+                self.conn.commit()
+                return
+
+        hasher = hashlib.sha256()
+        self._import_tracked(spec, read_batches(path, spec, self.batch_size, end=stat.st_size, hasher=hasher))
+        self._save_checkpoint(spec.file_name, stat, hasher.hexdigest(), stat.st_size)
+        self.conn.commit()
+
+    def _begin(self):
+        #блокировка записи сразу: новые rowid в таблице до конца транзакции появляются только от импорта
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+    #вставка строк файла с записью их rowid в import_rows
+    def _import_tracked(self, spec, batches):
+        if spec.table in KEYED_TABLES:
+            return self.import_table(spec, batches)
+        self._begin()
+        last_id = self.conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {spec.table}").fetchone()[0]
+        inserted = self.import_table(spec, batches)
+        self.conn.execute(f"INSERT INTO import_rows (file_name, row_id) SELECT ?, rowid FROM {spec.table} WHERE rowid > ?",
+                          (spec.file_name, last_id))
+        return inserted
+
+    def _read_rows(self, spec, path, stat, hasher):
+        rows = []
+        for batch, _ in read_batches(path, spec, self.batch_size, end=stat.st_size, hasher=hasher):
+            rows += batch
+        return rows
+
+    #{строка в виде кортежа: очередь rowid} для строк таблицы из select (rowid, столбцы файла...)
+    def _rows_by_content(self, select, params=()):
+        by_content = {}
+        for row_id, *values in self.conn.execute(select, params):
+            by_content.setdefault(tuple(values), deque()).append(row_id)
+        return by_content
+
+    def _adopt_rows(self, spec, path, stat, hasher):
+        rows = self._read_rows(spec, path, stat, hasher)
+        self._begin()
+        by_content = self._rows_by_content(
+            f"SELECT rowid, {', '.join(spec.headers)} FROM {spec.table} ORDER BY rowid")
+        adopted = []
+        for row in rows:
+            ids = by_content.get(row)
+            if ids:
+                adopted.append((spec.file_name, ids.popleft()))
+        self.conn.executemany("INSERT OR IGNORE INTO import_rows (file_name, row_id) VALUES (?, ?)", adopted)
+
+    def _sync_rows(self, spec, path, stat, hasher):
+        rows = self._read_rows(spec, path, stat, hasher)
+        self._begin()
+        by_content = self._rows_by_content(f'''
+            SELECT t.rowid, {', '.join(f"t.{column}" for column in spec.headers)}
+            FROM {spec.table} t
+            JOIN import_rows r ON r.row_id = t.rowid
+            WHERE r.file_name = ?
+        ''', (spec.file_name,))
+        added = []
+        for row in rows:
+            ids = by_content.get(row)
+            if ids:
+                ids.popleft()
+            else:
+                added.append(row)
+        #прежние строки, которых больше нет в файле в том же виде: строка с тем же естественным ключом
+        #обновляется на месте, остальные удаляются, а новые строки файла вставляются
+        positions = [spec.headers.index(column) for column in NATURAL_KEYS.get(spec.table, ())]
+        by_key = {}
+        removed = []
+        for content, ids in by_content.items():
+            key = tuple(content[i] for i in positions)
+            for row_id in ids:
+                if positions and None not in key:
+                    by_key.setdefault(key, deque()).append(row_id)
+                else:
+                    removed.append(row_id)
+        updated = []
+        inserted_rows = []
+        for row in added:
+            ids = by_key.get(tuple(row[i] for i in positions)) if positions else None
+            if ids:
+                updated.append((row, ids.popleft()))
+            else:
+                inserted_rows.append(row)
+        removed += [row_id for ids in by_key.values() for row_id in ids]
+        added = inserted_rows
+        try:
+            self.conn.executemany(f"DELETE FROM {spec.table} WHERE rowid = ?", [(row_id,) for row_id in removed])
+            self.conn.executemany(
+                f"UPDATE {spec.table} SET {', '.join(f'{column} = ?' for column in spec.headers)} WHERE rowid = ?",
+                [(*row, row_id) for row, row_id in updated])
+        except sqlite3.IntegrityError as e:
+            #например, удаляемая продукция уже есть в продажах или заявках; файл откатывается целиком
+            raise ValueError(f"строки файла нельзя обновить или удалить: {str(e)}") from e
+        self.conn.executemany("DELETE FROM import_rows WHERE file_name = ? AND row_id = ?",
+                              [(spec.file_name, row_id) for row_id in removed])
+        inserted = self._import_tracked(spec, [(added, 0)]) if added else 0
+        stats = self.stats.setdefault(spec.table, {'inserted': 0, 'skipped': 0, 'seconds': 0.0, 'rows_per_sec': 0.0})
+        stats.update(unchanged=len(rows) - len(updated) - len(added), updated=len(updated), deleted=len(removed))
+        self.report(f"{spec.file_name}: без изменений {stats['unchanged']}, обновлено {len(updated)}, "
+                    f"добавлено {inserted}, удалено {len(removed)}")
+
+    def _table_has_rows(self, table):
+        return self.conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0] == 1
+
+    def _save_checkpoint(self, file_name, stat, content_hash, offset):
+        self.conn.execute('''
+            INSERT INTO import_checkpoints (file_name, size, mtime, content_hash, offset, imported_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ON CONFLICT(file_name) DO UPDATE SET
+                size = excluded.size, mtime = excluded.mtime, content_hash = excluded.content_hash,
+                offset = excluded.offset, imported_at = excluded.imported_at
+        ''', (file_name, stat.st_size, stat.st_mtime_ns, content_hash, offset))
+
+
+if __name__ == "__main__":
+    from data_access import ConnectionPool, STORAGE_PROFILES
+    from main import DB_FILE, SCRIPT_DIRECTORY, create_database
+    from migrations import apply_migrations
+
+    parser = argparse.ArgumentParser(description="Импорт csv файлов в базу данных")
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--csv-dir', default=SCRIPT_DIRECTORY)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="процессов для разбора csv; 1 - последовательный импорт")
+    args = parser.parse_args()
+
+    create_database(args.db)
+    pool = ConnectionPool(args.db, pragmas=STORAGE_PROFILES['bulk-import'])
+    apply_migrations(pool.connection())
+    if args.workers > 1:
+        importer = ParallelImporter(pool.connection(), args.csv_dir, workers=args.workers, report=print)
+    else:
+        importer = BulkImporter(pool.connection(), args.csv_dir, report=print)
+    for warning in importer.run():
+        print(f"Предупреждение: {warning}")
+    pool.close_all()
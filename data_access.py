@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+#PRAGMA, которые применяются к каждому новому соединению
+DEFAULT_PRAGMAS = {
+    'foreign_keys': 'ON',
+}
+
+#профили хранения: набор PRAGMA под разные сценарии работы с db.db
+STORAGE_PROFILES = {
+    #обычная работа менеджера: WAL, чтобы чтение не ждало запись
+    'desktop': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 67108864,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    #массовый импорт csv: максимум скорости записи, допускаем потерю последних транзакций при сбое питания
+    'bulk-import': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -131072,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+    #отчеты и просмотр больших таблиц
+    'read-heavy': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+
+DEFAULT_STORAGE_PROFILE = 'desktop'
+
+
+#чтение профиля хранения из json файла вида {"profile": "desktop", "pragmas": {...}}
+def load_storage_config(config_file):
+    profile = DEFAULT_STORAGE_PROFILE
+    overrides = {}
+    if config_file and os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        profile = config.get('profile', profile)
+        overrides = config.get('pragmas') or {}
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Неизвестный профиль хранения: {profile}. Доступны: {', '.join(STORAGE_PROFILES)}")
+    pragmas = dict(STORAGE_PROFILES[profile])
+    pragmas.update(overrides)
+    return profile, pragmas
+
+
+#сколько подготовленных запросов держит каждое соединение
+DEFAULT_CACHED_STATEMENTS = 256
+
+
+#пул долгоживущих соединений: одно соединение на поток, открывается один раз
+class ConnectionPool:
+    def __init__(self, db_file, pragmas=None, cached_statements=DEFAULT_CACHED_STATEMENTS):
+        self.db_file = db_file
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.cached_statements = cached_statements
+        self.connections_opened = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._known_tables = set()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_file, cached_statements=self.cached_statements, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._connections.append(conn)
+            self.connections_opened += 1
+        return conn
+
+    def connection(self):
+        """Возвращает соединение текущего потока, открывая его при первом обращении"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def cursor(self):
+        return self.connection().cursor()
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def fetchone(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """Курсор внутри транзакции: commit при успехе, rollback при ошибке"""
+        conn = self.connection()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def table_exists(self, table_name):
+        #таблицы не удаляются во время работы, поэтому кешируем только найденные
+        if table_name in self._known_tables:
+            return True
+        row = self.fetchone("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if row is not None:
+            self._known_tables.add(table_name)
+            return True
+        return False
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                #обновляет статистику индексов (sqlite_stat1) по таблицам, которые читало соединение,
+                #если ее нет или таблица сильно выросла
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+        self._known_tables.clear()
+
+
+_pools = {}
+_pool_settings = {}
+_pools_lock = threading.Lock()
+
+
+#общий пул для файла базы данных (один на процесс)
+def get_pool(db_file, **kwargs):
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            settings = dict(_pool_settings.get(db_file, {}))
+            settings.update(kwargs)
+            pool = ConnectionPool(db_file, **settings)
+            _pools[db_file] = pool
+        return pool
+
+
+#задает PRAGMA пула по профилю хранения; уже открытые соединения пула закрываются
+def configure_pool(db_file, profile=DEFAULT_STORAGE_PROFILE, pragmas=None, **kwargs):
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Неизвестный профиль хранения: {profile}")
+    settings = dict(STORAGE_PROFILES[profile])
+    if pragmas:
+        settings.update(pragmas)
+    with _pools_lock:
+        _pool_settings[db_file] = dict(kwargs, pragmas=settings)
+        pool = _pools.pop(db_file, None)
+    if pool is not None:
+        pool.close_all()
+
+
+#суммарное число открытых соединений по всем пулам
+def connections_opened():
+    with _pools_lock:
+        return sum(pool.connections_opened for pool in _pools.values())
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
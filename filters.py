@@ -0,0 +1,185 @@
+import tkinter as tk
+from datetime import datetime, timedelta
+from tkinter import ttk
+
+#задержка перед применением фильтра после ввода, мс: запрос уходит, когда пользователь перестал печатать
+DEBOUNCE_MS = 250
+#верхняя граница для поиска по началу строки: "текст" <= значение < "текст" + U+10FFFF
+PREFIX_END = '\U0010ffff'
+DATE_FORMAT = "%Y-%m-%d"
+
+
+#Описание фильтра: fields - подписи полей ввода, conditions(values) по введенным строкам
+#возвращает (список условий SQL, параметры). Пустые и неразборчивые значения условий не дают.
+#Все условия параметризованы и рассчитаны на индекс: поиск по началу строки идет диапазоном,
+#а не LIKE '%...%', даты и числа - сравнением.
+
+class PrefixFilter:
+    """Поиск по началу строки; template оборачивает условие, например в подзапрос к справочнику"""
+    def __init__(self, label, column, template=None):
+        self.fields = (label,)
+        self.column = column
+        self.template = template
+        self.choices = None
+
+    def conditions(self, values):
+        text = values[0].strip()
+        if not text:
+            return [], []
+        #в SQLite сравнение кириллицы чувствительно к регистру, поэтому ищется и вариант с заглавной буквы
+        variants = list(dict.fromkeys((text, text[:1].upper() + text[1:])))
+        condition = " OR ".join(f"({self.column} >= ? AND {self.column} < ?)" for _ in variants)
+        params = [bound for variant in variants for bound in (variant, variant + PREFIX_END)]
+        if self.template:
+            condition = self.template.format(condition)
+        return [f"({condition})"], params
+
+
+class ChoiceFilter:
+    """Точное совпадение; при заданных choices поле - выпадающий список"""
+    operator = "="
+
+    def __init__(self, label, column, choices=None, convert=str):
+        self.fields = (label,)
+        self.column = column
+        self.choices = choices
+        self.convert = convert
+
+    def conditions(self, values):
+        text = values[0].strip()
+        if not text:
+            return [], []
+        try:
+            value = self.convert(text)
+        except ValueError:
+            return [], []
+        return [f"{self.column} {self.operator} ?"], [value]
+
+
+class MinFilter(ChoiceFilter):
+    """Значение не меньше введенного"""
+    operator = ">="
+
+    def __init__(self, label, column, convert=int):
+        super().__init__(label, column, convert=convert)
+
+
+class DateRangeFilter:
+    """Период 'ГГГГ-ММ-ДД' - 'ГГГГ-ММ-ДД' включительно; подходит и для дат со временем"""
+    def __init__(self, label, column):
+        self.fields = (f"{label} с", "по")
+        self.column = column
+        self.choices = None
+
+    def bounds(self, values):
+        """(начало, конец) периода для column >= начало AND column < конец; None - граница не задана"""
+        start, end = (_parse_date(value) for value in values)
+        #"по" включительно: все до начала следующего дня
+        return (start.strftime(DATE_FORMAT) if start is not None else None,
+                (end + timedelta(days=1)).strftime(DATE_FORMAT) if end is not None else None)
+
+    def conditions(self, values):
+        conditions, params = [], []
+        start, end = self.bounds(values)
+        if start is not None:
+            conditions.append(f"{self.column} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{self.column} < ?")
+            params.append(end)
+        return conditions, params
+
+
+def _parse_date(text):
+    try:
+        return datetime.strptime(text.strip(), DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def build_conditions(specs, values):
+    """Условия всех фильтров; values - по списку строк на каждый фильтр"""
+    conditions, params = [], []
+    for spec, spec_values in zip(specs, values):
+        spec_conditions, spec_params = spec.conditions(spec_values)
+        conditions += spec_conditions
+        params += spec_params
+    return conditions, params
+
+
+def build_ranges(specs, values):
+    """{столбец: (начало, конец)} заданных периодов (DateRangeFilter)"""
+    ranges = {}
+    for spec, spec_values in zip(specs, values):
+        if isinstance(spec, DateRangeFilter):
+            start, end = spec.bounds(spec_values)
+            if start is not None or end is not None:
+                ranges[spec.column] = (start, end)
+    return ranges
+
+
+#панель фильтров над VirtualTable: после каждого изменения (с задержкой DEBOUNCE_MS)
+#собирает условия (и периоды дат) и передает их в view.set_query; собственные условия таблицы сохраняются
+class FilterBar(ttk.Frame):
+    def __init__(self, parent, view, specs, debounce_ms=DEBOUNCE_MS):
+        super().__init__(parent)
+        self.view = view
+        self.specs = specs
+        self.debounce_ms = debounce_ms
+        self.base_where = list(view.where)
+        self.base_params = tuple(view.params)
+        self._after_id = None
+        self._applied = (self.base_where, self.base_params)
+
+        self.variables = []
+        self.widgets = []
+        column = 0
+        for spec in specs:
+            spec_variables = []
+            spec_widgets = []
+            for label in spec.fields:
+                ttk.Label(self, text=label).grid(row=0, column=column, padx=(5, 2))
+                variable = tk.StringVar()
+                if spec.choices is not None:
+                    widget = ttk.Combobox(self, textvariable=variable, values=[""] + list(spec.choices),
+                                          state="readonly", width=14)
+                else:
+                    widget = ttk.Entry(self, textvariable=variable, width=14)
+                widget.grid(row=0, column=column + 1, padx=(0, 5))
+                column += 2
+                variable.trace_add("write", self._changed)
+                spec_variables.append(variable)
+                spec_widgets.append(widget)
+            self.variables.append(spec_variables)
+            self.widgets.append(spec_widgets)
+        ttk.Button(self, text="Сбросить", command=self.clear).grid(row=0, column=column, padx=5)
+
+    def set_choices(self, spec, choices):
+        """Заменяет варианты выпадающего списка фильтра spec (например, после загрузки в фоне)"""
+        spec.choices = list(choices)
+        for widget in self.widgets[self.specs.index(spec)]:
+            widget.configure(values=[""] + spec.choices)
+
+    def values(self):
+        return [[variable.get() for variable in spec_variables] for spec_variables in self.variables]
+
+    def clear(self):
+        for spec_variables in self.variables:
+            for variable in spec_variables:
+                variable.set("")
+
+    def _changed(self, *args):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+        self._after_id = self.after(self.debounce_ms, self.apply)
+
+    def apply(self):
+        self._after_id = None
+        values = self.values()
+        conditions, params = build_conditions(self.specs, values)
+        query = (self.base_where + conditions, self.base_params + tuple(params))
+        #ввод, который не меняет условий (например, неполная дата), таблицу не перезагружает
+        if query == self._applied:
+            return
+        self._applied = query
+        self.view.set_query(*query, ranges=build_ranges(self.specs, values))
@@ -5,7 +5,24 @@ import os
 import sys
 import sqlite3
 from datetime import datetime, timedelta
-from calculate import calculate_discount, calculate_products
+from calculate import calculate_products, load_coefficients
+from data_access import get_pool, configure_pool, load_storage_config, connections_opened, close_all_pools
+from migrations import apply_migrations, prune_change_log
+from csv_import import IncrementalImporter
+from virtual_table import VirtualTable
+from filters import FilterBar, PrefixFilter, ChoiceFilter, MinFilter, DateRangeFilter
+from search import SearchBox, search_partners, search_products
+from reference_cache import ReferenceCombobox, get_reference_cache, REFERENCES
+from pricing import get_pricing_engine, reprice_open_orders, PricingError
+from access_partitions import PartitionedAccessTable, apply_retention, default_archive_dir, delete_access_log
+from access_analytics import update_sessions, daily_presence, door_occupancy
+from background import get_background_queries
+from sales_totals import partner_totals
+from stock_ledger import ensure_snapshots
+from reorder import suggest_purchase_orders
+from orders import (sweep_preservation_timeouts, advance_orders, cancel_orders, OrderTransitionError,
+                    SWEEP_INTERVAL_MS, ORDER_STATUSES)
+from notifications import NotificationDispatcher, FileSinkTransport
 
 #для получения файлов .py, а также для запуска бд
 def get_script_directory():
@@ -15,11 +32,17 @@ def get_script_directory():
 
 SCRIPT_DIRECTORY = get_script_directory()
 DB_FILE = os.path.join(SCRIPT_DIRECTORY, "db.db")
+#профиль хранения (PRAGMA для соединений), см. STORAGE_PROFILES в data_access.py
+STORAGE_CONFIG = os.path.join(SCRIPT_DIRECTORY, "storage.json")
+#файл, куда диспетчер уведомлений пишет отправленные письма
+NOTIFICATIONS_LOG = os.path.join(SCRIPT_DIRECTORY, "notifications.log")
+#как часто вкладка журнала доступа подтягивает новые события (их пишет access_ingest.py), мс
+ACCESS_REFRESH_MS = 3000
 
 #функция для создания базы данных
 def create_database(db_file):
     try:
-        conn = sqlite3.connect(db_file)
+        conn = get_pool(db_file).connection()
         cursor = conn.cursor()
         print("База данных создана успешно")
 
@@ -186,232 +209,45 @@ def create_database(db_file):
         print('Таблицы созданы')
     except sqlite3.Error as e:
         print(f"SQLite ошибка создания таблиц: {str(e)}")
+        conn.rollback()
         raise
     except Exception as e:
         print(f"Неизвестная ошибка {str(e)}")
-    finally:
-        conn.close()
-        print('База данных закрыла соединение')
 
 
 #функция для импорта данных из csv файлов(перенес все из xlsx файлов, колонки по английски назвал)
+#сам импорт - в csv_import.py: каждый файл читается один раз, вставка пачками через executemany,
+#по контрольным точкам в import_checkpoints загружаются только дописанные или измененные файлы
 def import_csv_data(db_file):
-    import_warnings = []
+    importer = IncrementalImporter(get_pool(db_file).connection(), SCRIPT_DIRECTORY, report=print)
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA foreign_keys = ON")
-        print("Foreign keys enabled for import")
-
-        partner_headers = ['name', 'partner_type', 'rating', 'address', 'director_name', 'phone', 'email', 'inn', 'logo', 'sales_locations']
-        product_headers = ['article', 'type', 'name', 'description', 'image', 'min_partner_price', 'package_length', 'package_width', 'package_height', 'weight_no_package', 'weight_with_package', 'certificate', 'standard_number', 'production_time', 'cost_price', 'workshop_number', 'labor_count', 'product_type_id', 'param1', 'param2']
-        sales_headers = ['partner_id', 'product_id', 'quantity', 'sale_date']
-        material_headers = ['type', 'name', 'supplier_id', 'package_quantity', 'unit', 'description', 'image', 'cost', 'stock_quantity', 'min_quantity']
-        supplier_headers = ['type', 'name', 'inn']
-
-        partners_inserted = 0
-        products_inserted = 0
-        sales_inserted = 0
-        materials_inserted = 0
-        suppliers_inserted = 0
-
-        cursor.execute("SELECT supplier_id FROM suppliers")
-        valid_supplier_ids = {row[0] for row in cursor.fetchall()}
-        print(f"Valid supplier_ids: {valid_supplier_ids}")
-
-        def validate_headers(file_path, expected_headers):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                return reader.fieldnames, all(h in reader.fieldnames for h in expected_headers)
-
-        suppliers_path = os.path.join(SCRIPT_DIRECTORY, 'suppliers.csv')
-        if os.path.exists(suppliers_path):
-            try:
-                fieldnames, headers_valid = validate_headers(suppliers_path, supplier_headers)
-                if not headers_valid:
-                    raise ValueError(f"Неправильные заголовки в suppliers.csv. Expected: {supplier_headers}, Found: {fieldnames}")
-                with open(suppliers_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        try:
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO suppliers (type, name, inn)
-                                VALUES (?, ?, ?)
-                            ''', (row['type'], row['name'], row['inn'] or None))
-                            if cursor.rowcount > 0:
-                                suppliers_inserted += 1
-                        except (ValueError, sqlite3.Error) as e:
-                            continue
-            except Exception as e:
-                import_warnings.append(f"Ошибка импорта suppliers.csv: {str(e)}")
-        cursor.execute("SELECT supplier_id FROM suppliers")
-        valid_supplier_ids = {row[0] for row in cursor.fetchall()}
-
-        materials_path = os.path.join(SCRIPT_DIRECTORY, 'materials.csv')
-        if os.path.exists(materials_path):
-            try:
-                fieldnames, headers_valid = validate_headers(materials_path, material_headers)
-                if not headers_valid:
-                    raise ValueError(f"Incorrect headers in materials.csv. Expected: {material_headers}, Found: {fieldnames}")
-                with open(materials_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        try:
-                            supplier_id = int(row['supplier_id']) if row['supplier_id'] else None
-                            if supplier_id and supplier_id not in valid_supplier_ids:
-                                print(f"Skipping material row with invalid supplier_id={supplier_id}: {row}")
-                                continue
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO materials (type, name, supplier_id, package_quantity, unit, description, image, cost, stock_quantity, min_quantity)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (row['type'], row['name'], supplier_id, int(row['package_quantity']) if row['package_quantity'] else None,
-                                  row['unit'] or None, row['description'] or None, row['image'] or None, float(row['cost']),
-                                  int(row['stock_quantity']), int(row['min_quantity']) if row['min_quantity'] else None))
-                            if cursor.rowcount > 0:
-                                materials_inserted += 1
-                        except (ValueError, sqlite3.Error) as e:
-                            continue
-            except Exception as e:
-                import_warnings.append(f"Ошибка испорта materials.csv: {str(e)}")
-                print(f"Предупреждение: {str(e)}")
-        else:
-            import_warnings.append(f"materials.csv not found at {materials_path}")
-        partners_path = os.path.join(SCRIPT_DIRECTORY, 'partners.csv')
-        if os.path.exists(partners_path):
-            try:
-                fieldnames, headers_valid = validate_headers(partners_path, partner_headers)
-                if not headers_valid:
-                    raise ValueError(f"Incorrect headers in partners.csv. Expected: {partner_headers}, Found: {fieldnames}")
-                with open(partners_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        try:
-                            cursor.execute('SELECT partner_id FROM partners WHERE name = ? OR (inn IS NOT NULL AND inn = ?)',
-                                         (row['name'], row['inn'] or None))
-                            if cursor.fetchone():
-                                print(f"Skipping duplicate partner: name={row['name']}, inn={row['inn']}")
-                                continue
-                            cursor.execute('''
-                                INSERT INTO partners (name, partner_type, rating, address, director_name, phone, email, inn, logo, sales_locations)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (row['name'], row['partner_type'], int(row['rating']), row['address'] or None,
-                                  row['director_name'] or None, row['phone'] or None, row['email'] or None,
-                                  row['inn'] or None, row['logo'] or None, row['sales_locations'] or None))
-                            partners_inserted += 1
-                        except (ValueError, sqlite3.Error) as e:
-                            print(f"Error importing row in partners.csv: {row}, Error: {str(e)}")
-                            continue
-                print(f"Imported {partners_inserted} rows from partners.csv")
-            except Exception as e:
-                import_warnings.append(f"Ошибка импорта partners.csv: {str(e)}")
-        else:
-            import_warnings.append(f"partners.csv not found at {partners_path}")
-
-        cursor.execute("SELECT partner_id FROM partners")
-        valid_partner_ids = {row[0] for row in cursor.fetchall()}
-
-        products_path = os.path.join(SCRIPT_DIRECTORY, 'products.csv')
-        if os.path.exists(products_path):
-            try:
-                fieldnames, headers_valid = validate_headers(products_path, product_headers)
-                if not headers_valid:
-                    raise ValueError(f"Неправильные заголовки в products.csv. Expected: {product_headers}, Found: {fieldnames}")
-                with open(products_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        try:
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO products (article, type, name, description, image, min_partner_price, package_length, package_width, package_height, weight_no_package, weight_with_package, certificate, standard_number, production_time, cost_price, workshop_number, labor_count, product_type_id, param1, param2)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (row['article'], row['type'], row['name'], row['description'] or None, row['image'] or None,
-                                  float(row['min_partner_price']), float(row['package_length']) if row['package_length'] else None,
-                                  float(row['package_width']) if row['package_width'] else None, float(row['package_height']) if row['package_height'] else None,
-                                  float(row['weight_no_package']) if row['weight_no_package'] else None, float(row['weight_with_package']) if row['weight_with_package'] else None,
-                                  row['certificate'] or None, row['standard_number'] or None, int(row['production_time']) if row['production_time'] else None,
-                                  float(row['cost_price']) if row['cost_price'] else None, int(row['workshop_number']) if row['workshop_number'] else None,
-                                  int(row['labor_count']) if row['labor_count'] else None, int(row['product_type_id']),
-                                  float(row['param1']), float(row['param2'])))
-                            if cursor.rowcount > 0:
-                                products_inserted += 1
-                        except (ValueError, sqlite3.Error) as e:
-                            print(f"Ошибка импота строк products.csv: {row}, Error: {str(e)}")
-                            continue
-                print(f"Imported {products_inserted} rows from products.csv")
-            except Exception as e:
-                import_warnings.append(f"Ошибка импорта в products.csv: {str(e)}")
-        else:
-            import_warnings.append(f"products.csv not found at {products_path}")
-
-        cursor.execute("SELECT product_id FROM products")
-        valid_product_ids = {row[0] for row in cursor.fetchall()}
-
-        sales_path = os.path.join(SCRIPT_DIRECTORY, 'sales.csv')
-        if os.path.exists(sales_path):
-            try:
-                fieldnames, headers_valid = validate_headers(sales_path, sales_headers)
-                if not headers_valid:
-                    raise ValueError(f"Неправильные заголовки в sales.csv. Expected: {sales_headers}, Found: {fieldnames}")
-                with open(sales_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        try:
-                            partner_id = int(row['partner_id'])
-                            product_id = int(row['product_id'])
-                            if partner_id not in valid_partner_ids:
-                                print(f"Skipping sale row with invalid partner_id={partner_id}: {row}")
-                                continue
-                            if product_id not in valid_product_ids:
-                                print(f"Skipping sale row with invalid product_id={product_id}: {row}")
-                                continue
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO sales (partner_id, product_id, quantity, sale_date)
-                                VALUES (?, ?, ?, ?)
-                            ''', (partner_id, product_id, int(row['quantity']), row['sale_date']))
-                            if cursor.rowcount > 0:
-                                sales_inserted += 1
-                        except (ValueError, sqlite3.Error) as e:
-                            print(f"Error importing row in sales.csv: {row}, Error: {str(e)}")
-                            continue
-            except Exception as e:
-                import_warnings.append(f"Failed to import sales.csv: {str(e)}")
-        else:
-            import_warnings.append(f"sales.csv not found at {sales_path}")
-        conn.commit()
-        return import_warnings
+        return importer.run()
     except sqlite3.Error as e:
         print(f"SQLite error importing CSV data: {str(e)}")
         raise
-    finally:
-        conn.close()
-        print("Database connection closed for import")
 
 #инициализация базы данных
 def initialize_db(db_file):
     try:
         print(f'Инициализация с базой данных: {db_file}')
+        profile, pragmas = load_storage_config(STORAGE_CONFIG)
+        configure_pool(db_file, profile, pragmas)
+        print(f'Профиль хранения: {profile}')
         create_database(db_file)
-        conn = sqlite3.connect(db_file)
+        conn = get_pool(db_file).connection()
+        apply_migrations(conn)
         cursor = conn.cursor()
         cursor.execute('SELECT name FROM sqlite_master WHERE type="table"')
         tables = [row[0] for row in cursor.fetchall()]
         print(f'Существующие таблицы {tables}')
-        cursor.execute("SELECT COUNT(*) FROM partners")
-        partners_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM products")
-        products_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM sales")
-        sales_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM materials")
-        materials_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM suppliers")
-        suppliers_count = cursor.fetchone()[0]
-        conn.close()
-
-        import_warnings = []
-        if partners_count == 0 or products_count == 0 or sales_count == 0 or materials_count == 0 or suppliers_count == 0:
-            import_warnings = import_csv_data(db_file)
-        else:
-            return import_warnings
+
+        #импортируются только новые или измененные csv, неизмененные файлы даже не читаются
+        imported = import_csv_data(db_file)
+        prune_change_log(conn)
+        load_coefficients(conn)
+        #периодический снимок остатков, чтобы остатки на дату не суммировали весь журнал движений
+        ensure_snapshots(conn)
+        return imported
 
     except sqlite3.Error as e:
         print(f"SQLite ошибка базы данных: {str(e)}")
@@ -425,15 +261,40 @@ def initialize_db(db_file):
 #проверка создания таблиц
 def table_exists(db_file, table_name):
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        return get_pool(db_file).table_exists(table_name)
     except sqlite3.Error as e:
         return False
 
+#вкладка заявок: запрос, фильтры и сортируемые столбцы (по ним же замеряет benchmarks.py filters)
+ORDERS_SELECT_SQL = '''SELECT o.order_id, p.name, pr.name, o.quantity, o.cost, o.status, o.created_date
+                       FROM orders o
+                       JOIN partners p ON o.partner_id = p.partner_id
+                       JOIN products pr ON o.product_id = pr.product_id'''
+ORDER_FILTERS = [
+    PrefixFilter("Партнер", "name", "o.partner_id IN (SELECT partner_id FROM partners WHERE {})"),
+    ChoiceFilter("Статус", "o.status", ORDER_STATUSES),
+    DateRangeFilter("Создана", "o.created_date"),
+]
+ORDER_SORT_COLUMNS = {"ID": ("o.order_id", 0), "Статус": ("o.status", 5), "Дата создания": ("o.created_date", 6)}
+
+#журнал доступа с постраничной подгрузкой: новые записи сверху, вместе с месячными разделами
+def access_log_view(parent, db_file, columns, **options):
+    return PartitionedAccessTable(
+        parent, db_file,
+        columns=columns,
+        select_sql='''SELECT a.log_id, e.name, a.door_id, a.timestamp
+                      FROM {source} a
+                      JOIN employees e ON a.employee_id = e.employee_id''',
+        key_columns=("a.timestamp", "a.log_id"),
+        key_positions=(3, 0),
+        descending=True,
+        change_table='access_logs',
+        id_column="a.log_id",
+        sort_columns={columns[0]: ("a.log_id", 0), columns[2]: ("a.door_id", 2), columns[3]: ("a.timestamp", 3)},
+        base_table="{source} a",
+        **options
+    )
+
 #окно авторизации
 class LoginDialog(tk.Toplevel):
     def __init__(self, parent, db_file, callback):
@@ -477,11 +338,10 @@ class LoginDialog(tk.Toplevel):
             if not table_exists(self.db_file, 'managers'):
                 messagebox.showerror("Ошибка", "Таблица 'managers' не существует.", parent=self)
                 return
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             cursor.execute("SELECT manager_id, name FROM managers WHERE email = ? AND password = ?", (email, password))
             manager = cursor.fetchone()
-            conn.close()
             if manager:
                 self.callback(manager[0], manager[1])
                 self.destroy()
@@ -567,11 +427,10 @@ class PartnerDialog(tk.Toplevel):
             if not table_exists(self.db_file, 'partners'):
                 messagebox.showerror("Ошибка", "Таблица 'partners' не существует.", parent=self)
                 return
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM partners WHERE partner_id = ?', (self.partner_id,))
             partner = cursor.fetchone()
-            conn.close()
 
             if partner:
                 self.name_input.insert(0, partner[1])
@@ -607,13 +466,12 @@ class PartnerDialog(tk.Toplevel):
                 messagebox.showwarning("Ошибка", "Заполните обязательные поля: наименование и рейтинг (неотрицательный).", parent=self)
                 return
 
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             cursor.execute('SELECT partner_id FROM partners WHERE (name = ? AND partner_id != ?) OR (inn IS NOT NULL AND inn = ? AND partner_id != ?)',
                            (name, self.partner_id or 0, inn or '', self.partner_id or 0))
             if cursor.fetchone():
                 messagebox.showwarning("Ошибка", "Партнер с таким наименованием или ИНН уже существует.", parent=self)
-                conn.close()
                 return
 
             if self.partner_id:
@@ -627,13 +485,13 @@ class PartnerDialog(tk.Toplevel):
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (name, partner_type, rating, address, director, phone, email, inn, logo, sales_locations))
             conn.commit()
-            conn.close()
             self.parent.load_partners()
             self.destroy()
         except ValueError:
             messagebox.showwarning("Ошибка", "Рейтинг должен быть целым неотрицательным числом.", parent=self)
         except sqlite3.Error as e:
             print(f"Ошибка сохранения партнера: {str(e)}")
+            conn.rollback()
             messagebox.showerror("Ошибка", f"Ошибка сохранения: {str(e)}", parent=self)
 
 #окно истории продаж
@@ -655,20 +513,21 @@ class SalesDialog(tk.Toplevel):
          frame = ttk.Frame(self, padding="10")
          frame.grid(row=0, column=0, sticky="nsew")
 
-         self.sales_table = ttk.Treeview(frame, columns=("Продукция", "Количество", "Дата продажи", "Скидка"), show="headings")
-         self.sales_table.heading("Продукция", text="Продукция")
-         self.sales_table.heading("Количество", text="Количество")
-         self.sales_table.heading("Дата продажи", text="Дата продажи")
-         self.sales_table.heading("Скидка", text="Скидка")
+         self.discount = 0
+         self.sales_view = VirtualTable(
+             frame, self.db_file,
+             columns=("Продукция", "Количество", "Дата продажи", "Скидка"),
+             select_sql='''SELECT s.sale_id, p.name, s.quantity, s.sale_date
+                           FROM sales s
+                           JOIN products p ON s.product_id = p.product_id''',
+             key_columns=("s.sale_id",),
+             where=["s.partner_id = ?"], params=(self.partner_id,),
+             formatter=lambda sale: (sale[1], sale[2], sale[3], f"{self.discount}%")
+         )
+         self.sales_table = self.sales_view.tree
          self.sales_table.column("Продукция", width=200)
-         self.sales_table.column("Количество", width=100)
          self.sales_table.column("Дата продажи", width=150)
-         self.sales_table.column("Скидка", width=100)
-         self.sales_table.grid(row=0, column=0, sticky="nsew")
-
-         scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.sales_table.yview)
-         self.sales_table.configure(yscrollcommand=scrollbar.set)
-         scrollbar.grid(row=0, column=1, sticky="ns")
+         self.sales_view.grid(row=0, column=0, sticky="nsew")
 
          ttk.Button(frame, text="Назад", command=self.destroy).grid(row=1, column=0, pady=10)
 
@@ -684,34 +543,34 @@ class SalesDialog(tk.Toplevel):
              if not table_exists(self.db_file, 'sales') or not table_exists(self.db_file, 'products'):
                  messagebox.showerror("Ошибка", "Таблицы 'sales' или 'products' не существуют.", parent=self)
                  return
-             conn = sqlite3.connect(self.db_file)
-             cursor = conn.cursor()
-
-             cursor.execute("SELECT name FROM partners WHERE partner_id = ?", (self.partner_id,))
-             partner = cursor.fetchone()
-             if not partner:
-                 messagebox.showerror("Ошибка", f"Партнер с ID {self.partner_id} не найден.", parent=self)
-                 conn.close()
-                 return
-             cursor.execute('SELECT SUM(quantity) FROM sales WHERE partner_id = ?', (self.partner_id,))
-             total_quantity = cursor.fetchone()[0] or 0
-             discount = calculate_discount(total_quantity)
-
-             cursor.execute('''
-                 SELECT p.name, s.quantity, s.sale_date
-                 FROM sales s
-                 JOIN products p ON s.product_id = p.product_id
-                 WHERE s.partner_id = ?
-             ''', (self.partner_id,))
-             sales = cursor.fetchall()
-             conn.close()
-             for sale in sales:
-                 self.sales_table.insert("", "end", values=(sale[0], sale[1], sale[2], f"{discount}%"))
-             if not sales:
-                 messagebox.showinfo("Информация", "Нет данных о продажах для этого партнера.", parent=self)
          except sqlite3.Error as e:
-             print(f"Ошибка загрузки данных из истории продаж: {str(e)}")
              messagebox.showerror("Ошибка", f"Не удалось загрузить историю продаж: {str(e)}", parent=self)
+             return
+         get_background_queries(self).submit(f"sales:{self}", self.fetch_total_quantity,
+                                             self.on_total_quantity, self.on_load_error)
+
+     #выполняется в рабочем потоке
+     def fetch_total_quantity(self):
+         conn = get_pool(self.db_file).connection()
+         if not conn.execute("SELECT name FROM partners WHERE partner_id = ?", (self.partner_id,)).fetchone():
+             return None
+         #итоги ведутся триггерами на sales, чтение одной строки вместо суммы по всем продажам
+         return partner_totals(conn, self.partner_id)
+
+     def on_total_quantity(self, totals):
+         if totals is None:
+             messagebox.showerror("Ошибка", f"Партнер с ID {self.partner_id} не найден.", parent=self)
+             return
+         total_quantity, self.discount = totals
+         self.sales_view.reload(on_loaded=self.on_sales_loaded)
+
+     def on_sales_loaded(self):
+         if not self.sales_view.row_count():
+             messagebox.showinfo("Информация", "Нет данных о продажах для этого партнера.", parent=self)
+
+     def on_load_error(self, error):
+         print(f"Ошибка загрузки данных из истории продаж: {str(error)}")
+         messagebox.showerror("Ошибка", f"Не удалось загрузить историю продаж: {str(error)}", parent=self)
 
 #окно для создании заявки
 class OrderDialog(tk.Toplevel):
@@ -723,7 +582,7 @@ class OrderDialog(tk.Toplevel):
         self.partner_id = partner_id
         self.iconbitmap('logo.ico')
         self.title('Создать заявку')
-        self.geometry('500x350')
+        self.geometry('500x380')
         self.transient(parent)
         self.grab_set()
         self.init_ui()
@@ -732,31 +591,42 @@ class OrderDialog(tk.Toplevel):
         frame = ttk.Frame(self, padding="10")
         frame.grid(row=0, column=0, sticky="nsew")
 
+        #списки фильтруются по вводу; варианты берутся из общего кэша справочников
         ttk.Label(frame, text="Партнер:").grid(row=0, column=0, sticky="w", pady=2)
-        self.partner_combobox = ttk.Combobox(frame, state="readonly")
+        self.partner_combobox = ReferenceCombobox(frame, state="disabled")
         self.partner_combobox.grid(row=0, column=1, sticky="ew", pady=2)
-        self.load_partners()
 
         ttk.Label(frame, text="Продукт:").grid(row=1, column=0, sticky="w", pady=2)
-        self.product_combobox = ttk.Combobox(frame, state="readonly")
+        self.product_combobox = ReferenceCombobox(frame, state="disabled")
         self.product_combobox.grid(row=1, column=1, sticky="ew", pady=2)
-        self.load_products()
 
-        ttk.Label(frame, text="Количество:").grid(row=2, column=0, sticky="w", pady=2)
+        # Поиск продукции по названию, артикулу, описанию и ГОСТ; выбранная продукция ставится в список
+        ttk.Label(frame, text="Поиск продукции:").grid(row=2, column=0, sticky="w", pady=2)
+        SearchBox(frame, self.db_file, search_products, self.select_product).grid(row=2, column=1, sticky="ew", pady=2)
+
+        ttk.Label(frame, text="Количество:").grid(row=3, column=0, sticky="w", pady=2)
         self.quantity_input = ttk.Entry(frame)
-        self.quantity_input.grid(row=2, column=1, sticky="ew", pady=2)
+        self.quantity_input.grid(row=3, column=1, sticky="ew", pady=2)
 
-        ttk.Label(frame, text="Стоимость:").grid(row=3, column=0, sticky="w", pady=2)
-        self.cost_input = ttk.Entry(frame)
-        self.cost_input.grid(row=3, column=1, sticky="ew", pady=2)
+        #стоимость считается по цене продукции и скидке партнера (pricing.py), вручную не вводится
+        ttk.Label(frame, text="Стоимость:").grid(row=4, column=0, sticky="w", pady=2)
+        self.cost_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=self.cost_var, state="readonly").grid(row=4, column=1, sticky="ew", pady=2)
+        self.price_label = ttk.Label(frame, text="")
+        self.price_label.grid(row=5, column=1, sticky="w", pady=2)
 
-        ttk.Label(frame, text="Дата производства:").grid(row=4, column=0, sticky="w", pady=2)
+        ttk.Label(frame, text="Дата производства:").grid(row=6, column=0, sticky="w", pady=2)
         self.production_date_input = ttk.Entry(frame)
-        self.production_date_input.grid(row=4, column=1, sticky="ew", pady=2)
+        self.production_date_input.grid(row=6, column=1, sticky="ew", pady=2)
         self.production_date_input.insert(0, (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d"))
 
+        for combobox in (self.partner_combobox, self.product_combobox):
+            combobox.bind("<<ComboboxSelected>>", self.update_quote, add="+")
+            combobox.bind("<Return>", self.update_quote, add="+")
+        self.quantity_input.bind("<KeyRelease>", self.update_quote)
+
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=5, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=7, column=0, columnspan=2, pady=10)
         ttk.Button(button_frame, text="Создать", command=self.create_order).grid(row=0, column=0, padx=5)
         ttk.Button(button_frame, text="Отмена", command=self.destroy).grid(row=0, column=1, padx=5)
 
@@ -764,75 +634,94 @@ class OrderDialog(tk.Toplevel):
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
-        if self.partner_id:
-            self.partner_combobox.set(self.get_partner_name(self.partner_id))
+        #справочники читаются в фоне (после первого открытия - из кэша), до их загрузки выбор недоступен
+        self.load_partners()
+        self.load_products()
+
+    def load_reference(self, name, combobox):
+        cache = get_reference_cache(self.db_file)
+        get_background_queries(self).submit(
+            f"order_{name}:{self}",
+            lambda: cache.get(get_pool(self.db_file).connection(), name),
+            lambda snapshot: self.on_reference_loaded(snapshot, combobox),
+            lambda e: print(f"Ошибка загрузки справочника {name}: {str(e)}"))
 
     def load_partners(self):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT partner_id, name FROM partners")
-            partners = cursor.fetchall()
-            conn.close()
-            self.partner_combobox['values'] = [f"{p[1]} (ID: {p[0]})" for p in partners]
-            self.partner_map = {f"{p[1]} (ID: {p[0]})": p[0] for p in partners}
-        except sqlite3.Error as e:
-            print(f"Ошибка загрузки партнеров: {str(e)}")
+        self.load_reference('partners', self.partner_combobox)
 
     def load_products(self):
+        self.load_reference('products', self.product_combobox)
+
+    def on_reference_loaded(self, snapshot, combobox):
+        combobox.set_snapshot(snapshot)
+        if combobox is self.partner_combobox and self.partner_id:
+            combobox.select_id(self.partner_id)
+        self.update_quote()
+
+    def select_product(self, row):
+        self.product_combobox.set_item(row[0], row[1])
+        self.update_quote()
+
+    def quote(self):
+        """Расчет стоимости по выбранным партнеру, продукции и количеству; None, если выбрано не все"""
+        partner_id = self.partner_combobox.selected_id()
+        product_id = self.product_combobox.selected_id()
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT product_id, name FROM products")
-            products = cursor.fetchall()
-            conn.close()
-            self.product_combobox['values'] = [f"{p[1]} (ID: {p[0]})" for p in products]
-            self.product_map = {f"{p[1]} (ID: {p[0]})": p[0] for p in products}
-        except sqlite3.Error as e:
-            print(f"Ошибка загрузки продуктов: {str(e)}")
+            quantity = int(self.quantity_input.get().strip())
+        except ValueError:
+            return None
+        if not partner_id or not product_id or quantity <= 0:
+            return None
+        return get_pricing_engine(self.db_file).quote(get_pool(self.db_file).connection(), partner_id, product_id, quantity)
 
-    def get_partner_name(self, partner_id):
+    def update_quote(self, event=None):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM partners WHERE partner_id = ?", (partner_id,))
-            name = cursor.fetchone()[0]
-            conn.close()
-            return f"{name} (ID: {partner_id})"
-        except sqlite3.Error:
-            return ""
+            quote = self.quote()
+        except (PricingError, sqlite3.Error) as e:
+            self.cost_var.set("")
+            self.price_label.config(text=str(e))
+            return
+        if quote is None:
+            self.cost_var.set("")
+            self.price_label.config(text="")
+            return
+        self.cost_var.set(f"{quote.cost:.2f}")
+        self.price_label.config(text=f"Цена {quote.price:.2f}, скидка {quote.discount}%, за единицу {quote.unit_price:.2f}")
 
     def create_order(self):
         try:
             partner_text = self.partner_combobox.get()
             product_text = self.product_combobox.get()
             quantity = int(self.quantity_input.get().strip())
-            cost = float(self.cost_input.get().strip())
             production_date = self.production_date_input.get().strip()
 
-            if not partner_text or not product_text or quantity <= 0 or cost <= 0 or not production_date:
+            if not partner_text or not product_text or quantity <= 0 or not production_date:
                 messagebox.showwarning("Ошибка", "Заполните все поля корректно.", parent=self)
                 return
 
-            partner_id = self.partner_map.get(partner_text)
-            product_id = self.product_map.get(product_text)
+            partner_id = self.partner_combobox.selected_id()
+            product_id = self.product_combobox.selected_id()
             if not partner_id or not product_id:
                 messagebox.showerror("Ошибка", "Выберите корректного партнера и продукт.", parent=self)
                 return
+            #стоимость пересчитывается при сохранении: скидка или цена могли измениться, пока окно открыто
+            cost = self.quote().cost
 
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO orders (partner_id, manager_id, product_id, quantity, cost, production_date, status, created_date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (partner_id, self.manager_id, product_id, quantity, cost, production_date, "created", datetime.now().strftime("%Y-%m-%d")))
             conn.commit()
-            conn.close()
             self.parent.load_orders()
             self.destroy()
         except ValueError:
-            messagebox.showwarning("Ошибка", "Количество и стоимость должны быть положительными числами.", parent=self)
+            messagebox.showwarning("Ошибка", "Количество должно быть положительным целым числом.", parent=self)
+        except PricingError as e:
+            messagebox.showerror("Ошибка", f"Не удалось рассчитать стоимость: {str(e)}", parent=self)
         except sqlite3.Error as e:
+            get_pool(self.db_file).connection().rollback()
             messagebox.showerror("Ошибка", f"Ошибка создания заявки: {str(e)}", parent=self)
 
 #окно для добавления/редактирования сотрудника
@@ -893,11 +782,10 @@ class EmployeeDialog(tk.Toplevel):
     #загрузка данных сотрудника в базу данных
     def load_employee_data(self):
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM employees WHERE employee_id = ?', (self.employee_id,))
             employee = cursor.fetchone()
-            conn.close()
 
             if employee:
                 self.name_input.insert(0, employee[1])
@@ -923,7 +811,7 @@ class EmployeeDialog(tk.Toplevel):
                 messagebox.showwarning("Ошибка", "ФИО обязательно для заполнения.", parent=self)
                 return
 
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
             if self.employee_id:
                 cursor.execute('''
@@ -936,10 +824,10 @@ class EmployeeDialog(tk.Toplevel):
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (name, birth_date, passport, bank, family, health))
             conn.commit()
-            conn.close()
             self.parent.load_employees()
             self.destroy()
         except sqlite3.Error as e:
+            conn.rollback()
             messagebox.showerror("Ошибка", f"Ошибка сохранения сотрудника: {str(e)}", parent=self)
 
 #Журнал доступа
@@ -968,24 +856,9 @@ class AccessLogDialog(tk.Toplevel):
 
         # Создаем таблицу с колонками
         columns = ("ID", "Сотрудник", "Дверь", "Время")
-        self.access_table = ttk.Treeview(
-            frame,
-            columns=columns,
-            show="headings",
-            selectmode="browse"
-        )
-
-        # Настраиваем заголовки
-        for col in columns:
-            self.access_table.heading(col, text=col)
-            self.access_table.column(col, width=100)
-
-        self.access_table.grid(row=0, column=0, sticky="nsew")
-
-        # Скроллбар
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.access_table.yview)
-        self.access_table.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.access_view = access_log_view(frame, self.db_file, columns, selectmode="browse")
+        self.access_table = self.access_view.tree
+        self.access_view.grid(row=0, column=0, sticky="nsew")
 
         # Фрейм для кнопок
         button_frame = ttk.Frame(frame)
@@ -1035,30 +908,9 @@ class AccessLogDialog(tk.Toplevel):
     def load_access_logs(self):
         """Загружает данные журнала доступа из БД"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            # Выбираем данные с JOIN для получения имени сотрудника
-            cursor.execute('''
-                           SELECT a.log_id,
-                                  e.name,
-                                  a.door_id,
-                                  a.timestamp
-                           FROM access_logs a
-                                    JOIN employees e ON a.employee_id = e.employee_id
-                           ORDER BY a.timestamp DESC
-                           ''')
-
-            logs = cursor.fetchall()
-            conn.close()
-
-            # Очищаем таблицу перед загрузкой новых данных
-            for item in self.access_table.get_children():
-                self.access_table.delete(item)
-
-            # Заполняем таблицу данными
-            for log in logs:
-                self.access_table.insert("", "end", values=log)
+            # Первая страница журнала, остальные подгружаются при прокрутке;
+            # после первой загрузки обновляются только изменившиеся записи
+            self.access_view.refresh()
 
         except sqlite3.Error as e:
             messagebox.showerror(
@@ -1091,13 +943,11 @@ class AccessLogDialog(tk.Toplevel):
             return
 
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            conn = get_pool(self.db_file).connection()
 
-            # Выполняем удаление
-            cursor.execute("DELETE FROM access_logs WHERE log_id = ?", (log_id,))
+            # Выполняем удаление (запись может быть и в месячном разделе)
+            delete_access_log(conn, log_id)
             conn.commit()
-            conn.close()
 
             # Обновляем таблицу в диалоге
             self.load_access_logs()
@@ -1112,6 +962,7 @@ class AccessLogDialog(tk.Toplevel):
             )
 
         except sqlite3.Error as e:
+            conn.rollback()
             messagebox.showerror(
                 "Ошибка удаления",
                 f"Не удалось удалить запись:\n{str(e)}",
@@ -1121,7 +972,7 @@ class AccessLogDialog(tk.Toplevel):
     def add_access_log(self):
         """Добавляет тестовую запись доступа"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
 
             # Получаем первого сотрудника
@@ -1147,7 +998,6 @@ class AccessLogDialog(tk.Toplevel):
                            ''', (employee_id, door_id, timestamp))
 
             conn.commit()
-            conn.close()
 
             # Обновляем таблицу в диалоге
             self.load_access_logs()
@@ -1156,12 +1006,92 @@ class AccessLogDialog(tk.Toplevel):
             self.main_app.load_access_logs()
 
         except sqlite3.Error as e:
+            conn.rollback()
             messagebox.showerror(
                 "Ошибка добавления",
                 f"Не удалось добавить запись:\n{str(e)}",
                 parent=self
             )
 
+#присутствие сотрудников по журналу доступа: первый вход и последний выход по дням, кто сейчас у каких дверей
+class AccessAnalyticsDialog(tk.Toplevel):
+    def __init__(self, parent, db_file):
+        super().__init__(parent)
+        self.db_file = db_file
+        self.title('Присутствие сотрудников')
+        self.geometry("800x500")
+        self.transient(parent)
+
+        frame = ttk.Frame(self, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        period_frame = ttk.Frame(frame)
+        period_frame.pack(fill=tk.X)
+        today = datetime.now()
+        self.start_var = tk.StringVar(value=(today - timedelta(days=6)).strftime("%Y-%m-%d"))
+        self.end_var = tk.StringVar(value=today.strftime("%Y-%m-%d"))
+        ttk.Label(period_frame, text="Период с").pack(side=tk.LEFT)
+        ttk.Entry(period_frame, textvariable=self.start_var, width=12).pack(side=tk.LEFT, padx=5)
+        ttk.Label(period_frame, text="по").pack(side=tk.LEFT)
+        ttk.Entry(period_frame, textvariable=self.end_var, width=12).pack(side=tk.LEFT, padx=5)
+        ttk.Button(period_frame, text="Показать", command=self.load_data).pack(side=tk.LEFT, padx=5)
+
+        columns = ("Сотрудник", "День", "Первый вход", "Последний выход", "Интервалов", "Часов")
+        self.presence_tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for col in columns:
+            self.presence_tree.heading(col, text=col)
+            self.presence_tree.column(col, width=110)
+        self.presence_tree.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        ttk.Label(frame, text="Сейчас в здании").pack(anchor="w")
+        self.occupancy_tree = ttk.Treeview(frame, columns=("Дверь", "Сотрудников", "Кто"), show="headings", height=5)
+        for col in ("Дверь", "Сотрудников", "Кто"):
+            self.occupancy_tree.heading(col, text=col)
+        self.occupancy_tree.column("Кто", width=500)
+        self.occupancy_tree.pack(fill=tk.X, pady=5)
+
+        self.status_label = ttk.Label(frame, text="Загрузка...")
+        self.status_label.pack(anchor="w")
+        ttk.Button(frame, text="Закрыть", command=self.destroy).pack(pady=5)
+
+        self.load_data()
+
+    def load_data(self):
+        start, end = self.start_var.get().strip(), self.end_var.get().strip()
+        try:
+            datetime.strptime(start, "%Y-%m-%d")
+            datetime.strptime(end, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите даты в формате ГГГГ-ММ-ДД", parent=self)
+            return
+        self.status_label.configure(text="Загрузка...")
+        get_background_queries(self).submit(f"access_analytics:{self}", lambda: self.fetch_reports(start, end),
+                                            self.show_reports, self.show_error)
+
+    def fetch_reports(self, start, end):
+        """Выполняется в рабочем потоке: сначала дописывает в итоги новые записи журнала"""
+        conn = get_pool(self.db_file).connection()
+        processed, skipped = update_sessions(conn)
+        return processed, skipped, daily_presence(conn, start, end), door_occupancy(conn)
+
+    def show_reports(self, result):
+        processed, skipped, presence, occupancy = result
+        self.presence_tree.delete(*self.presence_tree.get_children())
+        for _, name, day, first_in, last_out, sessions, _, seconds in presence:
+            self.presence_tree.insert("", tk.END, values=(name, day, first_in[11:], last_out[11:], sessions,
+                                                          f"{seconds / 3600:.1f}"))
+        self.occupancy_tree.delete(*self.occupancy_tree.get_children())
+        for door_id, count, names in occupancy:
+            self.occupancy_tree.insert("", tk.END, values=(door_id, count, names))
+        status = f"Строк: {len(presence)}, новых записей журнала: {processed}"
+        if skipped:
+            status += f", пропущено с неверным временем: {skipped}"
+        self.status_label.configure(text=status)
+
+    def show_error(self, error):
+        self.status_label.configure(text="")
+        messagebox.showerror("Ошибка", f"Не удалось построить отчет: {str(error)}", parent=self)
+
 #основное окно
 class MainWindow(tk.Tk):
     def __init__(self, db_file):
@@ -1173,6 +1103,7 @@ class MainWindow(tk.Tk):
         self.configure(bg='#FFFFFF')
         self.title("Учет партнеров - Образ плюс")
         self.geometry("1000x600")
+        self.dispatcher = NotificationDispatcher(db_file, FileSinkTransport(NOTIFICATIONS_LOG))
 
         try:
             import_warnings = initialize_db(self.db_file)
@@ -1193,19 +1124,40 @@ class MainWindow(tk.Tk):
 
         ttk.Label(self, text=f"Менеджер: {self.manager_name}").pack(anchor="ne", padx=10)
 
+    #варианты выпадающих фильтров читаются в фоне, как и сами таблицы: построение вкладок не ждет запросов
+    def load_filter_choices(self, name, sql, filter_bar, spec):
+        get_background_queries(self).submit(
+            f"filter_choices:{name}",
+            lambda: [row[0] for row in get_pool(self.db_file).fetchall(sql)],
+            lambda choices: filter_bar.set_choices(spec, choices),
+            lambda e: print(f"Ошибка загрузки вариантов фильтра {name}: {str(e)}"))
+
     def init_materials_tab(self):
         frame = ttk.Frame(self.materials_frame, padding="10")
         frame.pack(fill="both", expand=True)
 
-        # Treeview для материалов
-        self.materials_tree = ttk.Treeview(frame, columns=("ID", "Тип", "Название", "Поставщик", "Количество"),
-                                           show="headings")
-        self.materials_tree.pack(fill="both", expand=True)
-
-        # Настройка колонок
-        for col in ["ID", "Тип", "Название", "Поставщик", "Количество"]:
-            self.materials_tree.heading(col, text=col)
-            self.materials_tree.column(col, width=100)
+        # Таблица материалов, строки подгружаются страницами
+        self.materials_view = VirtualTable(
+            frame, self.db_file,
+            columns=("ID", "Тип", "Название", "Поставщик", "Количество"),
+            select_sql='''SELECT m.material_id, m.type, m.name, s.name, m.stock_quantity
+                          FROM materials m
+                          LEFT JOIN suppliers s ON m.supplier_id = s.supplier_id''',
+            key_columns=("m.material_id",),
+            change_table='materials',
+            sort_columns={"ID": ("m.material_id", 0), "Тип": ("m.type", 1), "Название": ("m.name", 2),
+                          "Количество": ("m.stock_quantity", 4)}
+        )
+        self.materials_tree = self.materials_view.tree
+        material_type_filter = ChoiceFilter("Тип", "m.type", [])
+        materials_filter_bar = FilterBar(frame, self.materials_view, [
+            PrefixFilter("Название", "m.name"),
+            material_type_filter,
+        ])
+        materials_filter_bar.pack(anchor="w", pady=(0, 5))
+        self.load_filter_choices('material_types', "SELECT DISTINCT type FROM materials ORDER BY type",
+                                 materials_filter_bar, material_type_filter)
+        self.materials_view.pack(fill="both", expand=True)
 
         # Кнопки
         btn_frame = ttk.Frame(frame)
@@ -1214,6 +1166,21 @@ class MainWindow(tk.Tk):
         ttk.Button(btn_frame, text="Обновить", command=self.load_materials).pack(side="left", padx=5)
         ttk.Button(btn_frame, text="Показать продукцию", command=self.show_products).pack(side="left", padx=5)
 
+        # Предлагаемые закупки: материалы ниже минимального остатка по поставщикам и упаковкам
+        reorder_frame = ttk.LabelFrame(frame, text="Нужно заказать", padding="5")
+        reorder_frame.pack(fill="x", pady=5)
+        self.reorder_tree = ttk.Treeview(
+            reorder_frame,
+            columns=("Не хватает", "Упаковок", "Количество"),
+            height=6
+        )
+        self.reorder_tree.heading("#0", text="Поставщик / материал")
+        self.reorder_tree.column("#0", width=300)
+        for col in ("Не хватает", "Упаковок", "Количество"):
+            self.reorder_tree.heading(col, text=col)
+            self.reorder_tree.column(col, width=100)
+        self.reorder_tree.pack(fill="x")
+
         # Загрузка данных
         self.load_materials()
 
@@ -1243,6 +1210,17 @@ class MainWindow(tk.Tk):
         self.manager_id = manager_id
         self.manager_name = manager_name
         self.init_ui()
+        self.dispatcher.start()
+        self.check_preservation_timeouts()
+        self.after(ACCESS_REFRESH_MS, self.poll_access_logs)
+        self.apply_access_retention()
+        #справочники для окна заявки читаются заранее, в фоне
+        get_background_queries(self).submit(
+            'reference_cache',
+            lambda: [get_reference_cache(self.db_file).get(get_pool(self.db_file).connection(), name)
+                     for name in REFERENCES],
+            lambda snapshots: None,
+            lambda e: print(f"Ошибка загрузки справочников: {str(e)}"))
 
     def init_ui(self):
         self.notebook = ttk.Notebook(self)
@@ -1271,26 +1249,45 @@ class MainWindow(tk.Tk):
         frame = ttk.Frame(self.partners_frame, padding="10")
         frame.grid(row=0, column=0, sticky="nsew")
 
-        self.partners_table = ttk.Treeview(frame, columns=("ID", "Наименование", "Тип", "Рейтинг", "Адрес", "Директор", "Телефон", "Email", "ИНН"), show="headings")
-        headers = ["ID", "Наименование", "Тип", "Рейтинг", "Адрес", "Директор", "Телефон", "Email", "ИНН"]
-        for header in headers:
-            self.partners_table.heading(header, text=header)
-            self.partners_table.column(header, width=100)
-            self.partners_table.grid(row=0, column=0, sticky="nsew")
-            self.partners_table.bind("<Double-1>", self.edit_partner)
-
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.partners_table.yview)
-        self.partners_table.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.partners_view = VirtualTable(
+            frame, self.db_file,
+            columns=("ID", "Наименование", "Тип", "Рейтинг", "Адрес", "Директор", "Телефон", "Email", "ИНН"),
+            select_sql='SELECT partner_id, name, partner_type, rating, address, director_name, phone, email, inn FROM partners',
+            key_columns=("partner_id",),
+            change_table='partners',
+            sort_columns={"ID": ("partner_id", 0), "Наименование": ("name", 1), "Тип": ("partner_type", 2),
+                          "Рейтинг": ("rating", 3)}
+        )
+        self.partners_table = self.partners_view.tree
+        self.partners_table.bind("<Double-1>", self.edit_partner)
+        self.partners_view.grid(row=1, column=0, columnspan=2, sticky="nsew")
+
+        # Фильтры выполняются в SQL, таблица перезагружается с первой страницы
+        partner_type_filter = ChoiceFilter("Тип", "partner_type", [])
+        partners_filter_bar = FilterBar(frame, self.partners_view, [
+            PrefixFilter("Наименование", "name"),
+            partner_type_filter,
+            MinFilter("Рейтинг от", "rating"),
+        ])
+        partners_filter_bar.grid(row=0, column=0, sticky="w", pady=(0, 5))
+        self.load_filter_choices('partner_types', "SELECT DISTINCT partner_type FROM partners ORDER BY partner_type",
+                                 partners_filter_bar, partner_type_filter)
+
+        # Полнотекстовый поиск: директор, адрес, места продаж, телефон, ИНН; выбор открывает карточку партнера
+        search_frame = ttk.Frame(frame)
+        search_frame.grid(row=0, column=1, sticky="e", pady=(0, 5))
+        ttk.Label(search_frame, text="Поиск:").grid(row=0, column=0, padx=(0, 2))
+        SearchBox(search_frame, self.db_file, search_partners,
+                  lambda row: PartnerDialog(self, self.db_file, self.manager_id, row[0])).grid(row=0, column=1)
 
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=1, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=2, column=0, columnspan=2, pady=10)
         ttk.Button(button_frame, text="Добавить партнера", command=self.add_partner).grid(row=0, column=0, padx=5)
         ttk.Button(button_frame, text="История продаж", command=self.view_sales).grid(row=0, column=1, padx=5)
         ttk.Button(button_frame, text="Тест расчета материала", command=self.test_material_calculation).grid(row=0, column=2, padx=5)
 
         frame.columnconfigure(0, weight=1)
-        frame.rowconfigure(0, weight=1)
+        frame.rowconfigure(1, weight=1)
         self.partners_frame.columnconfigure(0, weight=1)
         self.partners_frame.rowconfigure(0, weight=1)
 
@@ -1300,25 +1297,29 @@ class MainWindow(tk.Tk):
         frame = ttk.Frame(self.orders_frame, padding="10")
         frame.grid(row=0, column=0, sticky="nsew")
 
-        self.orders_table = ttk.Treeview(frame, columns=("ID", "Партнер", "Продукт", "Количество", "Сумма", "Статус", "Дата создания"), show="headings")
-        headers = ["ID", "Партнер", "Продукт", "Количество", "Сумма", "Статус", "Дата создания"]
-        for header in headers:
-            self.orders_table.heading(header, text=header)
-            self.orders_table.column(header, width=100)
-        self.orders_table.grid(row=0, column=0, sticky="nsew")
-
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.orders_table.yview)
-        self.orders_table.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.orders_view = VirtualTable(
+            frame, self.db_file,
+            columns=("ID", "Партнер", "Продукт", "Количество", "Сумма", "Статус", "Дата создания"),
+            select_sql=ORDERS_SELECT_SQL,
+            key_columns=("o.order_id",),
+            change_table='orders',
+            sort_columns=ORDER_SORT_COLUMNS,
+            base_table="orders o",
+            selectmode="extended"
+        )
+        self.orders_table = self.orders_view.tree
+        self.orders_view.grid(row=1, column=0, columnspan=2, sticky="nsew")
+        FilterBar(frame, self.orders_view, ORDER_FILTERS).grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 5))
 
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=1, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=2, column=0, columnspan=2, pady=10)
         ttk.Button(button_frame, text="Создать заявку", command=self.create_order).grid(row=0, column=0, padx=5)
         ttk.Button(button_frame, text="Обновить статус", command=self.update_order_status).grid(row=0, column=1, padx=5)
         ttk.Button(button_frame, text="Отменить заявку", command=self.cancel_order).grid(row=0, column=2, padx=5)
+        ttk.Button(button_frame, text="Пересчитать цены", command=self.reprice_orders).grid(row=0, column=3, padx=5)
 
         frame.columnconfigure(0, weight=1)
-        frame.rowconfigure(0, weight=1)
+        frame.rowconfigure(1, weight=1)
         self.orders_frame.columnconfigure(0, weight=1)
         self.orders_frame.rowconfigure(0, weight=1)
 
@@ -1329,27 +1330,26 @@ class MainWindow(tk.Tk):
         frame.grid(row=0, column=0, sticky="nsew")
 
         # Создание таблицы сотрудников
-        self.employees_table = ttk.Treeview(
-            frame,
+        self.employees_view = VirtualTable(
+            frame, self.db_file,
             columns=("ID", "ФИО", "Дата рождения", "Паспорт", "Банк", "Семья", "Здоровье"),
-            show="headings",
+            select_sql='''SELECT employee_id, name, birth_date, passport, bank_details, family_status, health_status
+                          FROM employees''',
+            key_columns=("employee_id",),
+            change_table='employees',
+            sort_columns={"ID": ("employee_id", 0), "ФИО": ("name", 1)},
             selectmode="browse"
         )
+        self.employees_table = self.employees_view.tree
+        self.employees_view.grid(row=1, column=0, columnspan=2, sticky="nsew")
 
-        headers = ["ID", "ФИО", "Дата рождения", "Паспорт", "Банк", "Семья", "Здоровье"]
-        for header in headers:
-            self.employees_table.heading(header, text=header)
-            self.employees_table.column(header, width=100, anchor="w")
-
-        self.employees_table.grid(row=0, column=0, sticky="nsew")
-
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.employees_table.yview)
-        self.employees_table.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        # Фильтр по началу ФИО
+        FilterBar(frame, self.employees_view, [PrefixFilter("ФИО", "name")]).grid(
+            row=0, column=0, columnspan=2, sticky="w", pady=(0, 5))
 
         # Фрейм для кнопок управления
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=1, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=2, column=0, columnspan=2, pady=10)
 
         ttk.Button(
             button_frame,
@@ -1367,7 +1367,7 @@ class MainWindow(tk.Tk):
 
         # Настройка адаптивности
         frame.columnconfigure(0, weight=1)
-        frame.rowconfigure(0, weight=1)
+        frame.rowconfigure(1, weight=1)
         self.employees_frame.columnconfigure(0, weight=1)
         self.employees_frame.rowconfigure(0, weight=1)
 
@@ -1399,12 +1399,9 @@ class MainWindow(tk.Tk):
 
         try:
             # Подключение к вашей БД
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
             cursor = conn.cursor()
 
-            # Включаем проверку внешних ключей
-            cursor.execute("PRAGMA foreign_keys = ON")
-
             # Пытаемся удалить сотрудника
             cursor.execute("DELETE FROM employees WHERE employee_id = ?", (emp_id,))
 
@@ -1419,6 +1416,7 @@ class MainWindow(tk.Tk):
 
         except sqlite3.IntegrityError as e:
             # Обработка ошибки связанных данных
+            conn.rollback()
             messagebox.showerror(
                 "Ошибка удаления",
                 "Невозможно удалить сотрудника:\n"
@@ -1427,87 +1425,32 @@ class MainWindow(tk.Tk):
             )
         except sqlite3.OperationalError as e:
             # Обработка других ошибок БД
+            conn.rollback()
             messagebox.showerror("Ошибка БД", f"Ошибка при работе с базой данных: {str(e)}")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Произошла непредвиденная ошибка: {str(e)}")
-        finally:
-            try:
-                if conn:
-                    conn.close()
-            except:
-                pass
-
-    def load_employees(self):
-        """Загружает сотрудников из базы данных в таблицу"""
-        # Очистка существующих данных
-        for row in self.employees_table.get_children():
-            self.employees_table.delete(row)
-
-        conn = None
-        try:
-            # Подключение к вашей БД
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            # Получаем данные сотрудников
-            cursor.execute("""
-                           SELECT employee_id,
-                                  name,
-                                  birth_date,
-                                  passport,
-                                  bank_details,
-                                  family_status,
-                                  health_status
-                           FROM employees
-                           ORDER BY employee_id
-                           """)
-
-            # Вставляем данные в таблицу
-            for row in cursor.fetchall():
-                # Заменяем None на пустую строку для отображения
-                formatted_row = [str(value) if value is not None else "" for value in row]
-                self.employees_table.insert("", "end", values=formatted_row)
-
-        except sqlite3.OperationalError as e:
-            # Обработка ошибки отсутствия таблицы
-            if "no such table" in str(e):
-                messagebox.showerror(
-                    "Ошибка таблицы",
-                    "Таблица сотрудников не найдена в базе данных.\n"
-                    "Убедитесь, что таблица 'employees' существует."
-                )
-            else:
-                messagebox.showerror("Ошибка загрузки", f"Ошибка при загрузке сотрудников: {str(e)}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка: {str(e)}")
-        finally:
-            try:
-                if conn:
-                    conn.close()
-            except:
-                pass
 
     def init_access_tab(self):
         frame = ttk.Frame(self.access_frame, padding="10")
         frame.grid(row=0, column=0, sticky="nsew")
 
-        self.access_table = ttk.Treeview(frame, columns=("ID", "Сотрудник", "Дверь", "Время"), show="headings")
-        headers = ["ID", "Сотрудник", "Дверь", "Время"]
-        for header in headers:
-            self.access_table.heading(header, text=header)
-            self.access_table.column(header, width=100)
-        self.access_table.grid(row=0, column=0, sticky="nsew")
-
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.access_table.yview)
-        self.access_table.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.access_view = access_log_view(frame, self.db_file, ("ID", "Сотрудник", "Дверь", "Время"))
+        self.access_table = self.access_view.tree
+        self.access_view.grid(row=1, column=0, columnspan=2, sticky="nsew")
+        FilterBar(frame, self.access_view, [
+            PrefixFilter("Сотрудник", "name", "a.employee_id IN (SELECT employee_id FROM employees WHERE {})"),
+            ChoiceFilter("Дверь", "a.door_id", convert=int),
+            DateRangeFilter("Время", "a.timestamp"),
+        ]).grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 5))
 
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=1, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=2, column=0, columnspan=2, pady=10)
         ttk.Button(button_frame, text="Просмотреть журнал", command=self.view_access_log).grid(row=0, column=0, padx=5)
+        ttk.Button(button_frame, text="Присутствие", command=lambda: AccessAnalyticsDialog(self, self.db_file)).grid(
+            row=0, column=1, padx=5)
 
         frame.columnconfigure(0, weight=1)
-        frame.rowconfigure(0, weight=1)
+        frame.rowconfigure(1, weight=1)
         self.access_frame.columnconfigure(0, weight=1)
         self.access_frame.rowconfigure(0, weight=1)
 
@@ -1518,58 +1461,12 @@ class MainWindow(tk.Tk):
         # Исправленный вызов с передачей всех необходимых параметров
         AccessLogDialog(self, self.db_file, self)  # Добавлен третий аргумент - ссылка на главное приложение
 
-    def load_access_logs(self):
-        """Загружает данные журнала доступа в главное окно"""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            # Выбираем данные
-            cursor.execute('''
-                           SELECT a.log_id,
-                                  e.name,
-                                  a.door_id,
-                                  a.timestamp
-                           FROM access_logs a
-                                    JOIN employees e ON a.employee_id = e.employee_id
-                           ORDER BY a.timestamp DESC
-                           ''')
-
-            logs = cursor.fetchall()
-            conn.close()
-
-            # Очищаем таблицу
-            for item in self.access_table.get_children():
-                self.access_table.delete(item)
-
-            # Заполняем данными
-            for log in logs:
-                self.access_table.insert("", "end", values=log)
-
-        except sqlite3.Error as e:
-            messagebox.showerror(
-                "Ошибка базы данных",
-                f"Не удалось загрузить журнал доступа:\n{str(e)}",
-                parent=self
-            )
-
     def load_partners(self):
         try:
             if not table_exists(self.db_file, 'partners'):
                 messagebox.showerror("Ошибка", "Таблица 'partners' не существует.", parent=self)
                 return
-            for item in self.partners_table.get_children():
-                self.partners_table.delete(item)
-
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('SELECT partner_id, name, partner_type, rating, address, director_name, phone, email, inn FROM partners')
-            partners = cursor.fetchall()
-            conn.close()
-
-            print(f"Loaded {len(partners)} partners")
-            for partner in partners:
-                self.partners_table.insert("", "end", values=partner)
+            self.partners_view.refresh()
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка", f"Не удалось загрузить список партнеров: {str(e)}", parent=self)
 
@@ -1578,51 +1475,32 @@ class MainWindow(tk.Tk):
             if not table_exists(self.db_file, 'orders'):
                 messagebox.showerror("Ошибка", "Таблица 'orders' не существует.", parent=self)
                 return
-            for item in self.orders_table.get_children():
-                self.orders_table.delete(item)
-
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT o.order_id, p.name, pr.name, o.quantity, o.cost, o.status, o.created_date
-                FROM orders o
-                JOIN partners p ON o.partner_id = p.partner_id
-                JOIN products pr ON o.product_id = pr.product_id
-            ''')
-            orders = cursor.fetchall()
-            conn.close()
-
-            print(f"Loaded {len(orders)} orders")
-            for order in orders:
-                self.orders_table.insert("", "end", values=order)
-
-            self.check_preservation_timeouts()
+            self.orders_view.refresh()
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка", f"Не удалось загрузить заявки: {str(e)}", parent=self)
 
     def load_materials(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                           SELECT m.material_id, m.type, m.name, s.name, m.stock_quantity
-                           FROM materials m
-                                    LEFT JOIN suppliers s ON m.supplier_id = s.supplier_id
-                           ''')
-
-            # Очистка таблицы
-            for item in self.materials_tree.get_children():
-                self.materials_tree.delete(item)
-
-            # Заполнение данными
-            for row in cursor.fetchall():
-                self.materials_tree.insert("", "end", values=row)
-
+            self.materials_view.refresh()
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка", f"Ошибка загрузки материалов: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
+        get_background_queries(self).submit(
+            'reorder_suggestions',
+            lambda: suggest_purchase_orders(get_pool(self.db_file).connection()),
+            self.show_reorder_suggestions,
+            lambda e: print(f"Ошибка расчета закупок: {str(e)}"))
+
+    def show_reorder_suggestions(self, suggestions):
+        self.reorder_tree.delete(*self.reorder_tree.get_children())
+        for suggestion in suggestions:
+            package = f"упаковка {suggestion.package_quantity}" if suggestion.package_quantity else "поштучно"
+            parent = self.reorder_tree.insert(
+                "", "end", open=True,
+                text=f"{suggestion.supplier_name or 'Без поставщика'} ({package})",
+                values=("", suggestion.packages, ""))
+            for line in suggestion.lines:
+                self.reorder_tree.insert(parent, "end", text=f"{line.name} (ID: {line.material_id})",
+                                         values=(line.shortfall, line.packages, f"{line.quantity} {line.unit or ''}"))
 
     def show_products(self):
         selected = self.materials_tree.focus()
@@ -1638,18 +1516,7 @@ class MainWindow(tk.Tk):
             if not table_exists(self.db_file, 'employees'):
                 messagebox.showerror("Ошибка", "Таблица 'employees' не существует.", parent=self)
                 return
-            for item in self.employees_table.get_children():
-                self.employees_table.delete(item)
-
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('SELECT employee_id, name, birth_date, passport, bank_details, family_status, health_status FROM employees')
-            employees = cursor.fetchall()
-            conn.close()
-
-            print(f"Loaded {len(employees)} employees")
-            for employee in employees:
-                self.employees_table.insert("", "end", values=employee)
+            self.employees_view.refresh()
         except sqlite3.Error as e:
             print(f"Error loading employees: {str(e)}")
             messagebox.showerror("Ошибка", f"Не удалось загрузить список сотрудников: {str(e)}", parent=self)
@@ -1659,51 +1526,51 @@ class MainWindow(tk.Tk):
             if not table_exists(self.db_file, 'access_logs'):
                 messagebox.showerror("Ошибка", "Таблица 'access_logs' не существует.", parent=self)
                 return
-            for item in self.access_table.get_children():
-                self.access_table.delete(item)
-
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT a.log_id, e.name, a.door_id, a.timestamp
-                FROM access_logs a
-                JOIN employees e ON a.employee_id = e.employee_id
-            ''')
-            logs = cursor.fetchall()
-            conn.close()
-
-            print(f"Loaded {len(logs)} access logs")
-            for log in logs:
-                self.access_table.insert("", "end", values=log)
+            self.access_view.refresh()
         except sqlite3.Error as e:
             print(f"Error loading access logs: {str(e)}")
             messagebox.showerror("Ошибка", f"Не удалось загрузить журнал доступа: {str(e)}", parent=self)
 
-    def check_preservation_timeouts(self):
+    #перенос прошедших месяцев журнала доступа в разделы и архивация старых разделов, в фоне
+    def apply_access_retention(self):
+        get_background_queries(self).submit(
+            'access_retention',
+            lambda: apply_retention(get_pool(self.db_file).connection(), default_archive_dir(self.db_file)),
+            self.on_access_retention,
+            lambda e: print(f"Ошибка обслуживания журнала доступа: {str(e)}"))
+
+    def on_access_retention(self, result):
+        rotated, archived = result
+        for month, rows in rotated:
+            print(f"Журнал доступа: {month} перенесен в раздел ({rows} записей)")
+        for month, path in archived:
+            print(f"Журнал доступа: раздел {month} сжат в {path}")
+        if rotated or archived:
+            self.access_view.reload()
+
+    #события доступа приходят от access_ingest.py в другом процессе: вкладка догоняет журнал изменений
+    def poll_access_logs(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT order_id, created_date, partner_id
-                FROM orders
-                WHERE status = 'created' AND prepayment_date IS NULL
-            ''')
-            orders = cursor.fetchall()
-            for order_id, created_date, partner_id in orders:
-                created = datetime.strptime(created_date, "%Y-%m-%d")
-                if datetime.now() - created > timedelta(days=3):
-                    cursor.execute("UPDATE orders SET status = 'cancelled' WHERE order_id = ?", (order_id,))
-                    cursor.execute("SELECT email FROM partners WHERE partner_id = ?", (partner_id,))
-                    email = cursor.fetchone()[0]
-                    if email:
-                        print(f"Order {order_id} cancelled due to timeout. Notified partner: {email}")
-                    else:
-                        print(f"Order {order_id} cancelled due to timeout. No email for partner_id={partner_id}")
-            conn.commit()
+            self.access_view.refresh()
         except sqlite3.Error as e:
-            print(f"Error checking prepayment timeouts: {str(e)}")
-        finally:
-            conn.close()
+            print(f"Error refreshing access logs: {str(e)}")
+        self.after(ACCESS_REFRESH_MS, self.poll_access_logs)
+
+    #отмена просроченных заявок в фоне, повторяется каждые SWEEP_INTERVAL_MS
+    def check_preservation_timeouts(self):
+        get_background_queries(self).submit(
+            'preservation_timeouts',
+            lambda: sweep_preservation_timeouts(get_pool(self.db_file).connection()),
+            self.on_preservation_timeouts,
+            lambda e: print(f"Error checking prepayment timeouts: {str(e)}"))
+        self.after(SWEEP_INTERVAL_MS, self.check_preservation_timeouts)
+
+    def on_preservation_timeouts(self, result):
+        cancelled, seconds = result
+        print(f"Отмена просроченных заявок: отменено {len(cancelled)} за {seconds * 1000:.1f} мс")
+        if cancelled:
+            self.dispatcher.wake()
+            self.orders_view.refresh()
 
     def add_partner(self):
         PartnerDialog(self, self.db_file, self.manager_id)
@@ -1718,92 +1585,62 @@ class MainWindow(tk.Tk):
     def create_order(self):
         OrderDialog(self, self.db_file, self.manager_id)
 
+    #выделенные заявки (дерево допускает выделение нескольких строк)
+    def selected_order_ids(self):
+        return [int(iid) for iid in self.orders_table.selection()]
+
     def update_order_status(self):
-        selected_item = self.orders_table.selection()
-        if not selected_item:
-            messagebox.showwarning("Ошибка", "Выберите заявку для обновления статуса.", parent=self)
+        order_ids = self.selected_order_ids()
+        if not order_ids:
+            messagebox.showwarning("Ошибка", "Выберите заявки для обновления статуса.", parent=self)
             return
-        order_id = int(self.orders_table.item(selected_item)['values'][0])
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT order_id, status, product_id, quantity, partner_id FROM orders WHERE order_id = ?", (order_id,))
-            order = cursor.fetchone()
-            if not order:
-                messagebox.showerror("Ошибка", "Заявка не найдена.", parent=self)
-                conn.close()
-                return
-            _, current_status, product_id, quantity, partner_id = order
-            status_map = {
-                'created': 'prepaid',
-                'prepaid': 'in_production',
-                'in_production': 'delivered',
-                'delivered': 'completed'
-            }
-            if current_status not in status_map:
-                messagebox.showerror("Ошибка", f"Невозможный переход для статуса: {current_status}", parent=self)
-                conn.close()
-                return
-            new_status = status_map[current_status]
-            if new_status == 'prepaid':
-                cursor.execute('UPDATE orders SET status = ?, prepayment_date = ? WHERE order_id = ?',
-                              (new_status, datetime.now().strftime('%Y-%m-%d'), order_id))
-            elif new_status == 'in_production':
-                cursor.execute('SELECT stock_quantity FROM materials WHERE material_id = ?', (1,))
-                material = cursor.fetchone()
-                if not material or material[0] < quantity:
-                    messagebox.showerror("Ошибка", "Недостаточно материала на складе.", parent=self)
-                    conn.close()
-                    return
-                cursor.execute('UPDATE materials SET stock_quantity = stock_quantity - ? WHERE material_id = ?', (quantity, 1))
-                cursor.execute('''
-                    INSERT INTO warehouse_movements (material_id, product_id, quantity, movement_type, date)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (1, product_id, quantity, 'outgoing', datetime.now().strftime('%Y-%m-%d')))
-                cursor.execute('UPDATE orders SET status = ? WHERE order_id = ?', (new_status, order_id))
-            elif new_status == 'completed':
-                cursor.execute('UPDATE orders SET status = ?, completion_date = ? WHERE order_id = ?',
-                              (new_status, datetime.now().strftime('%Y-%m-%d'), order_id))
-                cursor.execute('SELECT email FROM partners WHERE partner_id = ?', (partner_id,))
-                email = cursor.fetchone()[0]
-            else:
-                cursor.execute('UPDATE orders SET status = ? WHERE order_id = ?', (new_status, order_id))
-            conn.commit()
-            self.load_orders()
+            advanced = advance_orders(get_pool(self.db_file).connection(), order_ids)
+        except OrderTransitionError as e:
+            messagebox.showerror("Ошибка", "Статус не изменен ни у одной заявки:\n" + "\n".join(
+                f"Заявка {order_id}: {reason}" for order_id, reason in e.errors[:20]), parent=self)
+            return
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка", f"Ошибка обновления статуса: {str(e)}", parent=self)
-        finally:
-            conn.close()
+            return
+        if 'completed' in advanced:
+            self.dispatcher.wake()
+        self.load_orders()
+        if 'in_production' in advanced:
+            self.load_materials()
 
     def cancel_order(self):
-        selected_item = self.orders_table.selection()
-        if not selected_item:
-            messagebox.showwarning("Ошибка", "Выберите заявку для отмены.", parent=self)
+        order_ids = self.selected_order_ids()
+        if not order_ids:
+            messagebox.showwarning("Ошибка", "Выберите заявки для отмены.", parent=self)
             return
-        order_id = int(self.orders_table.item(selected_item)['values'][0])
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT status, partner_id FROM orders WHERE order_id = ?", (order_id,))
-            order = cursor.fetchone()
-            if not order:
-                messagebox.showerror("Ошибка", "Заявка не найдена.", parent=self)
-                conn.close()
-                return
-            status, partner_id = order
-            if status not in ['created', 'prepaid']:
-                messagebox.showwarning("Ошибка", "Можно отменить только заявки в статусе 'created' или 'prepaid'.", parent=self)
-                conn.close()
-                return
-            cursor.execute("UPDATE orders SET status = 'cancelled' WHERE order_id = ?", (order_id,))
-            cursor.execute("SELECT email FROM partners WHERE partner_id = ?", (partner_id,))
-            email = cursor.fetchone()[0]
-            conn.commit()
-            self.load_orders()
+            cancel_orders(get_pool(self.db_file).connection(), order_ids)
+        except OrderTransitionError as e:
+            messagebox.showwarning("Ошибка", "Можно отменить только заявки в статусе 'created' или 'prepaid':\n" + "\n".join(
+                f"Заявка {order_id}: {reason}" for order_id, reason in e.errors[:20]), parent=self)
+            return
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка", f"Ошибка отмены заявки: {str(e)}", parent=self)
-        finally:
-            conn.close()
+            return
+        self.dispatcher.wake()
+        self.load_orders()
+
+    #после изменения цен продукции: стоимость новых заявок пересчитывается по прайс-листу и скидкам партнеров
+    def reprice_orders(self):
+        if not messagebox.askyesno("Подтверждение", "Пересчитать стоимость заявок в статусе 'created' по текущим ценам?",
+                                   parent=self):
+            return
+        get_background_queries(self).submit(
+            'reprice_orders',
+            lambda: reprice_open_orders(get_pool(self.db_file).connection(), get_pricing_engine(self.db_file)),
+            self.on_orders_repriced,
+            lambda e: messagebox.showerror("Ошибка", f"Ошибка пересчета цен: {str(e)}", parent=self))
+
+    def on_orders_repriced(self, changed):
+        messagebox.showinfo("Информация", f"Стоимость изменена у заявок: {len(changed)}", parent=self)
+        if changed:
+            self.load_orders()
 
     def view_sales(self):
         selected_item = self.partners_table.selection()
@@ -1829,7 +1666,9 @@ class MainWindow(tk.Tk):
             if partner_id != 1:
                 messagebox.showinfo("Информация", "Тест расчета материала доступен только для партнера с ID=1.", parent=self)
                 return
-            conn = sqlite3.connect(self.db_file)
+            conn = get_pool(self.db_file).connection()
+            #коэффициенты могли поменяться в БД с момента запуска
+            load_coefficients(conn)
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT s.quantity, p.product_type_id, p.param1, p.param2
@@ -1838,7 +1677,6 @@ class MainWindow(tk.Tk):
                 WHERE s.partner_id = ?
             ''', (partner_id,))
             sale = cursor.fetchone()
-            conn.close()
             if not sale:
                 messagebox.showerror("Ошибка", "Нет данных о продажах для этого партнера.", parent=self)
                 return
@@ -1887,6 +1725,9 @@ class ProductsForMaterialDialog(tk.Toplevel):
             self.tree.heading("Количество материала", text="Количество материала")
             self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+            self.status_label = ttk.Label(main_frame, text="Загрузка...")
+            self.status_label.pack()
+
             # Кнопка закрытия
             ttk.Button(
                 main_frame,
@@ -1899,11 +1740,13 @@ class ProductsForMaterialDialog(tk.Toplevel):
 
         def load_data(self):
             """Загружает данные о продукции для материала"""
-            try:
-                conn = sqlite3.connect(self.db_file)
-                cursor = conn.cursor()
+            self.status_label.configure(text="Загрузка...")
+            get_background_queries(self).submit(f"material_products:{self}", self.fetch_rows,
+                                                self.show_rows, self.show_error)
 
-                cursor.execute("""
+        def fetch_rows(self):
+            """Выполняется в рабочем потоке"""
+            return get_pool(self.db_file).fetchall("""
                                SELECT p.name,
                                       SUM(wm.quantity) as total_material
                                FROM products p
@@ -1913,22 +1756,28 @@ class ProductsForMaterialDialog(tk.Toplevel):
                                GROUP BY p.product_id
                                """, (self.material_id,))
 
-                # Очистка таблицы
-                for row in self.tree.get_children():
-                    self.tree.delete(row)
+        def show_rows(self, rows):
+            # Очистка таблицы
+            for row in self.tree.get_children():
+                self.tree.delete(row)
 
-                # Заполнение данными
-                for row in cursor.fetchall():
-                    self.tree.insert("", tk.END, values=row)
+            # Заполнение данными
+            for row in rows:
+                self.tree.insert("", tk.END, values=row)
+            self.status_label.configure(text=f"Строк: {len(rows)}")
 
-            except sqlite3.Error as e:
-                messagebox.showerror("Ошибка", f"Ошибка загрузки данных: {str(e)}", parent=self)
-            finally:
-                conn.close()
+        def show_error(self, error):
+            self.status_label.configure(text="")
+            messagebox.showerror("Ошибка", f"Ошибка загрузки данных: {str(error)}", parent=self)
 
 if __name__ == "__main__":
     try:
         app = MainWindow(DB_FILE)
         app.mainloop()
+        if getattr(app, 'background_queries', None) is not None:
+            app.background_queries.shutdown()
+        app.dispatcher.stop()
+        print(f"Соединений с БД открыто за сеанс: {connections_opened()}")
+        close_all_pools()
     except KeyboardInterrupt:
         print("Программа корректно завершена")
@@ -0,0 +1,407 @@
+import sqlite3
+import sys
+from datetime import datetime
+
+import access_analytics
+import access_partitions
+import sales_totals
+import reorder
+import search
+import stock_ledger
+
+#таблицы, изменения которых пишутся в change_log (для VirtualTable.refresh): таблица -> первичный ключ
+CHANGE_TRACKED_TABLES = {
+    'partners': 'partner_id',
+    'orders': 'order_id',
+    'materials': 'material_id',
+    'employees': 'employee_id',
+    'access_logs': 'log_id',
+}
+
+
+def change_log_triggers(table, pk):
+    """Триггеры, записывающие в change_log первичные ключи вставленных, измененных и удаленных строк"""
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_insert AFTER INSERT ON {table}
+           BEGIN
+               INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', NEW.{pk}, 'I');
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_update AFTER UPDATE ON {table}
+           BEGIN
+               INSERT INTO change_log (table_name, row_id, op) SELECT '{table}', OLD.{pk}, 'D' WHERE OLD.{pk} IS NOT NEW.{pk};
+               INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', NEW.{pk}, 'U');
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_delete AFTER DELETE ON {table}
+           BEGIN
+               INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', OLD.{pk}, 'D');
+           END''',
+    ]
+
+
+def data_version_triggers(table, name, update_columns=None):
+    """Триггеры, увеличивающие версию name в data_versions при любом изменении таблицы
+
+    update_columns - при UPDATE версия растет, только если изменилось значение одного из этих столбцов
+    (при INSERT и DELETE - всегда).
+    """
+    bump = (f"INSERT INTO data_versions (name, version) VALUES ('{name}', 1) "
+            f"ON CONFLICT(name) DO UPDATE SET version = version + 1;")
+    events = {'insert': f"INSERT ON {table}", 'update': f"UPDATE ON {table}", 'delete': f"DELETE ON {table}"}
+    if update_columns:
+        #UPDATE OF срабатывает и при записи того же значения, поэтому нужно еще сравнение OLD и NEW
+        changed = ' OR '.join(f"OLD.{column} IS NOT NEW.{column}" for column in update_columns)
+        events['update'] = f"UPDATE OF {', '.join(update_columns)} ON {table} WHEN {changed}"
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event} AFTER {event_sql}
+           BEGIN
+               {bump}
+           END'''
+        for event, event_sql in events.items()
+    ]
+
+
+#версионированные миграции схемы: (версия, описание, шаги)
+#шаг - строка SQL или функция, принимающая курсор
+MIGRATIONS = [
+    (1, 'индексы для горячих запросов', [
+        #SalesDialog.load_sales_data, test_material_calculation
+        "CREATE INDEX IF NOT EXISTS idx_sales_partner_id ON sales(partner_id)",
+        #orders.sweep_preservation_timeouts
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_prepayment ON orders(status, prepayment_date, created_date)",
+        #ProductsForMaterialDialog.load_data
+        "CREATE INDEX IF NOT EXISTS idx_warehouse_movements_material_id ON warehouse_movements(material_id, product_id)",
+        #ORDER BY в load_access_logs
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp ON access_logs(timestamp)",
+        #LoginDialog.login
+        "CREATE INDEX IF NOT EXISTS idx_managers_email_password ON managers(email, password)",
+    ]),
+    (2, 'контрольные точки инкрементального импорта csv', [
+        '''CREATE TABLE IF NOT EXISTS import_checkpoints (
+              file_name TEXT PRIMARY KEY,
+              size INTEGER NOT NULL,
+              mtime INTEGER NOT NULL,
+              content_hash TEXT NOT NULL,
+              offset INTEGER NOT NULL,
+              imported_at TEXT NOT NULL
+        )''',
+    ]),
+    (3, 'журнал изменений для обновления таблиц по разнице', [
+        '''CREATE TABLE IF NOT EXISTS change_log (
+              change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+              table_name TEXT NOT NULL,
+              row_id INTEGER NOT NULL,
+              op TEXT NOT NULL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_change_log_table ON change_log(table_name, change_id)",
+    ] + [sql for table, pk in CHANGE_TRACKED_TABLES.items() for sql in change_log_triggers(table, pk)]),
+    (4, 'таблицы коэффициентов для calculate.py', [
+        #версии справочников: по ним кэши в памяти понимают, что пора перечитать данные
+        '''CREATE TABLE IF NOT EXISTS data_versions (
+              name TEXT PRIMARY KEY,
+              version INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS product_type_coefficients (
+              product_type_id INTEGER PRIMARY KEY,
+              coefficient REAL NOT NULL CHECK(coefficient > 0)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS material_defect_rates (
+              material_type_id INTEGER PRIMARY KEY,
+              defect_rate REAL NOT NULL CHECK(defect_rate >= 0 AND defect_rate < 1)
+        )''',
+    ] + [sql for table in ('product_type_coefficients', 'material_defect_rates')
+         for sql in data_version_triggers(table, 'coefficients')] + [
+        #прежние значения из calculate.py; типы продукции 1xx/2xx из products.csv получают коэффициенты
+        #групп 1 и 2, для остальных типов коэффициенты нужно внести в таблицу
+        '''INSERT OR IGNORE INTO product_type_coefficients (product_type_id, coefficient) VALUES
+              (1, 1.5), (2, 2.0), (101, 1.5), (102, 1.5), (103, 1.5), (201, 2.0)''',
+        "INSERT OR IGNORE INTO material_defect_rates (material_type_id, defect_rate) VALUES (1, 0.1), (2, 0.2)",
+    ]),
+    (5, 'итоги продаж по партнерам (partner_sales_totals)', [
+        sales_totals.CREATE_TABLE,
+        sales_totals.rebuild_totals,
+        sales_totals.create_triggers,
+    ]),
+    (6, 'outbox уведомлений о заявках', [
+        '''CREATE TABLE IF NOT EXISTS notification_outbox (
+              notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+              event TEXT NOT NULL,
+              order_id INTEGER,
+              partner_id INTEGER,
+              recipient TEXT,
+              subject TEXT NOT NULL,
+              body TEXT NOT NULL,
+              status TEXT NOT NULL CHECK(status IN ('pending', 'sent', 'failed', 'skipped')),
+              attempts INTEGER NOT NULL DEFAULT 0,
+              next_attempt_at TEXT NOT NULL,
+              created_at TEXT NOT NULL,
+              sent_at TEXT,
+              last_error TEXT
+        )''',
+        #NotificationDispatcher.dispatch_once
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(status, next_attempt_at)",
+    ]),
+    (7, 'спецификации материалов продукции (product_materials)', [
+        #material_type_id - тип для процента брака из material_defect_rates, может отсутствовать
+        '''CREATE TABLE IF NOT EXISTS product_materials (
+              product_id INTEGER NOT NULL,
+              material_id INTEGER NOT NULL,
+              quantity_per_unit REAL NOT NULL CHECK(quantity_per_unit > 0),
+              material_type_id INTEGER,
+              PRIMARY KEY (product_id, material_id),
+              FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE,
+              FOREIGN KEY (material_id) REFERENCES materials(material_id) ON DELETE RESTRICT
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_product_materials_material_id ON product_materials(material_id)",
+    ]),
+    (8, 'снимки остатков для книги склада', [
+        '''CREATE TABLE IF NOT EXISTS stock_snapshots (
+              material_id INTEGER NOT NULL,
+              snapshot_date TEXT NOT NULL,
+              balance INTEGER NOT NULL,
+              PRIMARY KEY (material_id, snapshot_date),
+              FOREIGN KEY (material_id) REFERENCES materials(material_id) ON DELETE CASCADE
+        ) WITHOUT ROWID''',
+        #суммы движений за период читаются только из индекса
+        "CREATE INDEX IF NOT EXISTS idx_warehouse_movements_ledger ON warehouse_movements(material_id, date, movement_type, quantity)",
+        stock_ledger.take_opening_snapshot,
+    ]),
+    (9, 'частичный индекс материалов ниже минимального остатка', [
+        #в индекс попадают только строки с нехваткой, он остается маленьким при любом размере materials
+        '''CREATE INDEX IF NOT EXISTS idx_materials_below_min ON materials(supplier_id, package_quantity, material_id)
+           WHERE stock_quantity < min_quantity''',
+    ]),
+    (10, 'индексы для фильтров и сортировки вкладок', [
+        #сортировка по заголовку: ключ страницы (столбец, первичный ключ) читается по индексу без сортировки,
+        #rowid в конце любого индекса и есть второй столбец ключа
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_created_date ON orders(created_date)",
+        #статус вместе с периодом или сортировкой по дате
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created_date ON orders(status, created_date)",
+        #фильтр по партнеру (подзапрос по partners(name)), в том числе вместе со статусом
+        "CREATE INDEX IF NOT EXISTS idx_orders_partner_status ON orders(partner_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_partner_type ON partners(partner_type)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_rating ON partners(rating)",
+        "CREATE INDEX IF NOT EXISTS idx_materials_type ON materials(type)",
+        "CREATE INDEX IF NOT EXISTS idx_materials_name ON materials(name)",
+        "CREATE INDEX IF NOT EXISTS idx_materials_stock_quantity ON materials(stock_quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_employees_name ON employees(name)",
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_employee_id ON access_logs(employee_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_door_id ON access_logs(door_id, timestamp)",
+        #при нескольких подходящих индексах (партнер + статус) планировщик выбирает по статистике;
+        #дальше ее обновляет PRAGMA optimize при закрытии соединений пула
+        "ANALYZE",
+    ]),
+    (11, 'полнотекстовый поиск по партнерам и продукции (FTS5)', [
+        search.create_indexes,
+    ]),
+    (12, 'месячные разделы журнала доступа: каталог и представление истории', [
+        access_partitions.create_catalog,
+    ]),
+    (13, 'интервалы присутствия сотрудников (access_sessions)', [
+        access_analytics.create_tables,
+    ]),
+    #версии для reference_cache: списки партнеров и продукции в окнах перечитываются только после изменений
+    (14, 'версии справочников партнеров и продукции', [
+        sql for table in ('partners', 'products') for sql in data_version_triggers(table, table)
+    ]),
+    #версия для pricing: запомненные скидки партнеров сбрасываются, только когда меняется ступень скидки,
+    #а не объем продаж
+    (15, 'версия скидок партнеров',
+        data_version_triggers('partner_sales_totals', 'partner_discounts', update_columns=('discount',))),
+    #csv_import.IncrementalImporter: измененный csv сверяется со строками, загруженными из него, а не вставляется заново
+    (16, 'строки таблиц, загруженные из каждого csv', [
+        '''CREATE TABLE IF NOT EXISTS import_rows (
+              file_name TEXT NOT NULL,
+              row_id INTEGER NOT NULL,
+              PRIMARY KEY (file_name, row_id)
+        ) WITHOUT ROWID''',
+        #файлы, загруженные раньше, при следующем запуске сопоставляются со строками таблиц заново
+        "DELETE FROM import_checkpoints",
+    ]),
+    #коэффициенты типов продукции и проценты брака теперь загружаются из product_type_coefficients.csv
+    #и material_defect_rates.csv (csv_import). Значения, которые миграция 4 вывела для 101-103 и 201
+    #из групп 1 и 2, ни на чем не основаны: если их не поменяли вручную, они удаляются, и расчеты по этим
+    #типам ждут утвержденных значений в файле
+    (17, 'справочники коэффициентов из csv', [
+        '''DELETE FROM product_type_coefficients
+           WHERE (product_type_id, coefficient) IN (VALUES (101, 1.5), (102, 1.5), (103, 1.5), (201, 2.0))''',
+    ]),
+]
+
+#сколько последних записей change_log хранить (см. prune_change_log)
+CHANGE_LOG_KEEP = 100000
+
+#запросы из main.py, которые обязаны идти по индексу (см. check_query_plans)
+HOT_QUERIES = {
+    'LoginDialog.login':
+        ("SELECT manager_id, name FROM managers WHERE email = ? AND password = ?", ('', '')),
+    'SalesDialog.load_sales_data (итоги)':
+        ("SELECT total_quantity, discount FROM partner_sales_totals WHERE partner_id = ?", (0,)),
+    'SalesDialog.load_sales_data (строки)':
+        ('''SELECT p.name, s.quantity, s.sale_date
+            FROM sales s
+            JOIN products p ON s.product_id = p.product_id
+            WHERE s.partner_id = ?''', (0,)),
+    'MainWindow.test_material_calculation':
+        ('''SELECT s.quantity, p.product_type_id, p.param1, p.param2
+            FROM sales s
+            JOIN products p ON s.product_id = p.product_id
+            WHERE s.partner_id = ?''', (0,)),
+    'orders.sweep_preservation_timeouts':
+        ('''UPDATE orders SET status = 'cancelled'
+            WHERE status = 'created' AND prepayment_date IS NULL AND created_date < ?
+            RETURNING order_id, partner_id''', ('',)),
+    'ProductsForMaterialDialog.load_data':
+        ('''SELECT p.name, SUM(wm.quantity) as total_material
+            FROM products p
+            JOIN warehouse_movements wm ON p.product_id = wm.product_id
+            WHERE wm.material_id = ?
+            GROUP BY p.product_id''', (0,)),
+    'VirtualTable.fetch_changes':
+        ("SELECT DISTINCT row_id FROM change_log WHERE table_name = ? AND change_id > ? AND change_id <= ?",
+         ('orders', 0, 0)),
+    'NotificationDispatcher.dispatch_once':
+        ('''SELECT notification_id, recipient, subject, body
+            FROM notification_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?''', ('', 50)),
+    'stock_ledger.balance_at':
+        (stock_ledger._BALANCES_SQL.format(where='WHERE m.material_id = :material_id'),
+         {'day': '2025-01-01', 'material_id': 1}),
+    'reorder.low_stock_materials':
+        (reorder.LOW_STOCK_SQL, ()),
+    'access_log_view (страница журнала доступа)':
+        ('''SELECT a.log_id, e.name, a.door_id, a.timestamp
+            FROM access_logs a
+            JOIN employees e ON a.employee_id = e.employee_id
+            WHERE a.log_id IN (SELECT a.log_id FROM access_logs a
+                               WHERE (a.timestamp, a.log_id) < (?, ?)
+                               ORDER BY a.timestamp DESC, a.log_id DESC LIMIT ?)
+            ORDER BY a.timestamp DESC, a.log_id DESC''', ('', 0, 200)),
+    'access_log_view (фильтр по сотруднику и периоду)':
+        ('''SELECT a.log_id FROM access_logs a
+            WHERE (a.employee_id IN (SELECT employee_id FROM employees WHERE (name >= ? AND name < ?)))
+              AND a.timestamp >= ? AND a.timestamp < ?
+            ORDER BY a.timestamp DESC, a.log_id DESC LIMIT ?''', ('', '', '', '', 200)),
+    'access_partitions (история за период)':
+        ('''SELECT a.log_id, a.employee_id, a.door_id, a.timestamp FROM access_logs_history a
+            WHERE a.timestamp >= ? AND a.timestamp < ?''', ('', '')),
+    'access_analytics._apply_events':
+        ('''SELECT session_id, start_time, end_time, events, first_door, last_door
+            FROM access_sessions WHERE employee_id = ? AND day = ?''', (0, '')),
+    'access_analytics.update_sessions':
+        ('''SELECT employee_id, door_id, timestamp FROM access_logs_history
+            WHERE log_id > ? AND log_id <= ?''', (0, 0)),
+    'access_analytics.daily_presence':
+        ('''SELECT d.employee_id, e.name, d.day, d.first_in, d.last_out, d.sessions, d.events, d.seconds
+            FROM access_presence_days d
+            JOIN employees e ON e.employee_id = d.employee_id
+            WHERE d.day >= ? AND d.day <= ?
+            ORDER BY d.day, d.employee_id''', ('', '')),
+    'access_analytics.door_occupancy':
+        ('''SELECT employee_id, last_door, MAX(end_time) FROM access_sessions
+            WHERE end_time >= ? AND end_time <= ? GROUP BY employee_id''', ('', '')),
+    'pricing.reprice_open_orders':
+        ('''SELECT o.order_id, o.product_id, o.quantity, o.cost, t.discount
+            FROM orders o
+            LEFT JOIN partner_sales_totals t ON t.partner_id = o.partner_id
+            WHERE o.status IN (?)''', ('created',)),
+    'orders_view (фильтр по партнеру и статусу)':
+        ('''SELECT o.order_id FROM orders o
+            WHERE (o.partner_id IN (SELECT partner_id FROM partners WHERE (name >= ? AND name < ?)))
+              AND o.status = ? AND (o.order_id) > (?)
+            ORDER BY o.order_id ASC LIMIT ?''', ('', '', '', 0, 200)),
+    'orders_view (период, сортировка по дате)':
+        ('''SELECT o.order_id FROM orders o
+            WHERE o.created_date >= ? AND o.created_date < ? AND (o.created_date, o.order_id) < (?, ?)
+            ORDER BY o.created_date DESC, o.order_id DESC LIMIT ?''', ('', '', '', 0, 200)),
+}
+
+
+def get_schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
+              description TEXT NOT NULL,
+              applied_at TEXT NOT NULL
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+#применяет все еще не примененные миграции по порядку, каждую в своей транзакции
+def apply_migrations(conn, migrations=None):
+    migrations = sorted(migrations or MIGRATIONS, key=lambda m: m[0])
+    current = get_schema_version(conn)
+    conn.commit()
+    applied = []
+    for version, description, steps in migrations:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                           (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            print(f"Ошибка миграции {version} ({description})")
+            raise
+        finally:
+            cursor.close()
+        print(f"Применена миграция {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+#удаляет старые записи журнала изменений; таблица, отставшая дальше, просто перезагрузится целиком
+def prune_change_log(conn, keep=CHANGE_LOG_KEEP):
+    cursor = conn.execute("DELETE FROM change_log WHERE change_id <= (SELECT MAX(change_id) FROM change_log) - ?",
+                          (keep,))
+    conn.commit()
+    return cursor.rowcount
+
+
+#EXPLAIN QUERY PLAN для горячих запросов: возвращает список запросов с полным сканированием таблицы.
+#Планы строятся по копии схемы без данных и статистики: на маленькой базе с sqlite_stat1 планировщик
+#законно сканирует крошечные таблицы, а проверить нужно, что для запроса есть индекс
+def check_query_plans(conn, queries=None):
+    schema = sqlite3.connect(':memory:')
+    objects = conn.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'").fetchall()
+    #служебные таблицы FTS5 (partners_fts_data и т.п.) создает сама виртуальная таблица
+    virtual = [name for _, name, sql in objects if sql.startswith('CREATE VIRTUAL TABLE')]
+    for kind, name, sql in objects:
+        if kind == 'table' and any(name.startswith(f"{table}_") for table in virtual):
+            continue
+        schema.execute(sql)
+    problems = []
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = schema.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        details = [row[3] for row in plan]
+        full_scans = [d for d in details if d.startswith('SCAN') and 'USING' not in d]
+        if full_scans:
+            problems.append((name, full_scans))
+    schema.close()
+    return problems
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    conn = sqlite3.connect(db_file)
+    apply_migrations(conn)
+    problems = check_query_plans(conn)
+    conn.close()
+    for name, scans in problems:
+        print(f"Полное сканирование в {name}: {'; '.join(scans)}")
+    if problems:
+        sys.exit(1)
+    print(f"Все {len(HOT_QUERIES)} горячих запросов используют индексы")
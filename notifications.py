@@ -0,0 +1,191 @@
+import json
+import os
+import smtplib
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from data_access import get_pool
+
+#сколько уведомлений отправляется за один проход диспетчера
+BATCH_SIZE = 50
+#как часто диспетчер проверяет outbox, если его не разбудили, с
+POLL_INTERVAL = 5.0
+#повторы: задержка base * 2^(попытка-1), но не больше MAX_RETRY_DELAY; после MAX_ATTEMPTS - 'failed'
+BASE_RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+MAX_ATTEMPTS = 8
+SENDER = 'orders@localhost'
+
+#тексты уведомлений по событию заявки; %d - номер заявки
+ORDER_EVENTS = {
+    'cancelled': ("Заявка №%d отменена", "Ваша заявка №%d отменена."),
+    'timeout': ("Заявка №%d отменена", "Заявка №%d отменена: предоплата не поступила вовремя."),
+    'completed': ("Заявка №%d выполнена", "Ваша заявка №%d выполнена."),
+}
+
+_ENQUEUE_SQL = '''
+    INSERT INTO notification_outbox (event, order_id, partner_id, recipient, subject, body, status,
+                                     next_attempt_at, created_at)
+    SELECT ?, o.order_id, o.partner_id, p.email, printf(?, o.order_id), printf(?, o.order_id),
+           CASE WHEN p.email IS NULL OR p.email = '' THEN 'skipped' ELSE 'pending' END, ?, ?
+    FROM orders o
+    JOIN partners p ON o.partner_id = p.partner_id
+    WHERE o.order_id = ?
+'''
+
+
+def _timestamp(moment=None):
+    return (moment or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue_order_notifications(cursor, event, order_ids):
+    """Ставит уведомления о заявках в outbox; вызывается в транзакции, которая меняет заявки"""
+    subject, body = ORDER_EVENTS[event]
+    now = _timestamp()
+    cursor.executemany(_ENQUEUE_SQL, [(event, subject, body, now, now, order_id) for order_id in order_ids])
+
+
+#транспорт получает список уведомлений (notification_id, recipient, subject, body)
+#и возвращает {notification_id: текст ошибки} для неотправленных
+
+#запись уведомлений в файл по строке json - для отладки и тестов
+class FileSinkTransport:
+    def __init__(self, path):
+        self.path = path
+
+    def send_batch(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for notification_id, recipient, subject, body in messages:
+                f.write(json.dumps({'id': notification_id, 'to': recipient, 'subject': subject, 'body': body,
+                                    'sent_at': _timestamp()}, ensure_ascii=False) + '\n')
+        return {}
+
+
+#отправка через SMTP (по умолчанию локальная заглушка: python -m aiosmtpd -n -l localhost:1025)
+class SmtpTransport:
+    def __init__(self, host='localhost', port=1025, sender=SENDER, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        errors = {}
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                for notification_id, recipient, subject, body in messages:
+                    message = EmailMessage()
+                    message['From'] = self.sender
+                    message['To'] = recipient
+                    message['Subject'] = subject
+                    message.set_content(body)
+                    try:
+                        smtp.send_message(message)
+                    except smtplib.SMTPException as e:
+                        errors[notification_id] = str(e)
+        except (OSError, smtplib.SMTPException) as e:
+            #сервер недоступен - не отправлено ничего из еще не обработанного
+            for notification_id, *_ in messages:
+                errors.setdefault(notification_id, str(e))
+        return errors
+
+
+def retry_delay(attempts, base=BASE_RETRY_DELAY, limit=MAX_RETRY_DELAY):
+    return min(base * 2 ** (attempts - 1), limit)
+
+
+#фоновая отправка уведомлений из notification_outbox; главный поток только вызывает wake()
+class NotificationDispatcher:
+    def __init__(self, db_file, transport, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS, base_delay=BASE_RETRY_DELAY):
+        self.db_file = db_file
+        self.transport = transport
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Проверить outbox сразу, не дожидаясь интервала"""
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                #пока пачки полные, в outbox могут быть еще уведомления
+                while not self._stop.is_set() and self.dispatch_once() == self.batch_size:
+                    pass
+            except sqlite3.Error as e:
+                print(f"Ошибка отправки уведомлений: {str(e)}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def dispatch_once(self, now=None):
+        """Отправляет одну пачку уведомлений, срок которых подошел; возвращает размер пачки"""
+        now = now or datetime.now()
+        conn = get_pool(self.db_file).connection()
+        messages = conn.execute('''
+            SELECT notification_id, recipient, subject, body
+            FROM notification_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (_timestamp(now), self.batch_size)).fetchall()
+        if not messages:
+            return 0
+        try:
+            errors = self.transport.send_batch(messages)
+        except Exception as e:
+            errors = {notification_id: str(e) for notification_id, *_ in messages}
+        attempts = dict(conn.execute(
+            f"SELECT notification_id, attempts FROM notification_outbox WHERE notification_id IN "
+            f"({', '.join('?' * len(messages))})", [m[0] for m in messages]).fetchall())
+        sent = [(_timestamp(now), notification_id) for notification_id, *_ in messages
+                if notification_id not in errors]
+        failed = []
+        for notification_id, error in errors.items():
+            attempt = attempts[notification_id] + 1
+            status = 'failed' if attempt >= self.max_attempts else 'pending'
+            next_attempt = _timestamp(now + timedelta(seconds=retry_delay(attempt, self.base_delay)))
+            failed.append((status, attempt, next_attempt, error, notification_id))
+        try:
+            conn.executemany('''
+                UPDATE notification_outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL
+                WHERE notification_id = ?
+            ''', sent)
+            conn.executemany('''
+                UPDATE notification_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE notification_id = ?
+            ''', failed)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"Уведомления: отправлено {len(sent)}, ошибок {len(failed)}")
+        return len(messages)
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    sink = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(db_file)),
+                                                               'notifications.log')
+    dispatcher = NotificationDispatcher(db_file, FileSinkTransport(sink))
+    while dispatcher.dispatch_once() == dispatcher.batch_size:
+        pass
@@ -0,0 +1,151 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import bom
+from notifications import enqueue_order_notifications
+
+#через сколько дней без предоплаты созданная заявка отменяется
+PRESERVATION_DAYS = 3
+#как часто главное окно запускает отмену просроченных заявок, мс
+SWEEP_INTERVAL_MS = 60000
+
+
+#отменяет все просроченные заявки одним UPDATE по индексу idx_orders_status_prepayment,
+#в той же транзакции ставит уведомления партнерам в outbox;
+#возвращает (order_id, partner_id) отмененных заявок и время работы в секундах
+def sweep_preservation_timeouts(conn, days=PRESERVATION_DAYS, now=None):
+    started = time.perf_counter()
+    #created_date хранится как 'ГГГГ-ММ-ДД', то есть полночь дня создания
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cancelled = conn.execute('''
+            UPDATE orders SET status = 'cancelled'
+            WHERE status = 'created' AND prepayment_date IS NULL AND created_date < ?
+            RETURNING order_id, partner_id
+        ''', (cutoff,)).fetchall()
+        enqueue_order_notifications(conn, 'timeout', [order_id for order_id, _ in cancelled])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return cancelled, time.perf_counter() - started
+
+
+#допустимые переходы статуса заявки при продвижении вперед
+STATUS_TRANSITIONS = {
+    'created': 'prepaid',
+    'prepaid': 'in_production',
+    'in_production': 'delivered',
+    'delivered': 'completed'
+}
+#все статусы заявки по порядку жизненного цикла
+ORDER_STATUSES = ('created', 'prepaid', 'in_production', 'delivered', 'completed', 'cancelled')
+#статусы, из которых заявку можно отменить
+CANCELLABLE_STATUSES = ('created', 'prepaid')
+
+
+class OrderTransitionError(Exception):
+    """Переход невозможен; errors - список (order_id, причина)"""
+    def __init__(self, errors):
+        super().__init__("; ".join(f"заявка {order_id}: {reason}" for order_id, reason in errors))
+        self.errors = errors
+
+
+def _load_orders(conn, order_ids):
+    orders = {}
+    for start in range(0, len(order_ids), 500):
+        chunk = order_ids[start:start + 500]
+        for row in conn.execute(f'''
+            SELECT order_id, status, product_id, quantity FROM orders
+            WHERE order_id IN ({', '.join('?' * len(chunk))})
+        ''', chunk):
+            orders[row[0]] = row
+    return orders
+
+
+#переводит все заявки order_ids в следующий статус одной транзакцией: либо все, либо ни одной.
+#При запуске в производство материалы списываются по спецификациям (bom.py).
+#Возвращает {новый статус: [order_id, ...]}, при ошибках проверки - OrderTransitionError
+def advance_orders(conn, order_ids, today=None):
+    order_ids = list(dict.fromkeys(order_ids))
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    try:
+        #блокировка записи берется сразу: между проверкой склада и списанием его никто не изменит
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        orders = _load_orders(conn, order_ids)
+        errors = []
+        by_status = {}
+        for order_id in order_ids:
+            if order_id not in orders:
+                errors.append((order_id, "не найдена"))
+                continue
+            status = orders[order_id][1]
+            if status not in STATUS_TRANSITIONS:
+                errors.append((order_id, f"невозможный переход для статуса {status}"))
+                continue
+            by_status.setdefault(STATUS_TRANSITIONS[status], []).append(orders[order_id])
+        if errors:
+            raise OrderTransitionError(errors)
+
+        cursor = conn.cursor()
+        production = [(order_id, product_id, quantity)
+                      for order_id, _, product_id, quantity in by_status.get('in_production', [])]
+        if production:
+            try:
+                requirements = bom.load_requirements(conn, production)
+            except bom.RequirementError as e:
+                raise OrderTransitionError(e.errors) from e
+            shortages = bom.find_shortages(conn, requirements)
+            if shortages:
+                short = {material_id: (needed, available) for material_id, needed, available in shortages}
+                raise OrderTransitionError([
+                    (order_id, f"не хватает материала {material_id}: нужно {short[material_id][0]}, "
+                               f"на складе {short[material_id][1]}")
+                    for order_id, _, _ in production
+                    for material_id, _ in requirements[order_id] if material_id in short
+                ])
+            bom.reserve_materials(cursor, production, requirements, today)
+        for new_status, rows in by_status.items():
+            ids = [row[0] for row in rows]
+            if new_status == 'prepaid':
+                cursor.executemany('UPDATE orders SET status = ?, prepayment_date = ? WHERE order_id = ?',
+                                   [(new_status, today, order_id) for order_id in ids])
+            elif new_status == 'completed':
+                cursor.executemany('UPDATE orders SET status = ?, completion_date = ? WHERE order_id = ?',
+                                   [(new_status, today, order_id) for order_id in ids])
+                enqueue_order_notifications(cursor, 'completed', ids)
+            else:
+                cursor.executemany('UPDATE orders SET status = ? WHERE order_id = ?',
+                                   [(new_status, order_id) for order_id in ids])
+        conn.commit()
+    except (sqlite3.Error, OrderTransitionError):
+        conn.rollback()
+        raise
+    return {new_status: [row[0] for row in rows] for new_status, rows in by_status.items()}
+
+
+#отменяет все заявки order_ids одной транзакцией; отменить можно только заявки в CANCELLABLE_STATUSES
+def cancel_orders(conn, order_ids):
+    order_ids = list(dict.fromkeys(order_ids))
+    try:
+        #блокировка записи до проверки статусов, как в advance_orders: иначе заявку могут запустить
+        #в производство (и списать материалы) между проверкой и отменой
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        orders = _load_orders(conn, order_ids)
+        errors = [(order_id, "не найдена") for order_id in order_ids if order_id not in orders]
+        errors += [(order_id, f"нельзя отменить заявку в статусе {orders[order_id][1]}")
+                   for order_id in order_ids if order_id in orders and orders[order_id][1] not in CANCELLABLE_STATUSES]
+        if errors:
+            raise OrderTransitionError(errors)
+        cursor = conn.cursor()
+        cursor.executemany("UPDATE orders SET status = 'cancelled' WHERE order_id = ?",
+                           [(order_id,) for order_id in order_ids])
+        enqueue_order_notifications(cursor, 'cancelled', order_ids)
+        conn.commit()
+    except (sqlite3.Error, OrderTransitionError):
+        conn.rollback()
+        raise
+    return order_ids
@@ -0,0 +1,176 @@
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from calculate import calculate_discount
+from reference_cache import get_reference_cache
+from sales_totals import partner_totals
+
+#заявки в этих статусах пересчитываются после смены цен; после предоплаты стоимость уже согласована
+REPRICE_STATUSES = ('created',)
+#версия скидок партнеров в data_versions: растет, только когда у партнера меняется скидка (миграция 15)
+DISCOUNTS_VERSION = 'partner_discounts'
+
+#расчет стоимости заявки: цена продукции, скидка партнера, цена за единицу со скидкой, стоимость
+Quote = namedtuple('Quote', 'price discount unit_price cost')
+
+
+class PricingError(Exception):
+    """Стоимость нельзя рассчитать (например, продукции нет в справочнике)"""
+
+
+def unit_price(price, discount):
+    """Цена за единицу со скидкой discount (%), с точностью до копейки"""
+    return round(price * (100 - discount) / 100, 2)
+
+
+def order_cost(unit, quantity):
+    return round(unit * quantity, 2)
+
+
+#прайс-листы и скидки на процесс. Прайс-лист - {product_id: цена за единицу} для одной ступени скидки,
+#строится из снимка справочника продукции (reference_cache) при первом обращении к ступени и живет до смены
+#версии справочника. Скидки запоминаются по партнерам и сбрасываются целиком при смене версии скидок.
+#Словари заменяются, а не правятся, поэтому читать их можно из любого потока
+class PricingEngine:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._price_lists = (None, {})
+        self._discounts = (None, {})
+        self._lock = threading.Lock()
+        self.price_list_builds = 0
+
+    def _versions(self, conn):
+        #версии справочника продукции и скидок одним запросом по первичному ключу
+        versions = dict(conn.execute("SELECT name, version FROM data_versions WHERE name IN ('products', ?)",
+                                     (DISCOUNTS_VERSION,)))
+        return versions.get('products', 0), versions.get(DISCOUNTS_VERSION, 0)
+
+    def _snapshot(self, conn, version):
+        cache = get_reference_cache(self.db_file)
+        snapshot = cache.cached('products')
+        return snapshot if snapshot is not None and snapshot.version == version else cache.get(conn, 'products')
+
+    def _price_list(self, snapshot, discount):
+        version, lists = self._price_lists
+        if version == snapshot.version and discount in lists:
+            return lists[discount]
+        with self._lock:
+            version, lists = self._price_lists
+            if version != snapshot.version:
+                lists = {}
+            if discount not in lists:
+                lists = dict(lists)
+                lists[discount] = {product_id: unit_price(price, discount)
+                                   for product_id, _, price in snapshot.rows}
+                self.price_list_builds += 1
+            self._price_lists = (snapshot.version, lists)
+        return lists[discount]
+
+    def _discount(self, conn, version, partner_id):
+        memo_version, memo = self._discounts
+        if memo_version == version and partner_id in memo:
+            return memo[partner_id]
+        #скидку читаем вне блокировки, словарь подменяем копией, как в _price_list
+        discount = partner_totals(conn, partner_id)[1]
+        with self._lock:
+            memo_version, memo = self._discounts
+            memo = dict(memo) if memo_version == version else {}
+            memo[partner_id] = discount
+            self._discounts = (version, memo)
+        return discount
+
+    def price_list(self, conn, discount):
+        """{product_id: цена за единицу} для ступени скидки discount"""
+        return self._price_list(self._snapshot(conn, self._versions(conn)[0]), discount)
+
+    def discount(self, conn, partner_id):
+        return self._discount(conn, self._versions(conn)[1], partner_id)
+
+    def quote(self, conn, partner_id, product_id, quantity):
+        """Стоимость quantity единиц продукции для партнера по его текущей ступени скидки"""
+        products_version, discounts_version = self._versions(conn)
+        snapshot = self._snapshot(conn, products_version)
+        discount = self._discount(conn, discounts_version, partner_id)
+        unit = self._price_list(snapshot, discount).get(product_id)
+        if unit is None:
+            raise PricingError(f"Продукция {product_id} не найдена")
+        return Quote(snapshot.price_of(product_id), discount, unit, order_cost(unit, quantity))
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_pricing_engine(db_file):
+    with _engines_lock:
+        engine = _engines.get(db_file)
+        if engine is None:
+            engine = _engines[db_file] = PricingEngine(db_file)
+        return engine
+
+
+#пересчитывает стоимость открытых заявок по текущим ценам и скидкам одной транзакцией:
+#один проход по заявкам в statuses (индекс по status) вместе со скидками партнеров, запись только изменившихся.
+#Возвращает [(order_id, старая стоимость, новая стоимость), ...]
+def reprice_open_orders(conn, engine, statuses=REPRICE_STATUSES):
+    placeholders = ', '.join('?' * len(statuses))
+    changed = []
+    try:
+        #блокировка записи сразу: между чтением и записью стоимости заявки и цены никто не изменит
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        price_lists = {}
+        for order_id, product_id, quantity, cost, discount in conn.execute(f'''
+            SELECT o.order_id, o.product_id, o.quantity, o.cost, t.discount
+            FROM orders o
+            LEFT JOIN partner_sales_totals t ON t.partner_id = o.partner_id
+            WHERE o.status IN ({placeholders})
+        ''', statuses).fetchall():
+            if discount is None:
+                #у партнера еще нет продаж
+                discount = calculate_discount(0)
+            prices = price_lists.get(discount)
+            if prices is None:
+                prices = price_lists[discount] = engine.price_list(conn, discount)
+            unit = prices.get(product_id)
+            if unit is None:
+                continue
+            new_cost = order_cost(unit, quantity)
+            if new_cost != cost:
+                changed.append((order_id, cost, new_cost))
+        conn.executemany("UPDATE orders SET cost = ? WHERE order_id = ?",
+                         [(new_cost, order_id) for order_id, _, new_cost in changed])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return changed
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = sys.argv[1:]
+    db_file = args.pop(0) if args and args[0].endswith('.db') else DB_FILE
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON")
+    engine = get_pricing_engine(db_file)
+    command = args.pop(0) if args else 'reprice'
+    if command == 'quote' and len(args) == 3:
+        partner_id, product_id, quantity = map(int, args)
+        for attempt in ('первый расчет', 'из кэша'):
+            started = time.perf_counter()
+            quote = engine.quote(conn, partner_id, product_id, quantity)
+            print(f"{attempt}: {(time.perf_counter() - started) * 1000:.2f} мс")
+        print(f"Цена {quote.price}, скидка {quote.discount}%, за единицу {quote.unit_price}, стоимость {quote.cost}")
+    elif command == 'reprice':
+        started = time.perf_counter()
+        changed = reprice_open_orders(conn, engine)
+        print(f"Пересчитано заявок: {len(changed)} за {time.perf_counter() - started:.2f} с")
+        for order_id, old_cost, new_cost in changed[:20]:
+            print(f"  заявка {order_id}: {old_cost} -> {new_cost}")
+    else:
+        print("Использование: python pricing.py [файл.db] reprice | quote partner_id product_id количество")
+    conn.close()
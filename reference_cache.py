@@ -0,0 +1,179 @@
+import bisect
+import sqlite3
+import sys
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk
+
+#сколько вариантов показывает выпадающий список при вводе
+TYPEAHEAD_LIMIT = 50
+#задержка фильтрации после ввода, мс
+TYPEAHEAD_DEBOUNCE_MS = 150
+
+#справочник -> запрос (id, название, цена); версия справочника в data_versions ведется триггерами на таблице
+REFERENCES = {
+    'partners': "SELECT partner_id, name, NULL FROM partners",
+    'products': "SELECT product_id, name, min_partner_price FROM products",
+}
+
+
+def label(row_id, name):
+    """Подпись строки справочника в списке выбора"""
+    return f"{name} (ID: {row_id})"
+
+
+#неизменяемый снимок справочника: строки, подписи и индексы по ним; заменяется целиком при смене версии,
+#поэтому его можно читать из любого потока без блокировок
+class ReferenceSnapshot:
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.labels = [label(row_id, name) for row_id, name, _ in rows]
+        self.by_label = {text: row[0] for text, row in zip(self.labels, rows)}
+        self.by_id = {row[0]: row for row in rows}
+        self._label_of = dict(zip(self.by_label.values(), self.labels))
+        #поиск по началу подписи без учета регистра: отсортированные подписи в нижнем регистре + bisect
+        self._sorted = sorted((text.lower(), text) for text in self.labels)
+        self._keys = [key for key, _ in self._sorted]
+
+    def label_of(self, row_id):
+        return self._label_of.get(row_id, "")
+
+    def price_of(self, row_id):
+        row = self.by_id.get(row_id)
+        return row[2] if row else None
+
+    def matches(self, text, limit=TYPEAHEAD_LIMIT):
+        """Подписи, начинающиеся с text, затем содержащие text (без учета регистра), не больше limit"""
+        text = text.strip().lower()
+        if not text:
+            return self.labels[:limit]
+        start = bisect.bisect_left(self._keys, text)
+        found = []
+        for key, original in self._sorted[start:start + limit]:
+            if not key.startswith(text):
+                break
+            found.append(original)
+        if len(found) < limit:
+            seen = set(found)
+            for key, original in self._sorted:
+                if text in key and original not in seen:
+                    found.append(original)
+                    if len(found) >= limit:
+                        break
+        return found
+
+
+#кэш справочников на процесс: get() сверяет версию из data_versions (один запрос по первичному ключу)
+#и перечитывает таблицу, только если ее меняли. Все окна получают один и тот же снимок
+class ReferenceCache:
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, conn, name):
+        row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+        version = row[0] if row else 0
+        snapshot = self._snapshots.get(name)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+            if snapshot is None or snapshot.version != version:
+                snapshot = ReferenceSnapshot(version, conn.execute(REFERENCES[name]).fetchall())
+                self._snapshots[name] = snapshot
+                self.loads += 1
+        return snapshot
+
+    def cached(self, name):
+        """Последний загруженный снимок без обращения к БД (None, если справочник еще не читался)"""
+        return self._snapshots.get(name)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_reference_cache(db_file):
+    with _caches_lock:
+        cache = _caches.get(db_file)
+        if cache is None:
+            cache = _caches[db_file] = ReferenceCache()
+        return cache
+
+
+#выпадающий список с фильтрацией по вводу: в values попадают только TYPEAHEAD_LIMIT подходящих подписей,
+#а не весь справочник; Enter подставляет первое совпадение
+class ReferenceCombobox(ttk.Combobox):
+    def __init__(self, parent, limit=TYPEAHEAD_LIMIT, **options):
+        super().__init__(parent, **options)
+        self.limit = limit
+        self.snapshot = None
+        #подписи, выбранные не из снимка (например, из полнотекстового поиска по свежей продукции)
+        self._extra = {}
+        self._after_id = None
+        self.bind("<KeyRelease>", self._changed)
+        self.bind("<Return>", self._complete)
+
+    def set_snapshot(self, snapshot):
+        self.snapshot = snapshot
+        self.configure(state="normal")
+        self._filter()
+
+    def set_item(self, row_id, name):
+        text = label(row_id, name)
+        self._extra[text] = row_id
+        self.set(text)
+
+    def select_id(self, row_id):
+        text = self.snapshot.label_of(row_id) if self.snapshot else ""
+        if text:
+            self.set(text)
+
+    def selected_id(self):
+        """id выбранной строки справочника; None, если текст не совпадает ни с одной подписью"""
+        text = self.get()
+        if text in self._extra:
+            return self._extra[text]
+        return self.snapshot.by_label.get(text) if self.snapshot else None
+
+    def _changed(self, event):
+        if event.keysym in ("Return", "Up", "Down", "Escape", "Tab"):
+            return
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+        self._after_id = self.after(TYPEAHEAD_DEBOUNCE_MS, self._filter)
+
+    def _filter(self):
+        self._after_id = None
+        if self.snapshot is not None:
+            self['values'] = self.snapshot.matches(self.get(), self.limit)
+
+    def _complete(self, event):
+        self._filter()
+        values = self['values']
+        if values and self.selected_id() is None:
+            self.set(values[0])
+            self.icursor("end")
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = sys.argv[1:]
+    db_file = args.pop(0) if args and args[0].endswith('.db') else DB_FILE
+    conn = sqlite3.connect(db_file)
+    name = args.pop(0) if args and args[0] in REFERENCES else 'products'
+    cache = get_reference_cache(db_file)
+    for attempt in ('первое чтение', 'из кэша'):
+        started = time.perf_counter()
+        snapshot = cache.get(conn, name)
+        print(f"{name}, {attempt}: {len(snapshot.rows)} строк за {(time.perf_counter() - started) * 1000:.2f} мс")
+    if args:
+        started = time.perf_counter()
+        found = snapshot.matches(args[0])
+        print(f"'{args[0]}': {len(found)} за {(time.perf_counter() - started) * 1000:.2f} мс")
+        for text in found[:10]:
+            print(f"  {text}")
+    conn.close()
@@ -0,0 +1,61 @@
+import math
+import sys
+from collections import namedtuple
+
+#материалы ниже минимального остатка; условие совпадает с частичным индексом idx_materials_below_min,
+#поэтому запрос читает только индекс нехватки, а не всю таблицу materials
+LOW_STOCK_SQL = '''
+    SELECT m.material_id, m.name, m.supplier_id, s.name, m.package_quantity, m.unit,
+           m.stock_quantity, m.min_quantity
+    FROM materials m
+    LEFT JOIN suppliers s ON m.supplier_id = s.supplier_id
+    WHERE m.stock_quantity < m.min_quantity
+    ORDER BY m.supplier_id, m.package_quantity, m.material_id
+'''
+
+LowStock = namedtuple('LowStock', 'material_id name supplier_id supplier_name package_quantity unit '
+                                  'stock_quantity min_quantity')
+#предлагаемый заказ: один поставщик и один размер упаковки
+PurchaseSuggestion = namedtuple('PurchaseSuggestion', 'supplier_id supplier_name package_quantity lines packages')
+#строка заказа: сколько упаковок и единиц материала докупить до минимального остатка
+PurchaseLine = namedtuple('PurchaseLine', 'material_id name shortfall packages quantity unit')
+
+
+def low_stock_materials(conn):
+    return [LowStock(*row) for row in conn.execute(LOW_STOCK_SQL)]
+
+
+def purchase_line(material):
+    """Докупить до min_quantity целыми упаковками (без упаковки - поштучно)"""
+    shortfall = material.min_quantity - material.stock_quantity
+    package = material.package_quantity if material.package_quantity and material.package_quantity > 0 else 1
+    packages = math.ceil(shortfall / package)
+    return PurchaseLine(material.material_id, material.name, shortfall, packages, packages * package, material.unit)
+
+
+def suggest_purchase_orders(conn):
+    """Материалы ниже минимума, сгруппированные по (supplier_id, package_quantity)"""
+    suggestions = []
+    for material in low_stock_materials(conn):
+        key = (material.supplier_id, material.package_quantity)
+        if not suggestions or (suggestions[-1].supplier_id, suggestions[-1].package_quantity) != key:
+            suggestions.append(PurchaseSuggestion(material.supplier_id, material.supplier_name,
+                                                  material.package_quantity, [], 0))
+        line = purchase_line(material)
+        last = suggestions[-1]
+        last.lines.append(line)
+        suggestions[-1] = last._replace(packages=last.packages + line.packages)
+    return suggestions
+
+
+if __name__ == "__main__":
+    import sqlite3
+    from main import DB_FILE
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_FILE)
+    for suggestion in suggest_purchase_orders(conn):
+        print(f"Поставщик {suggestion.supplier_name or '-'} (ID: {suggestion.supplier_id}), "
+              f"упаковка {suggestion.package_quantity or '-'}: {suggestion.packages} уп.")
+        for line in suggestion.lines:
+            print(f"    {line.name} (ID: {line.material_id}): не хватает {line.shortfall}, "
+                  f"заказать {line.packages} уп. = {line.quantity} {line.unit or ''}")
+    conn.close()
@@ -0,0 +1,132 @@
+import sqlite3
+import sys
+
+from calculate import DISCOUNT_RATES, DISCOUNT_THRESHOLDS, calculate_discount
+
+#таблица итогов продаж по партнерам: общий объем и текущая скидка, ведется триггерами на sales
+CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS partner_sales_totals (
+          partner_id INTEGER PRIMARY KEY,
+          total_quantity INTEGER NOT NULL,
+          discount INTEGER NOT NULL,
+          FOREIGN KEY (partner_id) REFERENCES partners(partner_id) ON DELETE CASCADE
+    )
+'''
+
+
+def discount_sql(expr):
+    """SQL-выражение скидки для объема expr, те же границы, что в calculate_discount"""
+    cases = ' '.join(f"WHEN {expr} < {threshold} THEN {rate}"
+                     for threshold, rate in zip(DISCOUNT_THRESHOLDS, DISCOUNT_RATES))
+    return f"(CASE {cases} ELSE {DISCOUNT_RATES[-1]} END)"
+
+
+def _add_sql(partner, quantity):
+    return f'''INSERT INTO partner_sales_totals (partner_id, total_quantity, discount)
+               VALUES ({partner}, {quantity}, {discount_sql(quantity)})
+               ON CONFLICT(partner_id) DO UPDATE SET
+                   total_quantity = total_quantity + excluded.total_quantity,
+                   discount = {discount_sql('total_quantity + excluded.total_quantity')};'''
+
+
+def _subtract_sql(partner, quantity):
+    return f'''UPDATE partner_sales_totals SET
+                   total_quantity = total_quantity - {quantity},
+                   discount = {discount_sql(f'total_quantity - {quantity}')}
+               WHERE partner_id = {partner};'''
+
+
+#имя -> SQL триггера; csv_import снимает их на время массовой вставки продаж
+TRIGGERS = {
+    'trg_sales_totals_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_totals_insert AFTER INSERT ON sales
+        BEGIN
+            {_add_sql('NEW.partner_id', 'NEW.quantity')}
+        END''',
+    'trg_sales_totals_update': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_totals_update AFTER UPDATE OF partner_id, quantity ON sales
+        BEGIN
+            {_subtract_sql('OLD.partner_id', 'OLD.quantity')}
+            {_add_sql('NEW.partner_id', 'NEW.quantity')}
+        END''',
+    'trg_sales_totals_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_totals_delete AFTER DELETE ON sales
+        BEGIN
+            {_subtract_sql('OLD.partner_id', 'OLD.quantity')}
+        END''',
+}
+
+
+def create_triggers(cursor):
+    for sql in TRIGGERS.values():
+        cursor.execute(sql)
+
+
+def drop_triggers(cursor):
+    for name in TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_totals(cursor, partner_ids=None):
+    """Пересчитывает итоги из sales: для всех партнеров или только для partner_ids. Не фиксирует транзакцию"""
+    select = f'''SELECT partner_id, SUM(quantity), {discount_sql('SUM(quantity)')}
+                 FROM sales'''
+    if partner_ids is None:
+        cursor.execute("DELETE FROM partner_sales_totals")
+        cursor.execute(f"INSERT INTO partner_sales_totals (partner_id, total_quantity, discount) {select} GROUP BY partner_id")
+        return
+    partner_ids = list(partner_ids)
+    for start in range(0, len(partner_ids), 500):
+        chunk = partner_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f"DELETE FROM partner_sales_totals WHERE partner_id IN ({placeholders})", chunk)
+        cursor.execute(f'''INSERT INTO partner_sales_totals (partner_id, total_quantity, discount)
+                           {select} WHERE partner_id IN ({placeholders}) GROUP BY partner_id''', chunk)
+
+
+def partner_totals(conn, partner_id):
+    """(общий объем продаж, скидка) партнера из итоговой таблицы"""
+    row = conn.execute("SELECT total_quantity, discount FROM partner_sales_totals WHERE partner_id = ?",
+                       (partner_id,)).fetchone()
+    return row if row else (0, calculate_discount(0))
+
+
+def check_consistency(conn, repair=False):
+    """Сверяет partner_sales_totals с пересчетом из sales.
+
+    Возвращает список расхождений (partner_id, ожидаемый объем, объем в таблице, ожидаемая скидка, скидка в таблице);
+    при repair=True таблица пересобирается заново.
+    """
+    expected = {partner_id: (total, calculate_discount(total)) for partner_id, total in conn.execute(
+        "SELECT partner_id, SUM(quantity) FROM sales GROUP BY partner_id")}
+    actual = {partner_id: (total, discount) for partner_id, total, discount in conn.execute(
+        "SELECT partner_id, total_quantity, discount FROM partner_sales_totals")}
+    differences = []
+    for partner_id in sorted(expected.keys() | actual.keys()):
+        #строка с нулевым итогом остается после удаления всех продаж партнера - это не расхождение
+        want = expected.get(partner_id, (0, calculate_discount(0)))
+        have = actual.get(partner_id, (0, calculate_discount(0)))
+        if want != have:
+            differences.append((partner_id, want[0], have[0], want[1], have[1]))
+    if repair and differences:
+        try:
+            rebuild_totals(conn)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return differences
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = [arg for arg in sys.argv[1:] if arg != '--repair']
+    conn = sqlite3.connect(args[0] if args else DB_FILE)
+    differences = check_consistency(conn, repair='--repair' in sys.argv)
+    conn.close()
+    for partner_id, want_total, have_total, want_discount, have_discount in differences:
+        print(f"partner_id={partner_id}: объем {have_total} (должен быть {want_total}), "
+              f"скидка {have_discount}% (должна быть {want_discount}%)")
+    if differences and '--repair' not in sys.argv:
+        sys.exit(1)
+    print("Расхождений нет" if not differences else f"Исправлено расхождений: {len(differences)}")
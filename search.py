@@ -0,0 +1,230 @@
+import re
+import sqlite3
+import sys
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from background import get_background_queries
+from data_access import get_pool
+
+#сколько лучших совпадений показывает поиск
+SEARCH_LIMIT = 20
+#задержка поиска после ввода, мс
+SEARCH_DEBOUNCE_MS = 150
+#unicode61 приводит к нижнему регистру любые буквы, в том числе кириллицу ("ИВАН" находит "Иван"),
+#и убирает диакритику латиницы; "ё" и "е" остаются разными буквами
+TOKENIZER = "unicode61 remove_diacritics 2"
+#индексы префиксов: запросы "ид*", "иван*" читают готовые списки, а не перебирают все слова словаря
+PREFIX_LENGTHS = '2 3 4'
+#поиск начинается со стольких букв: однобуквенный префикс совпадает почти со всем
+MIN_SEARCH_CHARS = 2
+#bm25 считается для каждого совпадения; если их больше, ранжирование стоит десятки мс и мало что дает
+#(запрос вроде "ст" при вводе), поэтому выдаются первые limit совпадений без сортировки
+RANK_LIMIT = 5000
+
+#полнотекстовый индекс -> (таблица, первичный ключ, столбцы, веса столбцов для bm25)
+#Индексы external content: текст хранится только в самой таблице, индекс ведут триггеры
+FTS_INDEXES = {
+    'partners_fts': ('partners', 'partner_id',
+                     ('name', 'director_name', 'address', 'sales_locations', 'phone', 'email', 'inn'),
+                     (10.0, 5.0, 2.0, 2.0, 1.0, 1.0, 1.0)),
+    'products_fts': ('products', 'product_id',
+                     ('name', 'article', 'description', 'standard_number'),
+                     (10.0, 5.0, 1.0, 2.0)),
+}
+
+
+def create_index_sql(fts):
+    table, pk, columns, _ = FTS_INDEXES[fts]
+    return (f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({', '.join(columns)}, "
+            f"content='{table}', content_rowid='{pk}', tokenize='{TOKENIZER}', prefix='{PREFIX_LENGTHS}')")
+
+
+def triggers_sql(fts):
+    """Триггеры синхронизации индекса: вставка, удаление и изменение строк таблицы"""
+    table, pk, columns, _ = FTS_INDEXES[fts]
+    names = ', '.join(columns)
+    new_values = ', '.join(f"NEW.{column}" for column in columns)
+    old_values = ', '.join(f"OLD.{column}" for column in columns)
+    delete = f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', OLD.{pk}, {old_values});"
+    insert = f"INSERT INTO {fts} (rowid, {names}) VALUES (NEW.{pk}, {new_values});"
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+           BEGIN
+               {insert}
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+           BEGIN
+               {delete}
+           END''',
+        #изменения других столбцов (рейтинг, цена) индекс не трогают
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {pk}, {names} ON {table}
+           BEGIN
+               {delete}
+               {insert}
+           END''',
+    ]
+
+
+def create_indexes(cursor):
+    """Создает индексы с триггерами и заполняет их из таблиц"""
+    for fts in FTS_INDEXES:
+        cursor.execute(create_index_sql(fts))
+        for sql in triggers_sql(fts):
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def match_query(text):
+    """Строка поиска -> выражение MATCH: каждое слово как префикс, все слова обязательны.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (OR, NOT, NEAR, скобки) во вводе не действуют.
+    Возвращает None, если букв меньше MIN_SEARCH_CHARS.
+    """
+    words = re.findall(r"\w+", text)
+    if sum(len(word) for word in words) < MIN_SEARCH_CHARS:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _search(conn, fts, select, text, limit):
+    query = match_query(text)
+    if query is None:
+        return []
+    table, pk, _, weights = FTS_INDEXES[fts]
+    matches = conn.execute(f"SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH ?", (query,)).fetchone()[0]
+    order = f"ORDER BY bm25({fts}, {', '.join(str(weight) for weight in weights)})" if matches <= RANK_LIMIT else ""
+    return conn.execute(f'''
+        SELECT {select}
+        FROM {fts} f
+        JOIN {table} t ON t.{pk} = f.rowid
+        WHERE {fts} MATCH ?
+        {order}
+        LIMIT ?
+    ''', (query, limit)).fetchall()
+
+
+def search_partners(conn, text, limit=SEARCH_LIMIT):
+    """Лучшие совпадения среди партнеров: [(partner_id, name, фрагмент с совпадением), ...]"""
+    return _search(conn, 'partners_fts',
+                   "t.partner_id, t.name, snippet(partners_fts, -1, '[', ']', '…', 8)", text, limit)
+
+
+def search_products(conn, text, limit=SEARCH_LIMIT):
+    """Лучшие совпадения среди продукции: [(product_id, name, фрагмент с совпадением), ...]"""
+    return _search(conn, 'products_fts',
+                   "t.product_id, t.name, snippet(products_fts, -1, '[', ']', '…', 8)", text, limit)
+
+
+def check_indexes(conn):
+    """Проверка целостности индексов относительно таблиц; sqlite3.Error, если индекс рассинхронизирован"""
+    for fts in FTS_INDEXES:
+        conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('integrity-check', 1)")
+
+
+#поле поиска с выпадающим списком лучших совпадений; поиск идет в фоне после каждого изменения текста.
+#search(conn, text, limit) -> строки (id, название, фрагмент); on_select(строка) - при выборе совпадения
+class SearchBox(ttk.Frame):
+    def __init__(self, parent, db_file, search, on_select, limit=SEARCH_LIMIT, width=30):
+        super().__init__(parent)
+        self.db_file = db_file
+        self.search = search
+        self.on_select = on_select
+        self.limit = limit
+        self._after_id = None
+        self._rows = []
+
+        self.text = tk.StringVar()
+        self.entry = ttk.Entry(self, textvariable=self.text, width=width)
+        self.entry.grid(row=0, column=0, sticky="ew")
+        self.status_label = ttk.Label(self, text="")
+        self.status_label.grid(row=0, column=1, padx=5)
+        self.columnconfigure(0, weight=1)
+
+        #список лежит поверх соседних виджетов окна, под полем ввода
+        self.listbox = tk.Listbox(self.winfo_toplevel(), height=8)
+        self.listbox.bind("<Double-1>", self._choose)
+        self.listbox.bind("<Return>", self._choose)
+        self.listbox.bind("<Escape>", lambda event: self.hide())
+        self.entry.bind("<Down>", self._focus_list)
+        self.entry.bind("<Return>", self._choose_first)
+        self.entry.bind("<Escape>", lambda event: self.hide())
+        self.text.trace_add("write", self._changed)
+
+    def hide(self):
+        self.listbox.place_forget()
+
+    def _changed(self, *args):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+        self._after_id = self.after(SEARCH_DEBOUNCE_MS, self._run)
+
+    def _run(self):
+        self._after_id = None
+        text = self.text.get()
+        if match_query(text) is None:
+            get_background_queries(self).cancel(self._query_key())
+            self._show([], 0)
+            return
+
+        def query():
+            started = time.perf_counter()
+            rows = self.search(get_pool(self.db_file).connection(), text, self.limit)
+            return rows, time.perf_counter() - started
+
+        get_background_queries(self).submit(self._query_key(), query, lambda result: self._show(*result),
+                                            lambda e: self.status_label.configure(text=f"Ошибка поиска: {str(e)}"))
+
+    def _query_key(self):
+        return f"search:{self}"
+
+    def _show(self, rows, seconds):
+        self._rows = rows
+        self.listbox.delete(0, "end")
+        for _, name, fragment in rows:
+            self.listbox.insert("end", f"{name} — {fragment}" if fragment and fragment != name else name)
+        if not rows:
+            self.hide()
+            self.status_label.configure(text="Ничего не найдено" if match_query(self.text.get()) else "")
+            return
+        self.status_label.configure(text=f"{len(rows)} за {seconds * 1000:.0f} мс")
+        self.listbox.place(in_=self.entry, relx=0, rely=1, relwidth=1)
+        self.listbox.lift()
+
+    def _focus_list(self, event):
+        if self._rows:
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, "end")
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+
+    def _choose_first(self, event):
+        if self._rows:
+            self._select(self._rows[0])
+
+    def _choose(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self._select(self._rows[selection[0]])
+
+    def _select(self, row):
+        self.hide()
+        self.entry.focus_set()
+        self.on_select(row)
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    if len(sys.argv) < 3 or sys.argv[-2] not in ('partners', 'products'):
+        print("Использование: python search.py [db] partners|products \"текст\"")
+        sys.exit(2)
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 3 else DB_FILE)
+    search = search_partners if sys.argv[-2] == 'partners' else search_products
+    started = time.perf_counter()
+    rows = search(conn, sys.argv[-1])
+    elapsed = time.perf_counter() - started
+    conn.close()
+    for row_id, name, fragment in rows:
+        print(f"{row_id}: {name} | {fragment}")
+    print(f"Найдено {len(rows)} за {elapsed * 1000:.1f} мс")
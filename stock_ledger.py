@@ -0,0 +1,126 @@
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+#изменение остатка от одного движения склада
+DELTA_SQL = "CASE wm.movement_type WHEN 'outgoing' THEN -wm.quantity ELSE wm.quantity END"
+#новый снимок остатков делается, если последний старше стольких дней
+SNAPSHOT_INTERVAL_DAYS = 30
+#дата "после всех движений" для текущего остатка
+END_OF_TIME = '9999-12-31'
+
+#Остаток материала на конец дня D = снимок на дату S <= D + движения за (S, D].
+#Если снимка до D нет, считается назад от ближайшего более позднего: снимок S - движения за (D, S].
+#Снимки хранятся в stock_snapshots и делаются за целый прошедший день, поэтому их не меняют
+#движения текущего дня; все суммы идут по покрывающему индексу (material_id, date, movement_type, quantity).
+
+_BALANCES_SQL = f'''
+    SELECT m.material_id, COALESCE(
+        (SELECT s.balance + COALESCE((SELECT SUM({DELTA_SQL}) FROM warehouse_movements wm
+                                      WHERE wm.material_id = s.material_id
+                                        AND wm.date > s.snapshot_date AND wm.date <= :day), 0)
+         FROM stock_snapshots s
+         WHERE s.material_id = m.material_id AND s.snapshot_date <= :day
+         ORDER BY s.snapshot_date DESC LIMIT 1),
+        (SELECT s.balance - COALESCE((SELECT SUM({DELTA_SQL}) FROM warehouse_movements wm
+                                      WHERE wm.material_id = s.material_id
+                                        AND wm.date > :day AND wm.date <= s.snapshot_date), 0)
+         FROM stock_snapshots s
+         WHERE s.material_id = m.material_id AND s.snapshot_date > :day
+         ORDER BY s.snapshot_date LIMIT 1)
+    ) AS balance
+    FROM materials m
+    {{where}}
+'''
+
+
+def _day(value):
+    if value is None:
+        return END_OF_TIME
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def balances_at(conn, day=None):
+    """Остатки всех материалов на конец дня day ('ГГГГ-ММ-ДД'; None - текущие): {material_id: остаток}
+
+    Материалы без единого снимка получают None.
+    """
+    sql = _BALANCES_SQL.format(where='')
+    return dict(conn.execute(sql, {'day': _day(day)}).fetchall())
+
+
+def balance_at(conn, material_id, day=None):
+    """Остаток одного материала на конец дня day"""
+    sql = _BALANCES_SQL.format(where='WHERE m.material_id = :material_id')
+    row = conn.execute(sql, {'day': _day(day), 'material_id': material_id}).fetchone()
+    return row[1] if row else None
+
+
+def last_snapshot_date(conn):
+    return conn.execute("SELECT MAX(snapshot_date) FROM stock_snapshots").fetchone()[0]
+
+
+def take_snapshot(conn, day=None):
+    """Снимок остатков всех материалов на конец дня day (по умолчанию - вчера). Не фиксирует транзакцию"""
+    day = _day(day or date.today() - timedelta(days=1))
+    balances = balances_at(conn, day)
+    conn.executemany(
+        "INSERT OR REPLACE INTO stock_snapshots (material_id, snapshot_date, balance) VALUES (?, ?, ?)",
+        [(material_id, day, balance) for material_id, balance in balances.items() if balance is not None])
+    return day
+
+
+def take_opening_snapshot(cursor):
+    """Первый снимок из текущего materials.stock_quantity: остаток на вчера = текущий - движения с сегодняшнего дня"""
+    yesterday = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO stock_snapshots (material_id, snapshot_date, balance)
+        SELECT m.material_id, ?, m.stock_quantity - COALESCE(
+            (SELECT SUM({DELTA_SQL}) FROM warehouse_movements wm
+             WHERE wm.material_id = m.material_id AND wm.date > ?), 0)
+        FROM materials m
+        WHERE NOT EXISTS (SELECT 1 FROM stock_snapshots s WHERE s.material_id = m.material_id)
+    ''', (yesterday, yesterday))
+
+
+def ensure_snapshots(conn, interval_days=SNAPSHOT_INTERVAL_DAYS):
+    """Делает новый снимок, если последнему больше interval_days дней; возвращает дату нового снимка или None"""
+    try:
+        #материалы, добавленные после прошлого снимка, получают свой первый снимок
+        take_opening_snapshot(conn)
+        last = last_snapshot_date(conn)
+        yesterday = date.today() - timedelta(days=1)
+        taken = None
+        if last is None or datetime.strptime(last, "%Y-%m-%d").date() <= yesterday - timedelta(days=interval_days):
+            taken = take_snapshot(conn, yesterday)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return taken
+
+
+def reconcile(conn):
+    """Сверка materials.stock_quantity с книгой: [(material_id, stock_quantity, остаток по книге), ...]"""
+    ledger = balances_at(conn)
+    return [(material_id, stock, ledger.get(material_id))
+            for material_id, stock in conn.execute("SELECT material_id, stock_quantity FROM materials")
+            if ledger.get(material_id) != stock]
+
+
+if __name__ == "__main__":
+    from main import DB_FILE
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    conn = sqlite3.connect(args[0] if args else DB_FILE)
+    if '--snapshot' in sys.argv:
+        print(f"Снимок остатков на {take_snapshot(conn)}")
+        conn.commit()
+    differences = reconcile(conn)
+    conn.close()
+    for material_id, stock, ledger in differences:
+        print(f"material_id={material_id}: stock_quantity={stock}, по книге {ledger}")
+    if differences:
+        sys.exit(1)
+    print("Остатки совпадают с книгой склада")
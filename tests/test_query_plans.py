@@ -0,0 +1,35 @@
+import os
+import sqlite3
+
+from data_access import close_all_pools
+from main import create_database
+from migrations import HOT_QUERIES, apply_migrations, check_query_plans
+
+
+def migrated_database(tmp_path):
+    #схема из main.create_database (через пул соединений) и все миграции
+    db_file = os.path.join(tmp_path, 'plans.db')
+    create_database(db_file)
+    close_all_pools()
+    conn = sqlite3.connect(db_file)
+    apply_migrations(conn)
+    return conn
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    conn = migrated_database(tmp_path)
+    try:
+        assert check_query_plans(conn) == []
+    finally:
+        conn.close()
+
+
+def test_query_without_index_is_reported(tmp_path):
+    conn = migrated_database(tmp_path)
+    try:
+        conn.execute("DROP INDEX idx_access_sessions_employee")
+        name = 'access_analytics._apply_events'
+        problems = check_query_plans(conn, {name: HOT_QUERIES[name]})
+        assert [problem for problem, _ in problems] == [name]
+    finally:
+        conn.close()
@@ -0,0 +1,415 @@
+import bisect
+import sqlite3
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+from background import get_background_queries
+from data_access import get_pool
+
+#если после отметки в журнале больше изменений, дешевле перечитать видимую страницу, чем сверять каждую строку
+#(например, при потоковом приеме журнала доступа)
+MAX_REFRESH_CHANGES = 5000
+
+
+def format_row(row):
+    """Заменяет None на пустую строку для отображения"""
+    return [value if value is not None else "" for value in row]
+
+
+def keyset_query(select_sql, where, params, key_columns, descending=False, after=None, before=None, limit=200,
+                 base_table=None, id_column=None):
+    """SQL и параметры страницы: строки после ключа after (или перед ключом before, в обратном порядке)
+
+    С base_table ("orders o") ключи страницы сначала выбираются из одной основной таблицы,
+    по ее индексам, и только найденные id соединяются со справочниками из select_sql.
+    """
+    conditions = list(where)
+    params = list(params)
+    keys = ', '.join(key_columns)
+    placeholders = ', '.join('?' * len(key_columns))
+    if after is not None:
+        conditions.append(f"({keys}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(after)
+    elif before is not None:
+        conditions.append(f"({keys}) {'>' if descending else '<'} ({placeholders})")
+        params.extend(before)
+        descending = not descending
+    order = " ORDER BY " + ", ".join(f"{k} {'DESC' if descending else 'ASC'}" for k in key_columns)
+    where_sql = " WHERE " + " AND ".join(conditions) if conditions else ""
+    params.append(limit)
+    if base_table is None:
+        return f"{select_sql}{where_sql}{order} LIMIT ?", params
+    #соединения делаются для limit строк, а не для всех подошедших под фильтр до сортировки
+    return f"{select_sql} WHERE {id_column} IN (SELECT {id_column} FROM {base_table}{where_sql}{order} LIMIT ?){order}", params
+
+
+#Treeview, который подгружает строки страницами по мере прокрутки.
+#Страницы выбираются по ключу (WHERE (ключ) > (последний ключ) ORDER BY ключ LIMIT n), без OFFSET,
+#поэтому любая страница стоит одинаково независимо от того, как далеко пролистана таблица.
+#В дереве держится не больше window_pages страниц: уходящие за край строки удаляются
+#и подгружаются снова при прокрутке назад.
+#При background=True страницы читаются в рабочем потоке (background.py), пока идет
+#чтение, под таблицей показывается "Загрузка...".
+#Порядок строк задается ключом, поэтому сортировка по заголовку (sort_columns) - это просто другой ключ
+#страниц, и фильтры (set_query, см. filters.py) работают на стороне SQLite для любой длины таблицы.
+#refresh() применяет к дереву только строки, изменившиеся с прошлой загрузки (по журналу change_log,
+#который ведут триггеры из migrations.py): выделение и позиция прокрутки при этом сохраняются.
+class VirtualTable(ttk.Frame):
+    def __init__(self, parent, db_file, columns, select_sql, key_columns, key_positions=(0,),
+                 id_position=0, where=None, params=(), descending=False, page_size=200,
+                 window_pages=5, formatter=format_row, column_width=100, background=True,
+                 on_error=None, change_table=None, id_column=None, sort_columns=None, base_table=None,
+                 **tree_options):
+        """
+        :param select_sql: SELECT ... FROM ... без WHERE/ORDER BY/LIMIT
+        :param key_columns: выражения ключа сортировки, последним должен идти уникальный столбец
+        :param key_positions: позиции значений ключа в строке результата
+        :param id_position: позиция первичного ключа в строке (он же iid строки в дереве)
+        :param where: список условий, объединяемых через AND
+        :param on_error: обработчик ошибки загрузки (в главном потоке)
+        :param change_table: таблица из change_log, по изменениям которой работает refresh()
+        :param id_column: выражение первичного ключа в select_sql (по умолчанию последний столбец ключа)
+        :param sort_columns: {заголовок: (выражение, позиция в строке)} - столбцы, сортируемые щелчком
+            по заголовку; выражения должны быть NOT NULL и иметь индекс (выражение, первичный ключ)
+        :param base_table: основная таблица с псевдонимом ("orders o"), если условия и ключ ссылаются только на нее:
+            страница выбирается по ней одной, а соединения из select_sql - только для строк страницы
+        """
+        super().__init__(parent)
+        self.db_file = db_file
+        self.select_sql = select_sql
+        self.key_columns = tuple(key_columns)
+        self.key_positions = tuple(key_positions)
+        self.id_position = id_position
+        self.where = list(where or [])
+        self.params = tuple(params)
+        self.ranges = {}
+        self.descending = descending
+        self.page_size = page_size
+        self.max_rows = page_size * window_pages
+        self.formatter = formatter
+        self.background = background
+        self.on_error = on_error
+        self.change_table = change_table
+        self.id_column = id_column or self.key_columns[-1]
+        self.sort_columns = dict(sort_columns or {})
+        self.base_table = base_table
+        self._sort_column = None
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", **tree_options)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            if col in self.sort_columns:
+                self.tree.heading(col, command=lambda c=col: self.sort_by(c))
+                if self.sort_columns[col][0] == self.key_columns[0]:
+                    self._sort_column = col
+                    self.tree.heading(col, text=col + (" ▼" if descending else " ▲"))
+            self.tree.column(col, width=column_width)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.status_label = ttk.Label(self, text="Загрузка...")
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self._keys = {}
+        self._has_before = False
+        self._at_end = True
+        self._pending = None
+        self._busy = False
+        #последняя учтенная запись change_log; None - таблица еще не загружалась
+        self._watermark = None
+
+    def set_query(self, where=None, params=(), ranges=None):
+        """Меняет условия отбора и загружает первую страницу
+
+        :param ranges: {столбец: (начало, конец)} - периоды из условий отбора, если таблица может
+            ими воспользоваться (PartitionedAccessTable читает только разделы периода)
+        """
+        self.where = list(where or [])
+        self.params = tuple(params)
+        self.ranges = dict(ranges or {})
+        self.reload()
+
+    def reload(self, on_loaded=None):
+        """Очищает дерево и загружает первую страницу; on_loaded() - после ее загрузки"""
+        if self.background:
+            #незавершенная подгрузка прежнего содержимого больше не нужна
+            get_background_queries(self).cancel(self._query_key())
+        self.tree.delete(*self.tree.get_children())
+        self._keys.clear()
+        self._has_before = False
+        self._at_end = False
+        self._busy = False
+        self._watermark = None
+        self._load_next(on_loaded)
+
+    def refresh(self, on_loaded=None):
+        """Обновляет только изменившиеся строки; без журнала изменений - то же, что reload()"""
+        if self.change_table is None or self._watermark is None:
+            self.reload(on_loaded)
+            return
+        if self._busy:
+            #идет подгрузка страницы: она уже прочитает свежие данные, но журнал все равно нужно догнать
+            self.after(50, self.refresh, on_loaded)
+            return
+        self._request({'changes_after': self._watermark}, self._apply_changes, on_loaded)
+
+    def row_count(self):
+        return len(self._keys)
+
+    def current_change_id(self):
+        return get_pool(self.db_file).fetchone("SELECT MAX(change_id) FROM change_log")[0] or 0
+
+    def fetch_changes(self, changes_after):
+        """Строки, изменившиеся после записи changes_after журнала: (новая отметка, {iid: строка или None})
+
+        Если журнал уже обрезан дальше changes_after или изменений больше MAX_REFRESH_CHANGES,
+        возвращает (None, None) - нужна полная перезагрузка.
+        """
+        pool = get_pool(self.db_file)
+        oldest, latest = pool.fetchone("SELECT MIN(change_id), MAX(change_id) FROM change_log")
+        if oldest is not None and oldest > changes_after + 1:
+            return None, None
+        if latest is None or latest <= changes_after:
+            return changes_after, {}
+        if latest - changes_after > MAX_REFRESH_CHANGES:
+            return None, None
+        ids = [row[0] for row in pool.fetchall(
+            "SELECT DISTINCT row_id FROM change_log WHERE table_name = ? AND change_id > ? AND change_id <= ?",
+            (self.change_table, changes_after, latest))]
+        watermark = latest
+        rows = dict.fromkeys(str(row_id) for row_id in ids)
+        #удаленные и не проходящие под условия отбора строки остаются None
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            conditions = self.where + [f"{self.id_column} IN ({', '.join('?' * len(chunk))})"]
+            for row in pool.fetchall(f"{self.select_sql} WHERE {' AND '.join(conditions)}",
+                                     list(self.params) + chunk):
+                rows[str(row[self.id_position])] = row
+        return watermark, rows
+
+    def fetch_page(self, after=None, before=None, limit=None):
+        """Страница строк после ключа after (или перед ключом before, в обратном порядке)"""
+        sql, params = keyset_query(self.select_sql, self.where, self.params, self.key_columns, self.descending,
+                                   after, before, limit or self.page_size, self.base_table, self.id_column)
+        return get_pool(self.db_file).fetchall(sql, params)
+
+    def sort_by(self, column):
+        """Сортировка по столбцу из sort_columns; повторный выбор того же столбца меняет направление"""
+        expression, position = self.sort_columns[column]
+        descending = not self.descending if column == self._sort_column else False
+        if expression == self.id_column:
+            self.key_columns, self.key_positions = (expression,), (position,)
+        else:
+            #первичный ключ вторым столбцом делает ключ уникальным
+            self.key_columns = (expression, self.id_column)
+            self.key_positions = (position, self.id_position)
+        self.descending = descending
+        self._sort_column = column
+        for col in self.sort_columns:
+            arrow = (" ▼" if descending else " ▲") if col == column else ""
+            self.tree.heading(col, text=col + arrow)
+        self.reload()
+
+    def _key(self, row):
+        return tuple(row[i] for i in self.key_positions)
+
+    def _insert(self, row, index="end"):
+        iid = str(row[self.id_position])
+        if iid in self._keys:
+            return
+        self.tree.insert("", index, iid=iid, values=self.formatter(row))
+        self._keys[iid] = self._key(row)
+
+    def _sort_key(self, key):
+        #ключ в порядке отображения дерева (при descending - обратном), пригодный для bisect
+        return _Descending(key) if self.descending else key
+
+    def _in_window(self, key, children):
+        """Попадает ли строка с ключом key в загруженный диапазон дерева"""
+        if not children:
+            return not self._has_before and self._at_end
+        sort_key = self._sort_key(key)
+        if self._has_before and sort_key < self._sort_key(self._keys[children[0]]):
+            return False
+        if not self._at_end and sort_key > self._sort_key(self._keys[children[-1]]):
+            return False
+        return True
+
+    def _apply_changes(self, result):
+        watermark, rows = result
+        if watermark is None:
+            self.reload()
+            return
+        self._watermark = watermark
+        if not rows:
+            return
+        tree = self.tree
+        children = list(tree.get_children())
+        #строка, которая сейчас вверху видимой области: после изменений прокрутка вернется к ней
+        top_index = int(float(tree.yview()[0]) * len(children) + 0.5) if children else 0
+        anchor = children[top_index] if top_index < len(children) else None
+        for iid, row in rows.items():
+            if row is None:
+                if iid in self._keys:
+                    self._delete([iid])
+                    children.remove(iid)
+                continue
+            key = self._key(row)
+            if iid in self._keys and self._keys[iid] == key:
+                tree.item(iid, values=self.formatter(row))
+                continue
+            if iid in self._keys:
+                #ключ сортировки изменился: строка переезжает
+                self._delete([iid])
+                children.remove(iid)
+            if not self._in_window(key, children):
+                continue
+            sort_keys = [self._sort_key(self._keys[child]) for child in children]
+            index = bisect.bisect_left(sort_keys, self._sort_key(key))
+            self._insert(row, index)
+            children.insert(index, iid)
+        if anchor is not None and tree.exists(anchor) and children:
+            tree.yview_moveto(tree.index(anchor) / len(children))
+
+    def _delete(self, iids):
+        if iids:
+            self.tree.delete(*iids)
+            for iid in iids:
+                self._keys.pop(iid, None)
+
+    def _query_key(self):
+        return f"virtual_table:{self}"
+
+    #чтение страницы: в фоне или сразу, затем apply(rows) в главном потоке
+    def _request(self, fetch_kwargs, apply, on_loaded=None):
+        def done(rows):
+            self._busy = False
+            self._set_loading(False)
+            apply(rows)
+            if on_loaded is not None:
+                on_loaded()
+
+        def failed(error):
+            self._busy = False
+            self._set_loading(False)
+            if self.on_error is not None:
+                self.on_error(error)
+            else:
+                messagebox.showerror("Ошибка", f"Не удалось загрузить данные: {str(error)}", parent=self.winfo_toplevel())
+
+        self._busy = True
+        if not self.background:
+            try:
+                rows = self._fetch(**fetch_kwargs)
+            except sqlite3.Error:
+                self._busy = False
+                raise
+            done(rows)
+            return
+        self._set_loading(True)
+        get_background_queries(self).submit(self._query_key(), lambda: self._fetch(**fetch_kwargs), done, failed)
+
+    def _set_loading(self, loading):
+        if loading:
+            self.status_label.grid(row=1, column=0, columnspan=2, sticky="w")
+        else:
+            self.status_label.grid_remove()
+
+    def _load_next(self, on_loaded=None):
+        if self._at_end or self._busy:
+            return
+        children = self.tree.get_children()
+        after = self._keys[children[-1]] if children else None
+        self._request({'after': after, 'first_page': after is None}, self._apply_next, on_loaded)
+
+    def _fetch(self, changes_after=None, first_page=False, **page):
+        """Чтение в рабочем потоке: страница строк или изменения по журналу"""
+        if changes_after is not None:
+            return self.fetch_changes(changes_after)
+        if first_page and self.change_table is not None:
+            #отметка берется до чтения страницы, так что изменения во время чтения не потеряются
+            watermark = self.current_change_id()
+            return watermark, self.fetch_page(**page)
+        return None, self.fetch_page(**page)
+
+    def _apply_next(self, result):
+        watermark, rows = result
+        if watermark is not None:
+            self._watermark = watermark
+        for row in rows:
+            self._insert(row)
+        if len(rows) < self.page_size:
+            self._at_end = True
+        children = self.tree.get_children()
+        overflow = len(children) - self.max_rows
+        if overflow > 0:
+            top = float(self.tree.yview()[0]) * len(children)
+            self._delete(children[:overflow])
+            self._has_before = True
+            #видимые строки остаются на месте после удаления верхних
+            self.tree.yview_moveto(max(top - overflow, 0) / self.max_rows)
+
+    def _load_previous(self):
+        if not self._has_before or self._busy:
+            return
+        children = self.tree.get_children()
+        if not children:
+            self._has_before = False
+            return
+        first = children[0]
+        self._request({'before': self._keys[first]}, lambda result: self._apply_previous(result[1], first))
+
+    def _apply_previous(self, rows, first):
+        for row in rows:
+            self._insert(row, 0)
+        if len(rows) < self.page_size:
+            self._has_before = False
+        children = self.tree.get_children()
+        overflow = len(children) - self.max_rows
+        if overflow > 0:
+            self._delete(children[-overflow:])
+            self._at_end = False
+        #прежняя первая строка остается на месте, а не прыгает вниз
+        if self.tree.exists(first):
+            self.tree.yview_moveto(self.tree.index(first) / max(len(self.tree.get_children()), 1))
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._pending is not None or self._busy:
+            return
+        if float(last) >= 0.9 and not self._at_end:
+            self._pending = self.after_idle(self._run_pending, self._load_next)
+        elif float(first) <= 0.1 and self._has_before:
+            self._pending = self.after_idle(self._run_pending, self._load_previous)
+
+    def _run_pending(self, load):
+        self._pending = None
+        try:
+            load()
+        except tk.TclError:
+            #окно закрыто во время подгрузки
+            pass
+        except sqlite3.Error as e:
+            print(f"Ошибка подгрузки строк: {str(e)}")
+
+
+class _Descending:
+    """Обертка, обращающая порядок сравнения ключа"""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return other.key > self.key
+
+    def __eq__(self, other):
+        return self.key == other.key